@@ -0,0 +1,165 @@
+import glob
+import hashlib
+import os
+import random
+import threading
+import xml.etree.ElementTree as ET
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, List, Optional
+from urllib.parse import parse_qs, urlparse
+from xml.sax.saxutils import escape
+
+ATOM_NS = "http://www.w3.org/2005/Atom"
+
+FEED_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom" xmlns:opensearch="http://a9.com/-/spec/opensearch/1.1/" xmlns:arxiv="http://arxiv.org/schemas/atom">
+  <title type="html">ArXiv Query: load test</title>
+  <id>http://arxiv.org/api/loadtest</id>
+  <updated>{updated}</updated>
+  <opensearch:totalResults>{total}</opensearch:totalResults>
+  <opensearch:startIndex>{start}</opensearch:startIndex>
+  <opensearch:itemsPerPage>{count}</opensearch:itemsPerPage>
+{entries}
+</feed>
+"""
+
+ENTRY_TEMPLATE = """  <entry>
+    <id>http://arxiv.org/abs/{arxiv_id}v1</id>
+    <updated>{date}</updated>
+    <published>{date}</published>
+    <title>{title}</title>
+    <summary>{abstract}</summary>
+    <author><name>Load Test</name></author>
+    <link href="http://arxiv.org/abs/{arxiv_id}v1" rel="alternate" type="text/html"/>
+    <link title="pdf" href="{base_url}/pdf/{arxiv_id}v1" rel="related" type="application/pdf"/>
+    <arxiv:primary_category xmlns:arxiv="http://arxiv.org/schemas/atom" term="cs.LG" scheme="http://arxiv.org/schemas/atom"/>
+    <category term="cs.LG" scheme="http://arxiv.org/schemas/atom"/>
+  </entry>"""
+
+TOPICS = [
+    "recommendation systems",
+    "real-time ad bidding",
+    "evidential deep learning",
+    "uncertainty estimation",
+    "retrieval augmented generation",
+    "graph neural networks",
+    "reinforcement learning from feedback",
+    "sparse mixture of experts",
+]
+
+
+class FakeArxivServer(ThreadingHTTPServer):
+    """Serves a synthetic or recorded arXiv Atom feed and the matching PDFs."""
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        num_papers: int = 10,
+        pdf_folder: str = "scripts/prompts/review/few_shot",
+        feed_file: Optional[str] = None,
+        port: int = 0,
+        seed: int = 0,
+    ):
+        super().__init__(("127.0.0.1", port), FakeArxivHandler)
+        self.pdfs = [
+            open(path, "rb").read()
+            for path in sorted(glob.glob(os.path.join(pdf_folder, "*.pdf")))
+        ]
+        if feed_file:
+            self.entries = load_recorded_entries(feed_file)
+        else:
+            self.entries = synthetic_entries(num_papers, self.base_url, seed)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    @property
+    def api_url(self) -> str:
+        return f"{self.base_url}/api/query"
+
+
+def synthetic_entries(num_papers: int, base_url: str, seed: int) -> List[str]:
+    rng = random.Random(seed)
+    date = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    entries = []
+    for i in range(num_papers):
+        topic, other = rng.sample(TOPICS, 2)
+        entries.append(
+            ENTRY_TEMPLATE.format(
+                arxiv_id=f"9901.{i:05d}",
+                date=date,
+                title=escape(f"Synthetic Paper {i:05d} on {topic.title()}"),
+                abstract=escape(
+                    f"We study {topic} and its interaction with {other}. "
+                    f"Experiments on synthetic benchmark {i} show consistent gains."
+                ),
+                base_url=base_url,
+            )
+        )
+    return entries
+
+
+def load_recorded_entries(feed_file: str) -> List[str]:
+    """Read the <entry> elements of a feed previously saved from the arXiv API."""
+    ET.register_namespace("", ATOM_NS)
+    ET.register_namespace("arxiv", "http://arxiv.org/schemas/atom")
+    root = ET.parse(feed_file).getroot()
+    return [
+        ET.tostring(entry, encoding="unicode")
+        for entry in root.findall(f"{{{ATOM_NS}}}entry")
+    ]
+
+
+class FakeArxivHandler(BaseHTTPRequestHandler):
+    server: FakeArxivServer
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        if url.path == "/api/query":
+            params = parse_qs(url.query)
+            start = int(params.get("start", ["0"])[0])
+            count = int(params.get("max_results", ["10"])[0])
+            entries = self.server.entries[start : start + count]
+            etag = hashlib.sha1("\n".join(entries).encode("utf-8")).hexdigest()
+            body = FEED_TEMPLATE.format(
+                updated=datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+                total=len(self.server.entries),
+                start=start,
+                count=len(entries),
+                entries="\n".join(entries),
+            ).encode("utf-8")
+            content_type = "application/atom+xml"
+        elif url.path.startswith("/pdf/") and self.server.pdfs:
+            index = sum(map(ord, url.path)) % len(self.server.pdfs)
+            body = self.server.pdfs[index]
+            etag = hashlib.sha1(body).hexdigest()
+            content_type = "application/pdf"
+        else:
+            self.send_error(404)
+            return
+
+        # Conditional requests for unchanged pages and PDFs get no body
+        etag = f'"{etag}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_fake_arxiv(**options: Any) -> FakeArxivServer:
+    server = FakeArxivServer(**options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,262 @@
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+# Silent MPEG-1 Layer III frame: 128 kbps, 44.1 kHz, mono, 26.1 ms of audio
+SILENT_MP3_FRAME = bytes([0xFF, 0xFB, 0x90, 0xC0]) + bytes(413)
+MP3_FRAME_SECONDS = 1152 / 44100
+SPOKEN_CHARS_PER_SECOND = 15
+
+REVIEW_JSON = {
+    "Summary": "The paper studies a synthetic problem generated by the load test.",
+    "Strengths": ["Clear problem statement", "Extensive experiments"],
+    "Weaknesses": ["Limited baselines"],
+    "Originality": 3,
+    "Quality": 3,
+    "Clarity": 3,
+    "Significance": 2,
+    "Questions": ["How does the method scale?"],
+    "Limitations": ["Synthetic evaluation only"],
+    "Ethical Concerns": False,
+    "Soundness": 3,
+    "Presentation": 3,
+    "Contribution": 2,
+    "Overall": 5,
+    "Confidence": 3,
+    "Decision": "Reject",
+}
+
+WORDS = (
+    "model training data results method approach performance evaluation "
+    "benchmark accuracy latency retrieval ranking attention transformer "
+    "uncertainty estimation recommendation signal learning objective"
+).split()
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self, amount: float = 1.0) -> Optional[float]:
+        """Take `amount` tokens, or return the seconds until they would be available."""
+        with self.lock:
+            now = time.monotonic()
+            rate = self.capacity / 60
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * rate)
+            self.updated = now
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return None
+            return (amount - self.tokens) / rate
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    """Local stand-in for the OpenAI chat completions and speech endpoints."""
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        port: int = 0,
+        latency_ms: float = 50.0,
+        jitter_ms: float = 25.0,
+        rpm: Optional[float] = None,
+        tpm: Optional[float] = None,
+        error_rate: float = 0.0,
+        malformed_rate: float = 0.0,
+        reply_words: int = 120,
+        seed: int = 0,
+    ):
+        super().__init__(("127.0.0.1", port), FakeOpenAIHandler)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.request_bucket = TokenBucket(rpm) if rpm else None
+        self.token_bucket = TokenBucket(tpm) if tpm else None
+        self.error_rate = error_rate
+        # Share of review answers whose JSON is cut off
+        self.malformed_rate = malformed_rate
+        self.reply_words = reply_words
+        self.random = random.Random(seed)
+        self.log: List[Dict[str, Any]] = []
+        self.log_lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+    def record(self, endpoint: str, start: float, status: int, tokens: int) -> None:
+        with self.log_lock:
+            self.log.append(
+                {
+                    "endpoint": endpoint,
+                    "start": start,
+                    "end": time.time(),
+                    "status": status,
+                    "tokens": tokens,
+                }
+            )
+
+    def rate_limit_delay(self, tokens: int) -> Optional[float]:
+        """Seconds the caller must wait, or None when the request may proceed."""
+        if self.error_rate and self.random.random() < self.error_rate:
+            return 1.0
+        for bucket, amount in [(self.request_bucket, 1), (self.token_bucket, tokens)]:
+            if bucket is not None:
+                wait = bucket.take(amount)
+                if wait is not None:
+                    return wait
+        return None
+
+    def sleep_latency(self) -> None:
+        jitter = self.random.uniform(-self.jitter_ms, self.jitter_ms)
+        time.sleep(max(0.0, self.latency_ms + jitter) / 1000)
+
+    def completion_text(
+        self,
+        messages: List[Dict[str, Any]],
+        response_format: Optional[Dict[str, Any]] = None,
+    ) -> str:
+        prompt = json.dumps(messages)
+        if "REVIEW JSON" in prompt or "```json" in prompt:
+            thought = "The synthetic paper is adequate but limited."
+            if (response_format or {}).get("type") == "json_schema":
+                text = json.dumps({"thought": thought, "review": REVIEW_JSON})
+            else:
+                text = (
+                    f"THOUGHT:\n{thought}\n\n"
+                    f"REVIEW JSON:\n```json\n{json.dumps(REVIEW_JSON, indent=2)}\n```"
+                )
+            with self.log_lock:
+                malformed = self.random.random() < self.malformed_rate
+            return text[: len(text) // 2] if malformed else text
+        paragraphs = []
+        for _ in range(3):
+            words = self.random.choices(WORDS, k=self.reply_words // 3)
+            paragraphs.append(" ".join(words).capitalize() + ".")
+        return "\n\n".join(paragraphs)
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    server: FakeOpenAIServer
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+    def send_json(
+        self, status: int, payload: Dict[str, Any], headers: Dict[str, str] = {}
+    ) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self) -> None:
+        start = time.time()
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        tokens = length // 4
+        endpoint = self.path.split("?")[0]
+
+        wait = self.server.rate_limit_delay(tokens)
+        if wait is not None:
+            self.send_json(
+                429,
+                {"error": {"message": "Rate limit reached", "type": "requests"}},
+                {"retry-after": f"{wait:.2f}"},
+            )
+            self.server.record(endpoint, start, 429, tokens)
+            return
+
+        self.server.sleep_latency()
+        if endpoint.endswith("/chat/completions"):
+            self.chat_completion(body, tokens)
+        elif endpoint.endswith("/audio/speech"):
+            self.speech(body)
+        else:
+            self.send_json(404, {"error": {"message": f"Unknown endpoint {endpoint}"}})
+        self.server.record(endpoint, start, 200, tokens)
+
+    def chat_completion(self, body: Dict[str, Any], prompt_tokens: int) -> None:
+        texts = [
+            self.server.completion_text(
+                body.get("messages", []), body.get("response_format")
+            )
+            for _ in range(body.get("n") or 1)
+        ]
+        completion_id = f"chatcmpl-{int(time.time() * 1000)}"
+
+        if body.get("stream"):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for piece in texts[0].split(" "):
+                chunk = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": body.get("model"),
+                    "choices": [
+                        {
+                            "index": 0,
+                            "delta": {"content": piece + " "},
+                            "finish_reason": None,
+                        }
+                    ],
+                }
+                self.write_chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.write_chunk(b"data: [DONE]\n\n")
+            self.write_chunk(b"")
+            return
+
+        self.send_json(
+            200,
+            {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model"),
+                "choices": [
+                    {
+                        "index": i,
+                        "message": {"role": "assistant", "content": text},
+                        "finish_reason": "stop",
+                    }
+                    for i, text in enumerate(texts)
+                ],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": sum(len(t) // 4 for t in texts),
+                    "total_tokens": prompt_tokens + sum(len(t) // 4 for t in texts),
+                },
+            },
+        )
+
+    def write_chunk(self, data: bytes) -> None:
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+
+    def speech(self, body: Dict[str, Any]) -> None:
+        seconds = len(body.get("input", "")) / SPOKEN_CHARS_PER_SECOND
+        audio = SILENT_MP3_FRAME * max(1, int(seconds / MP3_FRAME_SECONDS))
+        self.send_response(200)
+        self.send_header("Content-Type", "audio/mpeg")
+        self.send_header("Content-Length", str(len(audio)))
+        self.end_headers()
+        self.wfile.write(audio)
+
+
+def start_fake_openai(**options: Any) -> FakeOpenAIServer:
+    server = FakeOpenAIServer(**options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
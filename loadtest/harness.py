@@ -0,0 +1,319 @@
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import statistics
+import tempfile
+import time
+import tracemalloc
+from configparser import ConfigParser
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from loadtest.fake_arxiv import start_fake_arxiv
+from loadtest.fake_openai import start_fake_openai
+from scripts.benchmark import peak_rss_mb
+from utils.utils import resolve_config
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+DEFAULT_STEPS = "arxiv_search, select_papers, summarize_papers, perform_review, podcast"
+
+
+def build_config(
+    workspace: str,
+    num_papers: int,
+    steps: str,
+    arxiv_api_url: str,
+    rpm: Optional[float] = None,
+    tpm: Optional[float] = None,
+) -> ConfigParser:
+    """Point every step of the real config at the workspace and local stand-ins."""
+    config = resolve_config()
+    # The gateway holds calls to the stand-in's limits (none by default),
+    # not to the production quotas, so the run measures the pipeline
+    limits = f"{'' if rpm is None else rpm}, {'' if tpm is None else tpm}"
+    gateway = {
+        model: limits
+        for model in config.options("llm_gateway")
+        if model not in ("lanes", "max_tokens_per_call")
+    }
+    key_location = os.path.join(workspace, "key_openai.txt")
+    with open(key_location, "w") as f:
+        f.write("sk-loadtest")
+
+    overrides = {
+        "pipeline": {"steps": steps},
+        "arxiv_search": {
+            "api_url": arxiv_api_url,
+            "request_delay_seconds": "0",
+            "max_results": str(num_papers),
+            "output_dir": os.path.join(workspace, "pdfs"),
+        },
+        "select_papers": {
+            "number_of_papers_to_summarize": str(num_papers),
+            "input_file": os.path.join(workspace, "pdfs", "papers_found.csv"),
+            "output_dir": os.path.join(workspace, "pdfs-to-summarize"),
+            "queries": "query1",
+            "query1": "synthetic paper",
+            "pdf_cache": os.path.join(workspace, "pdf-cache"),
+        },
+        "queue": {"text_folder": os.path.join(workspace, "extracted-text")},
+        "http_cache": {"folder": os.path.join(workspace, "http-cache")},
+        "llm_gateway": gateway,
+        "summarize_papers": {
+            # The synthetic papers are copies of a few PDFs, so cached
+            # summaries would flatter the summarize throughput
+            "summary_cache": "false",
+            "input_folder": os.path.join(workspace, "pdfs-to-summarize"),
+            "output_folder": os.path.join(workspace, "txt-summaries"),
+            "csv_path": os.path.join(
+                workspace, "pdfs-to-summarize", "papers_to_summarize.csv"
+            ),
+        },
+        "podcast": {
+            "newsletter_text_location": os.path.join(
+                workspace, "txt-summaries", "newsletter.md"
+            ),
+            "audio_files_directory_path": os.path.join(workspace, "audio_files"),
+        },
+        "review": {
+            "input_folder": os.path.join(workspace, "pdfs-to-summarize"),
+            "output_folder": os.path.join(workspace, "reviews"),
+            "prompt_bundle_dir": os.path.join(workspace, "review_prompt_bundle"),
+        },
+        "cleanup": {"send_to_obsidian": "false"},
+        "Obsidian": {"send_to_obsidian": "false"},
+        "openai": {"api_key_location": key_location},
+        "weaviate": {"backend": "memory"},
+        "state": {"db_path": os.path.join(workspace, "state", "papers.db")},
+    }
+    for section, values in overrides.items():
+        if not config.has_section(section):
+            config.add_section(section)
+        for key, value in values.items():
+            config.set(section, key, value)
+    return config
+
+
+class StageRecorder:
+    """Times one pipeline step and records its memory use and any failure."""
+
+    def __init__(self, stages: Dict[str, Dict[str, Any]], step: str, trace: bool):
+        self.stages = stages
+        self.step = step
+        self.trace = trace
+
+    def __enter__(self) -> "StageRecorder":
+        if self.trace:
+            tracemalloc.reset_peak()
+        self.peak_before = peak_rss_mb()
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type: Any, exc: Any, tb: Any) -> bool:
+        end = time.time()
+        self.stages[self.step] = {
+            "start": self.start,
+            "end": end,
+            "seconds": end - self.start,
+            # The high-water mark is process-wide; the growth is what this
+            # stage added to it
+            "process_peak_rss_mb": peak_rss_mb(),
+            "peak_rss_growth_mb": peak_rss_mb() - self.peak_before,
+            "traced_peak_mb": (
+                tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+                if self.trace
+                else None
+            ),
+            "error": repr(exc) if exc is not None else None,
+        }
+        if exc is not None:
+            print(f"Stage {self.step} failed: {exc!r}")
+        # Keep going so the later stages are still measured
+        return True
+
+
+def run_pipeline(
+    config_sections: Dict[str, Dict[str, str]],
+    openai_base_url: str,
+    trace_memory: bool,
+    results: Any,
+) -> None:
+    """Child-process entry point: run `main.main` once against the stand-ins."""
+    os.environ["OPENAI_BASE_URL"] = openai_base_url
+    os.chdir(project_root)
+
+    import main
+    from utils.llm_gateway import configure_gateway
+
+    config = ConfigParser()
+    config.read_dict(config_sections)
+    configure_gateway(config)
+    stages: Dict[str, Dict[str, Any]] = {}
+    if trace_memory:
+        tracemalloc.start()
+    main.main(
+        config, profile_step=lambda step: StageRecorder(stages, step, trace_memory)
+    )
+    results.put(stages)
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def summarize_stage(
+    stage: Dict[str, Any], num_papers: int, requests_log: List[Dict[str, Any]]
+) -> Dict[str, Any]:
+    in_stage = [r for r in requests_log if stage["start"] <= r["start"] <= stage["end"]]
+    latencies = [r["end"] - r["start"] for r in in_stage if r["status"] == 200]
+    return {
+        "seconds": stage["seconds"],
+        "papers_per_second": (
+            num_papers / stage["seconds"] if stage["seconds"] else None
+        ),
+        "requests": len(in_stage),
+        "rate_limited": sum(1 for r in in_stage if r["status"] == 429),
+        "latency_p50": percentile(latencies, 0.50),
+        "latency_p95": percentile(latencies, 0.95),
+        "latency_p99": percentile(latencies, 0.99),
+        "latency_mean": statistics.mean(latencies) if latencies else None,
+        "process_peak_rss_mb": stage["process_peak_rss_mb"],
+        "peak_rss_growth_mb": stage["peak_rss_growth_mb"],
+        "traced_peak_mb": stage["traced_peak_mb"],
+        "error": stage["error"],
+    }
+
+
+def run_load_test(
+    sizes: List[int],
+    steps: str = DEFAULT_STEPS,
+    latency_ms: float = 50.0,
+    jitter_ms: float = 25.0,
+    rpm: Optional[float] = None,
+    tpm: Optional[float] = None,
+    error_rate: float = 0.0,
+    malformed_rate: float = 0.0,
+    feed_file: Optional[str] = None,
+    trace_memory: bool = False,
+) -> Dict[str, Any]:
+    report: Dict[str, Any] = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "steps": steps,
+        "openai": {
+            "latency_ms": latency_ms,
+            "jitter_ms": jitter_ms,
+            "rpm": rpm,
+            "tpm": tpm,
+            "error_rate": error_rate,
+            "malformed_rate": malformed_rate,
+        },
+        "runs": {},
+    }
+    context = multiprocessing.get_context("spawn")
+
+    for num_papers in sizes:
+        print(f"\n=== Load test with {num_papers} papers ===")
+        openai_server = start_fake_openai(
+            latency_ms=latency_ms,
+            jitter_ms=jitter_ms,
+            rpm=rpm,
+            tpm=tpm,
+            error_rate=error_rate,
+            malformed_rate=malformed_rate,
+        )
+        arxiv_server = start_fake_arxiv(num_papers=num_papers, feed_file=feed_file)
+
+        with tempfile.TemporaryDirectory(prefix="loadtest-") as workspace:
+            config = build_config(
+                workspace, num_papers, steps, arxiv_server.api_url, rpm, tpm
+            )
+            sections = {s: dict(config.items(s, raw=True)) for s in config.sections()}
+            results = context.Queue()
+            process = context.Process(
+                target=run_pipeline,
+                args=(sections, openai_server.base_url, trace_memory, results),
+            )
+            process.start()
+            process.join()
+            try:
+                stages = results.get(timeout=5)
+            except queue.Empty:
+                print(f"Pipeline process exited with code {process.exitcode}")
+                stages = {}
+
+        openai_server.shutdown()
+        arxiv_server.shutdown()
+        report["runs"][str(num_papers)] = {
+            step: summarize_stage(stage, num_papers, openai_server.log)
+            for step, stage in stages.items()
+        }
+
+    return report
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    def fmt(value: Optional[float], spec: str) -> str:
+        return "-" if value is None else format(value, spec)
+
+    print(
+        f"\n{'papers':>6} {'stage':<18} {'secs':>8} {'papers/s':>9} {'reqs':>6} "
+        f"{'429s':>5} {'p50 s':>7} {'p95 s':>7} {'p99 s':>7} {'peak MB':>8} {'+MB':>6}"
+    )
+    for num_papers, stages in report["runs"].items():
+        for step, s in stages.items():
+            print(
+                f"{num_papers:>6} {step:<18} {s['seconds']:>8.2f} "
+                f"{fmt(s['papers_per_second'], '.2f'):>9} {s['requests']:>6} "
+                f"{s['rate_limited']:>5} {fmt(s['latency_p50'], '.3f'):>7} "
+                f"{fmt(s['latency_p95'], '.3f'):>7} {fmt(s['latency_p99'], '.3f'):>7} "
+                f"{s['process_peak_rss_mb']:>8.0f} {s['peak_rss_growth_mb']:>6.0f}"
+                + (f"  FAILED: {s['error']}" if s["error"] else "")
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Offline end-to-end load test against local service stand-ins"
+    )
+    parser.add_argument("--sizes", default="10,100,1000")
+    parser.add_argument("--steps", default=DEFAULT_STEPS)
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    parser.add_argument("--jitter-ms", type=float, default=25.0)
+    parser.add_argument("--rpm", type=float, help="requests per minute before 429s")
+    parser.add_argument("--tpm", type=float, help="tokens per minute before 429s")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="random 429 rate")
+    parser.add_argument(
+        "--malformed-rate", type=float, default=0.0, help="cut-off review JSON rate"
+    )
+    parser.add_argument("--feed-file", help="recorded arXiv Atom feed to replay")
+    parser.add_argument("--trace-memory", action="store_true")
+    parser.add_argument("--output", default="data/loadtest_results")
+    args = parser.parse_args()
+
+    report = run_load_test(
+        [int(size) for size in args.sizes.split(",")],
+        steps=args.steps,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        rpm=args.rpm,
+        tpm=args.tpm,
+        error_rate=args.error_rate,
+        malformed_rate=args.malformed_rate,
+        feed_file=args.feed_file,
+        trace_memory=args.trace_memory,
+    )
+    print_report(report)
+
+    os.makedirs(args.output, exist_ok=True)
+    output_path = os.path.join(
+        args.output, f"loadtest_{datetime.now():%Y-%m-%d_%H%M%S}.json"
+    )
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nSaved results to {output_path}")
@@ -1,5 +1,11 @@
+import argparse
+import itertools
 import sys
-from utils.utils import resolve_config
+from configparser import ConfigParser
+from contextlib import nullcontext
+from typing import Callable, ContextManager, Dict, List, Optional
+from utils.profiles import profile_config, profile_names, shared_steps
+from utils.utils import pipeline_steps, resolve_config
 import importlib
 import pkgutil
 import scripts
@@ -22,28 +28,86 @@ def load_pipeline_steps():
     return step_functions
 
 
-def main():
-    config = resolve_config()
-    pipeline_steps = [
-        step.strip() for step in config.get("pipeline", "steps").split(",")
-    ]
-
-    step_functions = load_pipeline_steps()
-    print("Pipeline steps Loaded:", pipeline_steps)
-
-    for step in pipeline_steps:
+def execute_steps(
+    config: ConfigParser,
+    steps: List[str],
+    step_functions: Dict[str, Callable[..., None]],
+    profile_step: Optional[Callable[[str], ContextManager]] = None,
+) -> None:
+    for step in steps:
         print(f"Executing step: {step}")
         if step in step_functions:
-            step_functions[step](config=config)
+            with profile_step(step) if profile_step else nullcontext():
+                step_functions[step](config=config)
         else:
             print(f"Warning: Unknown pipeline step '{step}'")
 
+
+def run_steps(
+    config: ConfigParser,
+    steps: List[str],
+    step_functions: Dict[str, Callable[..., None]],
+    profile_step: Optional[Callable[[str], ContextManager]] = None,
+) -> None:
+    """Run `steps` in order; with [profiles], shared steps run once and each
+    stretch of the other steps runs once per profile."""
+    profiles = profile_names(config)
+    if not profiles:
+        execute_steps(config, steps, step_functions, profile_step)
+        return
+    shared = shared_steps(config)
+    for is_shared, group in itertools.groupby(steps, key=lambda step: step in shared):
+        group_steps = list(group)
+        if is_shared:
+            execute_steps(config, group_steps, step_functions, profile_step)
+            continue
+        for name in profiles:
+            print(f"Running {', '.join(group_steps)} for profile {name}")
+            execute_steps(
+                profile_config(config, name), group_steps, step_functions, profile_step
+            )
+
+
+def main(
+    config: Optional[ConfigParser] = None,
+    profile_step: Optional[Callable[[str], ContextManager]] = None,
+) -> None:
+    config = config or resolve_config()
+    steps = pipeline_steps(config)
+
+    step_functions = load_pipeline_steps()
+    print("Pipeline steps Loaded:", steps)
+
+    run_steps(config, steps, step_functions, profile_step)
+
     print("Pipeline execution completed.")
 
 
+def daemon(config: Optional[ConfigParser] = None) -> None:
+    """Keep running: poll arXiv and process new papers with warm resources."""
+    from utils.daemon import run_daemon
+
+    config = config or resolve_config()
+    step_functions = load_pipeline_steps()
+    print("Pipeline steps Loaded:", pipeline_steps(config))
+    run_daemon(
+        config,
+        lambda steps, profile_step: run_steps(
+            config, steps, step_functions, profile_step
+        ),
+    )
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the paper pipeline")
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="keep running, polling arXiv on the [daemon] schedule",
+    )
+    args = parser.parse_args()
     try:
-        main()
+        daemon() if args.daemon else main()
     except Exception as e:
         print(f"An error occurred during pipeline execution: {e}")
         sys.exit(1)
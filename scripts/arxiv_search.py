@@ -2,14 +2,74 @@ import configparser
 import arxiv
 import os
 import csv
-from datetime import datetime, timedelta, timezone
-from typing import List, Dict, Any
-from utils.weaviate_client import get_or_create_class
+import feedparser
+from datetime import date, datetime, timedelta, timezone
+from typing import List, Dict, Any, Optional, Tuple
+from utils.weaviate_client import (
+    get_or_create_class,
+    get_weaviate_client,
+    release_client,
+)
+from utils.paper_store import get_paper_store
+from utils.minhash import dedupe_enabled, get_duplicate_index
+from utils.query_cache import bump_collection_version
+from utils.http_cache import (
+    CachedSession,
+    HTTPCache,
+    OfflineCacheMiss,
+    get_http_cache,
+    http_cache_enabled,
+)
 from weaviate.util import generate_uuid5
-from utils.utils import resolve_config
-from weaviate import connect_to_local
 import backoff
 
+# With [http_cache] enabled the search window is split into one query per
+# day that arXiv has finished announcing plus one query for the recent days.
+# Successive runs search overlapping windows, and a settled day's query is
+# the same URL every time, so it is answered from the cache without a
+# request (or the rate-limit delay) for as long as settled_ttl_seconds.
+# Only the recent days' query goes back to arXiv once ttl_seconds pass.
+
+# Days after which arXiv has announced everything submitted on a day
+SETTLED_DAYS = 4
+
+
+class CachedArxivClient(arxiv.Client):
+    """An arXiv client that reads feed pages through an `HTTPCache` and only
+    waits out the request delay before pages it has to request."""
+
+    def __init__(self, cache: HTTPCache, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.cache = cache
+        self._session = CachedSession(cache)
+        self.ttl: Optional[float] = None
+
+    def _parse_feed(
+        self, url: str, first_page: bool = True, _try_index: int = 0
+    ) -> feedparser.FeedParserDict:
+        body = self.cache.fresh_body(url, self.ttl)
+        if body is not None:
+            return feedparser.parse(body)
+        self._session.ttl = self.ttl
+        return super()._parse_feed(url, first_page, _try_index)
+
+
+def search_windows(
+    start_date: date, end_date: date, settled_ttl: Optional[float]
+) -> List[Tuple[date, date, Optional[float]]]:
+    """The (start, end, cache TTL) windows to search, newest first."""
+    settled_end = min(end_date, datetime.now().date() - timedelta(days=SETTLED_DAYS))
+    windows = []
+    if settled_end < end_date:
+        windows.append(
+            (max(start_date, settled_end + timedelta(days=1)), end_date, None)
+        )
+    day = settled_end
+    while day >= start_date:
+        windows.append((day, day, settled_ttl))
+        day -= timedelta(days=1)
+    return windows
+
 
 @backoff.on_exception(backoff.expo, (arxiv.ArxivError,))
 def fetch_arxiv_results(
@@ -25,13 +85,18 @@ def search_papers(config: configparser.ConfigParser) -> None:
     output_dir: str = arxiv_config.get("output_dir")
     os.makedirs(output_dir, exist_ok=True)
 
+    store = get_paper_store(config)
+    checkpoint: Optional[str] = store.get_meta("most_recent_day_searched")
+    # Older runs kept the checkpoint in a text file next to the output folder
     checkpoint_file: str = os.path.join(
         os.path.dirname(output_dir), "most_recent_day_searched.txt"
     )
-
-    if os.path.exists(checkpoint_file):
+    if checkpoint is None and os.path.exists(checkpoint_file):
         with open(checkpoint_file, "r") as f:
-            most_recent_day_searched = datetime.strptime(f.read().strip(), "%Y-%m-%d")
+            checkpoint = f.read().strip()
+
+    if checkpoint:
+        most_recent_day_searched = datetime.strptime(checkpoint, "%Y-%m-%d")
     else:
         most_recent_day_searched = datetime.now() - timedelta(
             days=arxiv_config.getint("date_range")
@@ -41,27 +106,59 @@ def search_papers(config: configparser.ConfigParser) -> None:
     end_date = datetime.now().date()
     start_date = (most_recent_day_searched - timedelta(days=date_range)).date()
 
-    query: str = (
-        f"({arxiv_config.get('categories')}) AND submittedDate:[{start_date:%Y%m%d}000000 TO {end_date:%Y%m%d}235959]"
-    )
-
-    client: arxiv.Client = arxiv.Client(
-        page_size=arxiv_config.getint("max_results"), delay_seconds=5.0, num_retries=3
-    )
-    search: arxiv.Search = arxiv.Search(
-        query=query,
-        max_results=arxiv_config.getint("max_results"),
-        sort_by=arxiv.SortCriterion.SubmittedDate,
-        sort_order=arxiv.SortOrder.Descending,
-    )
-
-    papers: List[Dict[str, Any]] = []
-
-    try:
-        results = fetch_arxiv_results(search, client)
-    except Exception as e:
-        print(f"Failed to fetch results from arXiv: {e}")
-        return
+    max_results = arxiv_config.getint("max_results")
+    client_options = {
+        "page_size": max_results,
+        "delay_seconds": arxiv_config.getfloat("request_delay_seconds", 5.0),
+        "num_retries": 3,
+    }
+    if http_cache_enabled(config):
+        client: arxiv.Client = CachedArxivClient(
+            get_http_cache(config), **client_options
+        )
+        windows = search_windows(
+            start_date,
+            end_date,
+            config.getfloat("http_cache", "settled_ttl_seconds", fallback=2592000),
+        )
+    else:
+        client = arxiv.Client(**client_options)
+        windows = [(start_date, end_date, None)]
+    if arxiv_config.get("api_url"):
+        client.query_url_format = arxiv_config.get("api_url") + "?{}"
+
+    results: List[arxiv.Result] = []
+    seen = set()
+    for window_start, window_end, ttl in windows:
+        if len(results) >= max_results:
+            break
+        query: str = (
+            f"({arxiv_config.get('categories')}) AND submittedDate:[{window_start:%Y%m%d}000000 TO {window_end:%Y%m%d}235959]"
+        )
+        search: arxiv.Search = arxiv.Search(
+            query=query,
+            max_results=max_results - len(results),
+            sort_by=arxiv.SortCriterion.SubmittedDate,
+            sort_order=arxiv.SortOrder.Descending,
+        )
+        if isinstance(client, CachedArxivClient):
+            client.ttl = ttl
+        try:
+            found = fetch_arxiv_results(search, client)
+        except OfflineCacheMiss:
+            print(
+                f"No cached arXiv results for {window_start} to {window_end}; skipping them offline"
+            )
+            continue
+        except Exception as e:
+            print(f"Failed to fetch results from arXiv: {e}")
+            return
+        for result in found:
+            if result.entry_id not in seen:
+                seen.add(result.entry_id)
+                results.append(result)
+    if isinstance(client, CachedArxivClient):
+        print(f"arXiv feed pages: {client.cache.summary()}")
 
     papers = []
     for result in results:
@@ -86,30 +183,28 @@ def search_papers(config: configparser.ConfigParser) -> None:
             most_recent_day_searched = result.published
 
     # Add papers to Weaviate in batch
-    config = resolve_config()
-    weaviate_config = config["weaviate"]
-
-    client = connect_to_local(
-        port=weaviate_config["port"], grpc_port=weaviate_config["grpc_port"]
-    )
-    paper_class = get_or_create_class(
-        client, config["weaviate"].get("papers_class_name")
-    )
+    client = get_weaviate_client(weaviate_config)
+    paper_class = get_or_create_class(client, weaviate_config.get("papers_class_name"))
+    added = 0
     with paper_class.batch.dynamic() as batch:
         for paper in papers:
             obj_uuid = generate_uuid5(paper["arxiv_id"])
             if not paper_class.data.exists(obj_uuid):
                 batch.add_object(properties=paper, uuid=obj_uuid)
+                added += 1
             else:
                 print(
                     f"Paper with ID {paper['arxiv_id']} already exists. Skipping insertion."
                 )
 
+    if added:
+        # Cached select_papers searches no longer reflect the collection
+        bump_collection_version(store, weaviate_config.get("papers_class_name"))
     print("failed_objects")
     print(paper_class.batch.failed_objects)
     print("total_count")
     print(paper_class.aggregate.over_all(total_count=True))
-    client.close()
+    release_client(client)
 
     if papers:
         with open(
@@ -122,11 +217,33 @@ def search_papers(config: configparser.ConfigParser) -> None:
             writer.writerow(
                 ["ID", "Title", "ArXiv URL", "PDF URL", "Published Date", "Abstract"]
             )
-            writer.writerows([list(paper.values()) for paper in papers])
+            writer.writerows(
+                [
+                    [
+                        paper["arxiv_id"],
+                        paper["title"],
+                        paper["arxiv_url"],
+                        paper["pdf_url"],
+                        paper["published_date"],
+                        paper["abstract"],
+                    ]
+                    for paper in papers
+                ]
+            )
 
-        # Update the checkpoint file with the most recent date
-        with open(checkpoint_file, "w") as f:
-            f.write(most_recent_day_searched.strftime("%Y-%m-%d"))
+        index = get_duplicate_index(config) if dedupe_enabled(config) else None
+        duplicates = 0
+        for paper in papers:
+            paper_id = store.add_paper(paper, stage="found")
+            # Papers indexed on an earlier run were counted then
+            if index is not None and index.cluster_of(paper_id) is None:
+                cluster_id = index.add(paper_id, paper["title"], paper["abstract"])
+                duplicates += cluster_id != paper_id
+        if duplicates:
+            print(f"{duplicates} papers are near-duplicates of papers already found")
+        store.set_meta(
+            "most_recent_day_searched", most_recent_day_searched.strftime("%Y-%m-%d")
+        )
 
     print(f"Found {len(papers)} papers:")
     for paper in papers:
@@ -0,0 +1,353 @@
+import argparse
+import configparser
+import json
+import os
+import re
+import time
+import xml.etree.ElementTree as ET
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import date, datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Deque, Dict, Iterator, List, Optional, Set, Tuple
+from utils.paper_store import PaperStore, get_paper_store
+from utils.minhash import NearDuplicateIndex, dedupe_enabled, get_duplicate_index
+from utils.query_cache import bump_collection_version
+from utils.utils import resolve_config
+from utils.weaviate_client import connect_weaviate, get_or_create_class
+from weaviate.util import generate_uuid5
+
+# Bulk historical backfill from an arXiv metadata snapshot instead of the
+# rate-limited search API. Either dump format is read as a stream, so memory
+# stays flat however large the file is:
+#
+#   - Kaggle's arxiv-metadata-oai-snapshot.json, one JSON object per line
+#   - an OAI-PMH ListRecords response in the arXiv or arXivRaw format
+#
+# Papers are written in fixed-size batches by a pool of threads. The byte
+# offset after the last batch written (and every batch before it) is kept in
+# the paper store, so an interrupted backfill resumes where it stopped.
+#
+#     python -m scripts.backfill --dump data/arxiv-metadata-oai-snapshot.json
+
+READ_SIZE = 1024 * 1024
+# Times the objects Weaviate rejected from a batch are sent again
+WRITE_RETRIES = 2
+RECORD_START = re.compile(rb"<(?:[\w-]+:)?record[\s>]")
+
+
+def normalize_space(text: str) -> str:
+    return " ".join(text.split())
+
+
+def configured_categories(config: configparser.ConfigParser) -> Set[str]:
+    """The categories in the `cat:` terms of the arxiv_search query."""
+    return set(re.findall(r"cat:([\w.\-]+)", config.get("arxiv_search", "categories")))
+
+
+def parse_date(value: str) -> Optional[date]:
+    return date.fromisoformat(value) if value else None
+
+
+def to_utc(value: str) -> datetime:
+    """Submission time from an RFC 2822 version stamp or a YYYY-MM-DD date."""
+    try:
+        parsed = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
+
+
+def make_paper(
+    arxiv_id: str,
+    version: str,
+    title: str,
+    abstract: str,
+    published: datetime,
+) -> Dict[str, Any]:
+    # The same fields, and the same versioned id, as the arXiv search step
+    versioned_id = f"{arxiv_id}{version}"
+    return {
+        "arxiv_id": versioned_id,
+        "title": normalize_space(title),
+        "arxiv_url": f"http://arxiv.org/abs/{versioned_id}",
+        "pdf_url": f"http://arxiv.org/pdf/{versioned_id}",
+        "published_date": published.isoformat(),
+        "abstract": normalize_space(abstract),
+        "full_text": "",
+    }
+
+
+# JSON lines
+def paper_from_json(line: bytes) -> Optional[Tuple[Dict[str, Any], Set[str]]]:
+    record = json.loads(line)
+    versions = record.get("versions") or []
+    if versions:
+        published = to_utc(versions[0]["created"])
+        version = versions[-1]["version"]
+    else:
+        published = to_utc(record["update_date"])
+        version = ""
+    paper = make_paper(
+        record["id"], version, record["title"], record["abstract"], published
+    )
+    return paper, set(record.get("categories", "").split())
+
+
+def iter_json_records(
+    path: str, offset: int
+) -> Iterator[Tuple[Optional[Tuple[Dict[str, Any], Set[str]]], int]]:
+    """(paper and categories, offset after it) for each line from `offset`."""
+    with open(path, "rb") as f:
+        f.seek(offset)
+        for line in f:
+            offset += len(line)
+            if line.strip():
+                yield paper_from_json(line), offset
+
+
+# OAI-PMH XML
+def local_name(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+def child_text(element: ET.Element, name: str) -> str:
+    for child in element:
+        if local_name(child.tag) == name:
+            return child.text or ""
+    return ""
+
+
+def paper_from_oai(record: bytes) -> Optional[Tuple[Dict[str, Any], Set[str]]]:
+    root = ET.fromstring(record)
+    header = next((e for e in root if local_name(e.tag) == "header"), None)
+    if header is not None and header.get("status") == "deleted":
+        return None
+    metadata = next(
+        (
+            e
+            for element in root
+            if local_name(element.tag) == "metadata"
+            for e in element
+        ),
+        None,
+    )
+    if metadata is None:
+        return None
+    # arXivRaw lists every version with its date; arXiv has only `created`
+    versions = [e for e in metadata if local_name(e.tag) == "version"]
+    if versions:
+        published = to_utc(child_text(versions[0], "date"))
+        version = versions[-1].get("version", "")
+    else:
+        published = to_utc(child_text(metadata, "created"))
+        version = ""
+    paper = make_paper(
+        child_text(metadata, "id"),
+        version,
+        child_text(metadata, "title"),
+        child_text(metadata, "abstract"),
+        published,
+    )
+    return paper, set(child_text(metadata, "categories").split())
+
+
+def iter_oai_records(
+    path: str, offset: int
+) -> Iterator[Tuple[Optional[Tuple[Dict[str, Any], Set[str]]], int]]:
+    """(paper and categories, offset after it) for each <record> from `offset`.
+
+    Records are cut out of the raw bytes and parsed one at a time, so the
+    offsets are exact and only one read buffer is held."""
+    with open(path, "rb") as f:
+        f.seek(offset)
+        buffer, start = b"", offset
+        while True:
+            chunk = f.read(READ_SIZE)
+            buffer += chunk
+            position = 0
+            while True:
+                begin = RECORD_START.search(buffer, position)
+                if begin is None:
+                    # Only the last bytes can hold the start of a record tag
+                    position = max(position, len(buffer) - 64)
+                    break
+                prefix = buffer[begin.start() + 1 : begin.end() - 1]
+                end_tag = b"</" + prefix + b">"
+                end = buffer.find(end_tag, begin.end())
+                if end == -1:
+                    position = begin.start()
+                    break
+                position = end + len(end_tag)
+                yield paper_from_oai(buffer[begin.start() : position]), start + position
+            if not chunk:
+                return
+            # Keep only the unfinished record
+            buffer, start = buffer[position:], start + position
+
+
+def iter_records(
+    path: str, offset: int
+) -> Iterator[Tuple[Optional[Tuple[Dict[str, Any], Set[str]]], int]]:
+    with open(path, "rb") as f:
+        head = f.read(1024).lstrip()
+    if head.startswith(b"<"):
+        return iter_oai_records(path, offset)
+    return iter_json_records(path, offset)
+
+
+# Writing
+def write_batch(
+    papers: List[Dict[str, Any]],
+    paper_class: Any,
+    store: PaperStore,
+    index: Optional[NearDuplicateIndex] = None,
+) -> int:
+    from weaviate.classes.data import DataObject
+
+    # A batch import replaces objects that already exist, so batches that
+    # were written before an interruption can be written again. Only a
+    # batch in which every object failed raises, so the others are checked
+    # here: a paper must be in Weaviate before the store and the checkpoint
+    # move past it.
+    remaining = papers
+    for attempt in range(WRITE_RETRIES + 1):
+        result = paper_class.data.insert_many(
+            [
+                DataObject(properties=paper, uuid=generate_uuid5(paper["arxiv_id"]))
+                for paper in remaining
+            ]
+        )
+        if not result.has_errors:
+            break
+        if attempt == WRITE_RETRIES:
+            error = next(iter(result.errors.values()))
+            raise RuntimeError(
+                f"Weaviate rejected {len(result.errors)} of {len(remaining)} "
+                f"papers: {error.message}"
+            )
+        remaining = [remaining[i] for i in sorted(result.errors)]
+    paper_ids = store.add_papers(papers, stage="found")
+    if index is not None:
+        for paper_id, paper in zip(paper_ids, papers):
+            index.add(paper_id, paper["title"], paper["abstract"])
+    return len(papers)
+
+
+def backfill(
+    config: configparser.ConfigParser, dump_path: str, restart: bool = False
+) -> int:
+    """Load the dump's papers in the configured categories and date range;
+    returns how many were written."""
+    backfill_config = config["backfill"]
+    batch_size = backfill_config.getint("batch_size", 500)
+    workers = backfill_config.getint("workers", 4)
+    from_date = parse_date(backfill_config.get("from_date", ""))
+    until_date = parse_date(backfill_config.get("until_date", ""))
+    categories = configured_categories(config)
+
+    store = get_paper_store(config)
+    checkpoint_key = f"backfill_offset:{os.path.abspath(dump_path)}"
+    size = os.path.getsize(dump_path)
+    offset = 0 if restart else int(store.get_meta(checkpoint_key) or 0)
+    if offset >= size:
+        print(f"{dump_path} has already been backfilled")
+        return 0
+    if offset:
+        print(f"Resuming {dump_path} at byte {offset} of {size}")
+
+    weaviate_config = config["weaviate"]
+    client = connect_weaviate(weaviate_config)
+    paper_class = get_or_create_class(client, weaviate_config.get("papers_class_name"))
+    # Backfilled papers join the near-duplicate clusters like searched ones
+    index = get_duplicate_index(config) if dedupe_enabled(config) else None
+
+    # Batches in the order they were read, with the offset just after each
+    pending: Deque[Tuple[Future, int]] = deque()
+    scanned = written = 0
+    started = time.time()
+
+    def finish_oldest() -> int:
+        nonlocal written
+        future, end_offset = pending.popleft()
+        written += future.result()
+        # Every batch up to this one is written, so a resume can start here
+        store.set_meta(checkpoint_key, str(end_offset))
+        return end_offset
+
+    batch: List[Dict[str, Any]] = []
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            end_offset = offset
+            for parsed, end_offset in iter_records(dump_path, offset):
+                scanned += 1
+                if parsed is None:
+                    continue
+                paper, paper_categories = parsed
+                published = datetime.fromisoformat(paper["published_date"]).date()
+                if categories and not categories & paper_categories:
+                    continue
+                if from_date and published < from_date:
+                    continue
+                if until_date and published > until_date:
+                    continue
+                batch.append(paper)
+                if len(batch) < batch_size:
+                    continue
+                pending.append(
+                    (
+                        executor.submit(write_batch, batch, paper_class, store, index),
+                        end_offset,
+                    )
+                )
+                batch = []
+                # Bounded read-ahead: the reader waits for the writers
+                while len(pending) > workers * 2 or (pending and pending[0][0].done()):
+                    done_offset = finish_oldest()
+                    print(
+                        f"Backfill: {written} papers written, {scanned} records read "
+                        f"({100 * done_offset / size:.1f}%), "
+                        f"{written / (time.time() - started):.0f} papers/s"
+                    )
+            if batch:
+                pending.append(
+                    (
+                        executor.submit(write_batch, batch, paper_class, store, index),
+                        end_offset,
+                    )
+                )
+            while pending:
+                finish_oldest()
+            # Trailing records that were all filtered out
+            store.set_meta(checkpoint_key, str(end_offset))
+    finally:
+        if written:
+            # Cached select_papers searches no longer reflect the collection
+            bump_collection_version(store, weaviate_config.get("papers_class_name"))
+        client.close()
+
+    print(
+        f"Backfilled {written} of {scanned} records from {dump_path} "
+        f"in {time.time() - started:.1f}s"
+    )
+    return written
+
+
+def run(config: configparser.ConfigParser) -> None:
+    backfill(config, config.get("backfill", "dump_path"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Backfill papers from an arXiv metadata snapshot"
+    )
+    parser.add_argument("--dump", help="JSON lines or OAI-PMH XML metadata dump")
+    parser.add_argument(
+        "--restart", action="store_true", help="ignore the saved offset"
+    )
+    args = parser.parse_args()
+
+    config = resolve_config()
+    backfill(config, args.dump or config.get("backfill", "dump_path"), args.restart)
@@ -1,74 +1,383 @@
+import argparse
 import configparser
+import glob
+import importlib.util
+import json
+import multiprocessing
 import os
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
 import time
-from typing import Dict
-from utils.utils import delete_all_files_in_folder
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
 from utils.utils import (
-    extract_text_from_pdf,
     resolve_config,
+    make_folder_if_none,
     convert_pdfs_to_markdown_with_marker,
 )
+from utils.marker_service import marker_installed
+
+
+# Extraction backends
+def extract_with_pypdf2(pdf_path: str) -> str:
+    import PyPDF2
+
+    with open(pdf_path, "rb") as file:
+        reader = PyPDF2.PdfReader(file)
+        return "".join(page.extract_text() or "" for page in reader.pages)
+
+
+def extract_with_pypdf(pdf_path: str) -> str:
+    from pypdf import PdfReader
+
+    reader = PdfReader(pdf_path)
+    return "".join(page.extract_text() or "" for page in reader.pages)
+
+
+def extract_with_pymupdf(pdf_path: str) -> str:
+    import pymupdf
+
+    with pymupdf.open(pdf_path) as doc:
+        return "".join(page.get_text() for page in doc)
+
+
+def extract_with_pymupdf4llm(pdf_path: str) -> str:
+    import pymupdf4llm
+
+    return pymupdf4llm.to_markdown(pdf_path)
+
+
+def extract_with_marker(pdf_path: str) -> str:
+    """Convert a single PDF with marker and return the produced markdown.
+
+    The warm service is used when it can run, so this measures conversion
+    without model loading; the content-hash cache is bypassed."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        input_folder = os.path.join(tmp_dir, "in")
+        output_folder = os.path.join(tmp_dir, "out")
+        os.makedirs(input_folder)
+        shutil.copy(pdf_path, input_folder)
+        convert_pdfs_to_markdown_with_marker(
+            input_folder, output_folder, use_cache=False
+        )
+        md_files = glob.glob(os.path.join(output_folder, "**", "*.md"), recursive=True)
+        if not md_files:
+            raise RuntimeError(f"marker produced no markdown for {pdf_path}")
+        with open(md_files[0], "r", encoding="utf-8") as f:
+            return f.read()
+
+
+BACKENDS: Dict[str, Callable[[str], str]] = {
+    "pypdf2": extract_with_pypdf2,
+    "pypdf": extract_with_pypdf,
+    "pymupdf": extract_with_pymupdf,
+    "pymupdf4llm": extract_with_pymupdf4llm,
+    "marker": extract_with_marker,
+}
+
+BACKEND_REQUIREMENTS: Dict[str, str] = {
+    "pypdf2": "PyPDF2",
+    "pypdf": "pypdf",
+    "pymupdf": "pymupdf",
+    "pymupdf4llm": "pymupdf4llm",
+}
+
+
+def backend_available(backend: str) -> bool:
+    if backend == "marker":
+        return shutil.which("marker") is not None or marker_installed()
+    return importlib.util.find_spec(BACKEND_REQUIREMENTS[backend]) is not None
+
+
+# Measurement
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process and its children, in MB."""
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    # ru_maxrss is reported in bytes on macOS and in kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def measure_extraction(backend: str, pdf_path: str) -> Dict[str, Any]:
+    """Time one extraction. Runs in a fresh process so peak RSS is per backend."""
+    start_time = time.perf_counter()
+    try:
+        text = BACKENDS[backend](pdf_path)
+    except Exception as e:
+        return {"error": str(e)}
+    return {
+        "seconds": time.perf_counter() - start_time,
+        "text": text,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def count_pages(pdf_path: str) -> int:
+    from pypdf import PdfReader
+
+    return len(PdfReader(pdf_path).pages)
+
+
+def run_isolated(backend: str, pdf_path: str) -> Dict[str, Any]:
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(processes=1, maxtasksperchild=1) as pool:
+        return pool.apply(measure_extraction, (backend, pdf_path))
+
+
+def summarize_runs(
+    files: Dict[str, Dict[str, Any]], corpus_pages: Dict[str, int]
+) -> Dict[str, Any]:
+    """Aggregate per-file measurements into per-backend throughput statistics."""
+    measured = [name for name, result in files.items() if "runs_seconds" in result]
+    if not measured:
+        return {}
+
+    repeats = min(len(files[name]["runs_seconds"]) for name in measured)
+    pages = sum(corpus_pages[name] for name in measured)
+    run_totals = [
+        sum(files[name]["runs_seconds"][i] for name in measured) for i in range(repeats)
+    ]
+    pages_per_second = [pages / total for total in run_totals if total > 0]
+    parities = [
+        files[name]["parity"]
+        for name in measured
+        if files[name].get("parity") is not None
+    ]
+
+    return {
+        "files_measured": len(measured),
+        "pages": pages,
+        "seconds_mean": statistics.mean(run_totals),
+        "seconds_stdev": statistics.stdev(run_totals) if repeats > 1 else 0.0,
+        "pages_per_second_mean": statistics.mean(pages_per_second),
+        "pages_per_second_stdev": (
+            statistics.stdev(pages_per_second) if len(pages_per_second) > 1 else 0.0
+        ),
+        "peak_rss_mb": max(files[name]["peak_rss_mb"] for name in measured),
+        "parity_mean": statistics.mean(parities) if parities else None,
+    }
 
 
-# extract_text_with_marker
 def benchmark_extraction(
-    pdf_folder: str, output_folder: str
-) -> Dict[str, Dict[str, float]]:
-    results = {}
+    pdf_folder: str,
+    output_folder: str,
+    backends: List[str],
+    reference_backend: str = "pymupdf",
+    repeats: int = 3,
+) -> Dict[str, Any]:
+    """Run every backend over the corpus and return machine-readable results."""
+    pdf_files = sorted(f for f in os.listdir(pdf_folder) if f.endswith(".pdf"))
+    corpus_pages = {f: count_pages(os.path.join(pdf_folder, f)) for f in pdf_files}
+
+    results: Dict[str, Any] = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "pdf_folder": pdf_folder,
+        "reference_backend": reference_backend,
+        "repeats": repeats,
+        "corpus": {
+            f: {
+                "pages": corpus_pages[f],
+                "bytes": os.path.getsize(os.path.join(pdf_folder, f)),
+            }
+            for f in pdf_files
+        },
+        "backends": {},
+    }
 
-    # Wipe the output folder
-    delete_all_files_in_folder(output_folder)
+    # The reference runs first so every other backend can be compared against it
+    ordered = sorted(backends, key=lambda b: b != reference_backend)
+    reference_lengths: Dict[str, int] = {}
 
-    # benchmark Marker
-    start_time = time.time()
-    convert_pdfs_to_markdown_with_marker(pdf_folder, output_folder)
-    marker_time = time.time() - start_time
+    for backend in ordered:
+        if backend not in BACKENDS:
+            print(f"Warning: Unknown extraction backend '{backend}'")
+            continue
+        if not backend_available(backend):
+            print(f"Skipping {backend}: not installed")
+            results["backends"][backend] = {"available": False}
+            continue
 
-    results["marker_time"] = marker_time
+        text_folder = os.path.join(output_folder, "texts", backend)
+        make_folder_if_none(text_folder)
+        files: Dict[str, Dict[str, Any]] = {}
 
-    for filename in os.listdir(pdf_folder):
-        if filename.endswith(".pdf"):
-            pdf_path = os.path.join(pdf_folder, filename)
+        for pdf_file in pdf_files:
+            pdf_path = os.path.join(pdf_folder, pdf_file)
+            runs: List[Dict[str, Any]] = []
+            for i in range(repeats):
+                print(f"{backend}: {pdf_file} (run {i + 1}/{repeats})")
+                runs.append(run_isolated(backend, pdf_path))
 
-            # benchmark extract_text_from_pdf
-            start_time = time.time()
-            pypdf_text = extract_text_from_pdf(pdf_path)
-            pypdf_time = time.time() - start_time
+            errors = [r["error"] for r in runs if "error" in r]
+            if errors:
+                print(f"Error extracting {pdf_file} with {backend}: {errors[0]}")
+                files[pdf_file] = {"error": errors[0]}
+                continue
 
-            # Save extracted texts
+            text = runs[-1]["text"]
             with open(
-                os.path.join(output_folder, f"{filename}_pypdf.txt"),
-                "w",
-                encoding="utf-8",
+                os.path.join(text_folder, f"{pdf_file}.txt"), "w", encoding="utf-8"
             ) as f:
-                f.write(pypdf_text)
+                f.write(text)
 
-            results[filename] = {
-                "pypdf_time": pypdf_time,
-                "pypdf_length": len(pypdf_text),
+            if backend == reference_backend:
+                reference_lengths[pdf_file] = len(text)
+            reference_length = reference_lengths.get(pdf_file)
+
+            files[pdf_file] = {
+                "runs_seconds": [r["seconds"] for r in runs],
+                "chars": len(text),
+                "peak_rss_mb": max(r["peak_rss_mb"] for r in runs),
+                "parity": (len(text) / reference_length if reference_length else None),
             }
 
+        results["backends"][backend] = {
+            "available": True,
+            "files": files,
+            "summary": summarize_runs(files, corpus_pages),
+        }
+
     return results
 
 
-def main():
-    config = resolve_config()
-    pdf_folder = config.get("benchmark", "pdf_folder")
-    output_folder = config.get("benchmark", "output_folder")
+def compare_to_baseline(
+    results: Dict[str, Any],
+    baseline: Dict[str, Any],
+    tolerance: float = 0.25,
+    parity_tolerance: float = 0.05,
+) -> List[str]:
+    """List regressions of results against a stored baseline run."""
+    regressions = []
+    for backend, current in results["backends"].items():
+        previous = baseline.get("backends", {}).get(backend, {})
+        now, before = current.get("summary"), previous.get("summary")
+        if not now or not before:
+            continue
 
-    if not os.path.exists(output_folder):
-        os.makedirs(output_folder)
+        # Only flag throughput drops that exceed the run-to-run noise
+        noise = now["pages_per_second_stdev"] + before["pages_per_second_stdev"]
+        floor = before["pages_per_second_mean"] * (1 - tolerance) - noise
+        if now["pages_per_second_mean"] < floor:
+            regressions.append(
+                f"{backend}: throughput {now['pages_per_second_mean']:.2f} pages/s "
+                f"vs baseline {before['pages_per_second_mean']:.2f} pages/s"
+            )
 
-    results = benchmark_extraction(pdf_folder, output_folder)
+        if now["peak_rss_mb"] > before["peak_rss_mb"] * (1 + tolerance):
+            regressions.append(
+                f"{backend}: peak RSS {now['peak_rss_mb']:.0f} MB "
+                f"vs baseline {before['peak_rss_mb']:.0f} MB"
+            )
 
-    total_pypdf_time = sum(result["pypdf_time"] for result in results.values())
-    print(f"Total PyPDF2 Time: {total_pypdf_time:.2f}s")
-    print(f"Total Marker Time: {results['marker_time']:.2f}s")
+        if (
+            now["parity_mean"] is not None
+            and before["parity_mean"] is not None
+            and abs(now["parity_mean"] - before["parity_mean"]) > parity_tolerance
+        ):
+            regressions.append(
+                f"{backend}: text-length parity {now['parity_mean']:.3f} "
+                f"vs baseline {before['parity_mean']:.3f}"
+            )
+    return regressions
+
+
+def print_report(results: Dict[str, Any]) -> None:
+    print(
+        f"\n{'backend':<12} {'pages/s':>10} {'± stdev':>9} {'peak MB':>9} {'parity':>8}"
+    )
+    for backend, result in results["backends"].items():
+        summary = result.get("summary")
+        if not summary:
+            print(f"{backend:<12} {'n/a':>10}")
+            continue
+        parity = summary["parity_mean"]
+        print(
+            f"{backend:<12} {summary['pages_per_second_mean']:>10.2f} "
+            f"{summary['pages_per_second_stdev']:>9.2f} "
+            f"{summary['peak_rss_mb']:>9.0f} "
+            f"{parity if parity is None else format(parity, '.3f'):>8}"
+        )
+
+
+def main(
+    config: Optional[configparser.ConfigParser] = None,
+    save_baseline: bool = False,
+    fail_on_regression: bool = False,
+) -> int:
+    config = config or resolve_config()
+    benchmark_config = config["benchmark"]
+    pdf_folder = benchmark_config.get("pdf_folder")
+    output_folder = benchmark_config.get("output_folder")
+    backends = [
+        b.strip() for b in benchmark_config.get("backends", "pypdf2").split(",")
+    ]
+    baseline_file = benchmark_config.get(
+        "baseline_file", os.path.join(output_folder, "baseline.json")
+    )
+
+    make_folder_if_none(output_folder)
+
+    results = benchmark_extraction(
+        pdf_folder,
+        output_folder,
+        backends,
+        reference_backend=benchmark_config.get("reference_backend", "pymupdf"),
+        repeats=benchmark_config.getint("repeats", 3),
+    )
+    print_report(results)
+
+    results_path = os.path.join(
+        output_folder, f"extraction_{datetime.now():%Y-%m-%d_%H%M%S}.json"
+    )
+    with open(results_path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nSaved results to {results_path}")
+
+    if save_baseline:
+        with open(baseline_file, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved baseline to {baseline_file}")
+        return 0
+
+    if not os.path.exists(baseline_file):
+        print("No baseline stored yet; run with --save-baseline to create one.")
+        return 0
+
+    with open(baseline_file, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressions = compare_to_baseline(
+        results,
+        baseline,
+        tolerance=benchmark_config.getfloat("regression_tolerance", 0.25),
+        parity_tolerance=benchmark_config.getfloat("parity_tolerance", 0.05),
+    )
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if not regressions:
+        print(f"No regressions against {baseline_file}")
+    return 1 if regressions and fail_on_regression else 0
 
 
 def run(config: configparser.ConfigParser) -> None:
-    main()
+    main(config)
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Benchmark PDF extraction backends")
+    parser.add_argument("--backends", help="comma-separated backends to run")
+    parser.add_argument("--repeats", type=int, help="runs per backend and PDF")
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    args = parser.parse_args()
+
+    config = resolve_config()
+    if args.backends:
+        config.set("benchmark", "backends", args.backends)
+    if args.repeats:
+        config.set("benchmark", "repeats", str(args.repeats))
+    sys.exit(main(config, args.save_baseline, args.fail_on_regression))
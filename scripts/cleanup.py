@@ -3,33 +3,73 @@ import configparser
 import os
 import shutil
 import glob
-from utils.utils import get_link
+from typing import Optional
+from utils.paper_index import PaperIndex, paper_index_from_config
+from utils.paper_store import PaperStore, get_paper_store
+from utils.vault_sync import SyncItem, sync_to_vault
 
 
 def process_files(
-    pdf_folder: str, md_final_folder: str, pdf_final_folder: str, csv_path: str
+    pdf_folder: str,
+    md_final_folder: str,
+    pdf_final_folder: str,
+    index: PaperIndex,
+    store: Optional[PaperStore] = None,
+    link_mode: str = "auto",
+    max_workers: int = 8,
 ) -> None:
-    count = 0
+    items = []
     for pdf_file in glob.glob(os.path.join(pdf_folder, "*.pdf")):
-        count += 1
         base_filename = os.path.splitext(os.path.basename(pdf_file))[0]
-        link = get_link(base_filename, csv_path)
+        link = index.link(base_filename)
 
         md_content = f"{'Link: [' + link + '](' + link + ')' if link else ''}\n\n![[{base_filename}.pdf]]"
-        md_file = os.path.join(pdf_folder, f"{base_filename.title()} (pdf).md")
+        items.append(
+            SyncItem(
+                os.path.join(md_final_folder, f"{base_filename.title()} (pdf).md"),
+                content=md_content,
+            )
+        )
+        items.append(
+            SyncItem(
+                os.path.join(pdf_final_folder, f"{base_filename}.pdf"),
+                source_path=pdf_file,
+                linkable=True,
+            )
+        )
 
-        with open(md_file, "w") as f_out:
-            f_out.write(md_content)
+    results = sync_to_vault(items, link_mode, max_workers)
 
-        for src, dst in [(md_file, md_final_folder), (pdf_file, pdf_final_folder)]:
-            try:
-                shutil.move(src, dst)
-            except shutil.Error as e:
-                print(
-                    f"Error: {e}. Skipping file {src} because it already exists in the destination."
-                )
+    exported = 0
+    for item in items[1::2]:
+        base_filename = os.path.splitext(os.path.basename(item.destination))[0]
+        paper_id = store.find_by_filename(base_filename) if store else None
+        if results[item.destination] != "conflict":
+            exported += 1
+            if paper_id:
+                store.complete(paper_id, "exported")
 
-    print(f"{count} files added to vault assuming no skip errors")
+    print(f"{exported} of {len(items) // 2} papers are in the vault")
+
+
+def prune_pdf_cache(
+    pdf_cache: str, store: PaperStore, keep_for_passages: bool = False
+) -> None:
+    """Delete downloads that every profile selecting them has exported.
+    With `keep_for_passages`, papers not yet indexed by passage are kept."""
+    removed = 0
+    for pdf_file in glob.glob(os.path.join(pdf_cache, "*.pdf")):
+        paper_id = store.find_by_filename(
+            os.path.splitext(os.path.basename(pdf_file))[0]
+        )
+        if not paper_id or not store.done_by_every_profile(paper_id, "exported"):
+            continue
+        if keep_for_passages and not store.is_done(paper_id, "chunked"):
+            continue
+        os.remove(pdf_file)
+        removed += 1
+    if removed:
+        print(f"Removed {removed} exported papers from {pdf_cache}")
 
 
 def cleanup_files(
@@ -59,14 +99,29 @@ def cleanup_and_send_to_obsidian(config: ConfigParser):
             config.get("select_papers", "output_dir"),
             config.get("Obsidian", "vault_location"),
             config.get("Obsidian", "vault_attachments_location"),
-            config.get(
-                "summarize_papers",
-                "csv_path",
-                fallback="data/pdfs-to-summarize/papers_to_summarize.csv",
-            ),
+            paper_index_from_config(config),
+            get_paper_store(config),
+            config.get("Obsidian", "sync_link_mode", fallback="auto"),
+            config.getint("Obsidian", "sync_workers", fallback=8),
+        )
+
+    pdf_cache = config.get("select_papers", "pdf_cache", fallback="")
+    if pdf_cache and os.path.isdir(pdf_cache):
+        prune_pdf_cache(
+            pdf_cache,
+            get_paper_store(config),
+            config.getboolean("select_papers", "passage_search", fallback=False),
         )
 
-    files_to_preserve = ["papers_to_summarize.csv", "most_recent_day_searched.txt"]
+    # The paper store keeps the state of every paper across runs
+    db_path = config.get("state", "db_path", fallback="data/state/papers.db")
+    files_to_preserve = [
+        "papers_to_summarize.csv",
+        "most_recent_day_searched.txt",
+        os.path.basename(db_path),
+        f"{os.path.basename(db_path)}-wal",
+        f"{os.path.basename(db_path)}-shm",
+    ]
 
     cleanup_files(
         [
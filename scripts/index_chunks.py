@@ -0,0 +1,116 @@
+import configparser
+import os
+import time
+from typing import Any, Dict, List
+from utils.paper_store import PaperStore, get_paper_store, text_hash
+from utils.query_cache import bump_collection_version
+from utils.sections import split_passages, text_for_step
+from utils.utils import extract_text_cached, paper_pdf_path
+from utils.weaviate_client import (
+    get_or_create_class,
+    get_weaviate_client,
+    release_client,
+)
+from weaviate.classes.query import Filter
+from weaviate.util import generate_uuid5
+
+# Full-text indexing of downloaded papers. Each paper's text is split into
+# section-aware passages that are stored as their own objects in the chunks
+# collection, with a reference to the paper. Weaviate embeds them in
+# batches on import, and select_papers searches them alongside the
+# abstracts. Papers are indexed once (the `chunked` stage), so each run
+# only adds the papers downloaded since the last one.
+
+
+def chunk_objects(paper: Dict[str, Any], text: str, max_chars: int) -> List[Dict]:
+    arxiv_id = paper["arxiv_id"] or paper["paper_id"]
+    return [
+        {
+            # Stable ids, so indexing a paper again replaces its passages
+            "uuid": generate_uuid5(f"{arxiv_id}:{index}"),
+            "properties": {
+                "arxiv_id": arxiv_id,
+                "section": passage.section,
+                "chunk_index": index,
+                "text": passage.text,
+            },
+            "references": {"paper": generate_uuid5(arxiv_id)},
+        }
+        for index, passage in enumerate(split_passages(text, max_chars))
+    ]
+
+
+def delete_stale_chunks(chunk_class: Any, arxiv_id: str, count: int) -> None:
+    """Drop passages beyond the first `count`, left over from indexing an
+    earlier text of the paper that split into more of them."""
+    chunk_class.data.delete_many(
+        where=Filter.by_property("arxiv_id").equal(arxiv_id)
+        & Filter.by_property("chunk_index").greater_or_equal(count)
+    )
+
+
+def index_chunks(config: configparser.ConfigParser) -> None:
+    weaviate_config = config["weaviate"]
+    text_folder = config.get("queue", "text_folder", fallback=None)
+    max_chars = config.getint("index_chunks", "max_chars", fallback=1500)
+    batch_size = config.getint("index_chunks", "batch_size", fallback=100)
+
+    store: PaperStore = get_paper_store(config)
+    pending = [
+        paper
+        for paper in store.pending("chunked")
+        if paper["filename"]
+        and os.path.exists(paper_pdf_path(config, paper["filename"]))
+    ]
+    print(f"{len(pending)} downloaded papers to index by passage")
+    if not pending:
+        return
+
+    client = get_weaviate_client(weaviate_config)
+    chunk_class = get_or_create_class(
+        client, weaviate_config.get("chunks_class_name", "PaperChunks")
+    )
+    indexed = 0
+    try:
+        for paper in pending:
+            if not store.claim(paper["paper_id"], "chunked"):
+                continue
+            start_time = time.time()
+            try:
+                text = extract_text_cached(
+                    paper_pdf_path(config, paper["filename"]), text_folder, config
+                )
+                objects = chunk_objects(
+                    paper, text_for_step(text, config, "index_chunks"), max_chars
+                )
+                # The vectorizer embeds each batch of passages in one request
+                with chunk_class.batch.fixed_size(batch_size=batch_size) as batch:
+                    for obj in objects:
+                        batch.add_object(**obj)
+                if chunk_class.batch.failed_objects:
+                    raise RuntimeError(
+                        f"{len(chunk_class.batch.failed_objects)} passages failed to import"
+                    )
+                delete_stale_chunks(
+                    chunk_class, paper["arxiv_id"] or paper["paper_id"], len(objects)
+                )
+            except Exception as e:
+                print(f"Error indexing {paper['filename']}: {e}")
+                store.fail(paper["paper_id"], "chunked", repr(e))
+                continue
+            store.complete(
+                paper["paper_id"], "chunked", text_hash(text), time.time() - start_time
+            )
+            indexed += 1
+            print(f"Indexed {len(objects)} passages of {paper['filename']}")
+    finally:
+        if indexed:
+            # Cached passage searches no longer reflect the collection
+            bump_collection_version(
+                store, weaviate_config.get("chunks_class_name", "PaperChunks")
+            )
+        release_client(client)
+
+
+def run(config: configparser.ConfigParser) -> None:
+    index_chunks(config)
@@ -0,0 +1,108 @@
+import configparser
+import json
+import os
+import re
+import time
+from configparser import ConfigParser
+from datetime import datetime
+from typing import Any, Dict, List
+
+# The newsletter is assembled from the per-paper summaries that
+# summarize_papers writes, without any LLM calls. A manifest caches each
+# summary's text by file size and modification time, so re-assembly only
+# reads the summaries that changed since the last run.
+
+NEWSLETTER_MANIFEST = ".newsletter_manifest.json"
+DATE_PREFIX = re.compile(r"^(\d{4}-\d{2}-\d{2})-")
+ORDERS = ["date_desc", "date_asc", "name", "summarized"]
+
+
+def load_sections(output_folder: str, exclude: List[str]) -> List[Dict[str, Any]]:
+    """One entry per summary file, reading only files the manifest doesn't have."""
+    manifest_path = os.path.join(output_folder, NEWSLETTER_MANIFEST)
+    try:
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest: Dict[str, Dict[str, Any]] = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        manifest = {}
+
+    sections: Dict[str, Dict[str, Any]] = {}
+    changed = False
+    for entry in os.scandir(output_folder):
+        if not entry.name.endswith(".md") or entry.name in exclude:
+            continue
+        stat = entry.stat()
+        cached = manifest.get(entry.name)
+        if cached and (cached["size"], cached["mtime"]) == (
+            stat.st_size,
+            stat.st_mtime,
+        ):
+            sections[entry.name] = cached
+            continue
+        with open(entry.path, encoding="utf-8") as f:
+            text = f.read()
+        match = DATE_PREFIX.match(entry.name)
+        sections[entry.name] = {
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "paper_date": match.group(1) if match else "",
+            "text": text,
+        }
+        changed = True
+
+    if changed or len(sections) != len(manifest):
+        temp_path = f"{manifest_path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(sections, f)
+        os.replace(temp_path, manifest_path)
+    return [dict(section, name=name) for name, section in sections.items()]
+
+
+def order_sections(sections: List[Dict[str, Any]], order: str) -> List[Dict[str, Any]]:
+    if order == "date_desc":
+        return sorted(
+            sections, key=lambda s: (s["paper_date"], s["name"]), reverse=True
+        )
+    if order == "date_asc":
+        return sorted(sections, key=lambda s: (s["paper_date"], s["name"]))
+    if order == "name":
+        return sorted(sections, key=lambda s: s["name"])
+    if order == "summarized":
+        return sorted(sections, key=lambda s: s["mtime"])
+    raise ValueError(f"Unknown newsletter order '{order}', expected one of {ORDERS}")
+
+
+def assemble_newsletter(config: ConfigParser) -> str:
+    """Write the newsletter from the per-paper summaries and return its path."""
+    start_time: float = time.time()
+    output_folder: str = config.get("summarize_papers", "output_folder")
+    newsletter_location: str = config.get(
+        "podcast",
+        "newsletter_text_location",
+        fallback=f"{output_folder}/newsletter.md",
+    )
+    order: str = config.get("newsletter", "order", fallback="date_desc")
+    window_days: float = config.getfloat("newsletter", "window_days", fallback=0)
+
+    sections = load_sections(output_folder, [os.path.basename(newsletter_location)])
+    if window_days > 0:
+        # The window is on when a paper was summarized, not when it was published
+        cutoff = time.time() - window_days * 86400
+        sections = [s for s in sections if s["mtime"] >= cutoff]
+    sections = [s for s in order_sections(sections, order) if s["text"].strip()]
+
+    temp_location = f"{newsletter_location}.tmp"
+    with open(temp_location, "w", encoding="utf-8") as outfile:
+        outfile.write("".join(section["text"] for section in sections))
+    os.replace(temp_location, newsletter_location)
+
+    print(
+        f"Assembled newsletter from {len(sections)} summaries in "
+        f"{(time.time() - start_time) * 1000:.1f} ms "
+        f"({datetime.now():%Y-%m-%d %H:%M}): {newsletter_location}"
+    )
+    return newsletter_location
+
+
+def run(config: configparser.ConfigParser) -> None:
+    assemble_newsletter(config)
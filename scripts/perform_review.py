@@ -1,21 +1,42 @@
 import os
 import json
+import hashlib
+import re
 import configparser
-from typing import Dict, Any
-from openai import OpenAI
+import tempfile
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache, partial
+from typing import Callable, Dict, Any, List, Optional, Tuple
 from pypdf import PdfReader
 import pymupdf
 import pymupdf4llm
 from utils.utils import (
-    extract_text_from_pdf,
+    extract_text_cached,
     get_response_from_llm,
     get_batch_responses_from_llm,
-    extract_json_between_markers,
     get_review_model_settings,
     resolve_config,
 )
+from utils.paper_store import PaperStore, file_hash, get_paper_store
+from utils.review_schema import (
+    SCORE_LIMITS,
+    ReviewFormatError,
+    parse_review,
+    review_output_params,
+)
+from utils.sections import text_for_step
+from utils.job_queue import Job, get_job_queue, queue_enabled, work
+from utils.profiles import job_config, job_key, job_payload
+from utils.llm_gateway import get_adapter, get_openai_client
 
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+# Where review prompt bundles go unless [review] prompt_bundle_dir says otherwise
+DEFAULT_PROMPT_BUNDLE_DIR = os.path.join(project_root, "data/review_prompt_bundle")
+
+# Gateway lane for this step's LLM calls, see [llm_gateway] lanes
+LLM_LANE = "perform_review"
 
 
 def create_load_prompt() -> callable:
@@ -41,57 +62,257 @@ reviewer_neurips_form = (
 )
 reviewer_reviews_aggregation = load_prompt("reviewer_reviews_aggregation.txt")
 reviewer_reflection_prompt = load_prompt("reviewer_reflection_prompt.txt")
+reviewer_compact_reflection_prompt = load_prompt(
+    "reviewer_compact_reflection_prompt.txt"
+)
 reviewer_meta_system_prompt = load_prompt("reviewer_meta_system_prompt.txt")
 reviewer_improvement_prompt = load_prompt("reviewer_improvement_prompt.txt")
 
 del load_prompt
 
 
+class ReviewCheckpoint:
+    """Valid partial results of one paper's review (ensemble members, the
+    meta-review, reflection rounds), saved as they arrive. After a failure
+    or a restart only the calls that did not succeed are made again."""
+
+    def __init__(self, path: Optional[str], key: str):
+        self.path = path
+        self.state: Dict[str, Any] = {
+            "key": key,
+            "members": [],
+            "meta_review": None,
+            "rounds": {},
+        }
+        if path and os.path.exists(path):
+            with open(path) as f:
+                saved = json.load(f)
+            # A checkpoint of another text or other settings is stale
+            if saved.get("key") == key:
+                self.state = saved
+                print(
+                    f"Resuming review from {os.path.basename(path)}: "
+                    f"{len(saved['members'])} ensemble reviews, "
+                    f"{sum(len(r) for r in saved['rounds'].values())} reflection rounds"
+                )
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        with open(f"{self.path}.tmp", "w") as f:
+            json.dump(self.state, f)
+        os.replace(f"{self.path}.tmp", self.path)
+
+    def rounds(self, mode: str) -> List[Dict[str, Any]]:
+        return self.state["rounds"].setdefault(mode, [])
+
+    def remove(self) -> None:
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def checkpoint_key(text: str, model: str, *settings: Any) -> str:
+    return hashlib.sha256(
+        json.dumps([text, model, *settings]).encode("utf-8")
+    ).hexdigest()
+
+
+def valid_review(
+    call: Callable[[], Tuple[str, Any]], retries: int, what: str
+) -> Optional[Tuple[str, Any, Dict[str, Any]]]:
+    """(answer, history, review) from the first of at most `retries + 1`
+    calls whose answer is a valid review; None if none is."""
+    for attempt in range(retries + 1):
+        content, history = call()
+        try:
+            return content, history, parse_review(content)
+        except ReviewFormatError as e:
+            retrying = "retrying" if attempt < retries else "giving up"
+            print(f"{what} is not a valid review ({e}), {retrying}")
+    return None
+
+
+def aggregate_scores(reviews: List[Dict[str, Any]]) -> Dict[str, int]:
+    """Mean of each score over the reviews, rounded; all scores at once."""
+    names = list(SCORE_LIMITS)
+    scores = np.array([[review[name] for name in names] for review in reviews])
+    return dict(zip(names, np.rint(scores.mean(axis=0)).astype(int).tolist()))
+
+
 def perform_review(config: configparser.ConfigParser) -> None:
     review_config = config["review"]
     input_folder = review_config.get("input_folder")
     output_folder = review_config.get("output_folder")
-    model, temperature = get_review_model_settings()
-    num_reflections = review_config.getint("num_reflections", 1)
-    num_fs_examples = review_config.getint("num_fs_examples", 1)
-    num_reviews_ensemble = review_config.getint("num_reviews_ensemble", 1)
+    max_concurrent_reviews = review_config.getint("max_concurrent_reviews", 4)
 
     os.makedirs(output_folder, exist_ok=True)
 
-    client = OpenAI(
-        api_key=open(config.get("openai", "api_key_location")).read().strip()
-    )
+    client = get_openai_client(config.get("openai", "api_key_location"))
 
-    for filename in os.listdir(input_folder):
+    store = get_paper_store(config)
+    paper_ids = {}
+    for filename in sorted(os.listdir(input_folder)):
         if filename.endswith(".pdf"):
-            pdf_path = os.path.join(input_folder, filename)
-            output_path = os.path.join(
-                output_folder, f"{os.path.splitext(filename)[0]}_review.json"
-            )
+            base_filename = os.path.splitext(filename)[0]
+            paper_id = store.paper_for_file(base_filename)
+            output_path = os.path.join(output_folder, f"{base_filename}_review.json")
+            if os.path.exists(output_path) and not store.is_done(paper_id, "reviewed"):
+                # Reviewed before the paper store tracked it
+                store.complete(paper_id, "reviewed", file_hash(output_path))
+            paper_ids[paper_id] = (os.path.join(input_folder, filename), output_path)
+
+    if queue_enabled(config):
+        review_with_workers(list(paper_ids), config)
+        print("All reviews completed.")
+        return
+
+    pending = []
+    for paper in store.pending("reviewed"):
+        if paper["paper_id"] in paper_ids and store.claim(
+            paper["paper_id"], "reviewed"
+        ):
+            pending.append((paper["paper_id"], *paper_ids[paper["paper_id"]]))
+    print(f"{len(pending)} of {len(paper_ids)} papers need a review")
+
+    # Papers are independent, so several are reviewed at once; each worker
+    # still runs its own ensemble and reflection rounds in order.
+    with ThreadPoolExecutor(max_workers=max_concurrent_reviews) as executor:
+        futures = {
+            executor.submit(
+                review_tracked_paper,
+                store,
+                paper_id,
+                pdf_path,
+                output_path,
+                client,
+                review_config,
+                config.get("queue", "text_folder", fallback=None),
+            ): pdf_path
+            for paper_id, pdf_path, output_path in pending
+        }
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                print(f"Review of {os.path.basename(futures[future])} failed: {e}")
 
-            if os.path.exists(output_path):
-                print(f"Review for {filename} already exists. Skipping...")
-                continue
+    print("All reviews completed.")
 
-            print(f"Reviewing {filename}...")
-            text = extract_text_from_pdf(pdf_path)
 
-            review = perform_single_review(
-                text,
-                model,
-                client,
-                num_reflections,
-                num_fs_examples,
-                num_reviews_ensemble,
-                temperature,
-            )
+def review_with_workers(
+    paper_ids: List[str], config: configparser.ConfigParser
+) -> None:
+    """Queue the papers that still need a review and work the queue along
+    with any worker.py processes until nothing is left."""
+    queue = get_job_queue(config)
+    store = get_paper_store(config)
+    for paper in store.pending("reviewed"):
+        if paper["paper_id"] in paper_ids:
+            payload = job_payload(config, paper["paper_id"], paper["filename"])
+            queue.enqueue("review", payload, key=job_key("review", payload))
+    # Every in-flight review holds the same few rate-limited LLM lanes, so
+    # the concurrency setting carries over to the number of local workers
+    threads = [
+        threading.Thread(
+            target=work,
+            args=(queue, {"review": partial(handle_review_job, config=config)}),
+            kwargs={
+                "heartbeat_seconds": config.getfloat(
+                    "queue", "heartbeat_seconds", fallback=60
+                ),
+                "until_empty": True,
+            },
+        )
+        for _ in range(config.getint("review", "max_concurrent_reviews", fallback=4))
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def handle_review_job(job: Job, config: configparser.ConfigParser) -> None:
+    config = job_config(config, job.payload)
+    paper_id = job.payload["paper_id"]
+    base_filename = job.payload["filename"]
+    review_config = config["review"]
+    store = get_paper_store(config)
+    if not store.claim(paper_id, "reviewed"):
+        if store.is_done(paper_id, "reviewed"):
+            return
+        raise RuntimeError(f"{base_filename} is being reviewed by another worker")
+    os.makedirs(review_config.get("output_folder"), exist_ok=True)
+    review_tracked_paper(
+        store,
+        paper_id,
+        os.path.join(review_config.get("input_folder"), f"{base_filename}.pdf"),
+        os.path.join(
+            review_config.get("output_folder"), f"{base_filename}_review.json"
+        ),
+        get_openai_client(config.get("openai", "api_key_location")),
+        review_config,
+        config.get("queue", "text_folder", fallback=None),
+    )
 
-            with open(output_path, "w") as f:
-                json.dump(review, f, indent=2)
 
-            print(f"Review for {filename} completed and saved.")
+def review_tracked_paper(
+    store: PaperStore,
+    paper_id: str,
+    pdf_path: str,
+    output_path: str,
+    client: Any,
+    review_config: Any,
+    text_folder: Optional[str] = None,
+) -> None:
+    """`review_paper`, recording the outcome in the paper store."""
+    with store.track(paper_id, "reviewed") as result:
+        review_paper(pdf_path, output_path, client, review_config, text_folder)
+        result["content_hash"] = file_hash(output_path)
+
+
+def review_paper(
+    pdf_path: str,
+    output_path: str,
+    client: Any,
+    review_config: Any,
+    text_folder: Optional[str] = None,
+) -> None:
+    """Review one PDF and atomically write the result to `output_path`."""
+    filename = os.path.basename(pdf_path)
+    model, temperature = get_review_model_settings()
 
-    print("All reviews completed.")
+    print(f"Reviewing {filename}...")
+    text = text_for_step(
+        extract_text_cached(pdf_path, text_folder, review_config.parser),
+        review_config.parser,
+        "perform_review",
+    )
+
+    review = perform_single_review(
+        text,
+        model,
+        client,
+        review_config.getint("num_reflections", 1),
+        review_config.getint("num_fs_examples", 1),
+        review_config.getint("num_reviews_ensemble", 1),
+        temperature,
+        review_config.get("reflection_mode", "full"),
+        checkpoint_path=f"{output_path}.partial.json",
+        parse_retries=review_config.getint("parse_retries", 2),
+        structured_output=review_config.getboolean("structured_output", True),
+        bundle_dir=prompt_bundle_dir(review_config),
+    )
+
+    # Write next to the destination and rename so a crash never leaves a
+    # partial review that would be mistaken for a finished one
+    tmp_path = f"{output_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(review, f, indent=2)
+    os.replace(tmp_path, output_path)
+    if os.path.exists(f"{output_path}.partial.json"):
+        os.remove(f"{output_path}.partial.json")
+
+    print(f"Review for {filename} completed and saved.")
 
 
 def perform_single_review(
@@ -102,101 +323,321 @@ def perform_single_review(
     num_fs_examples: int,
     num_reviews_ensemble: int,
     temperature: float,
+    reflection_mode: str = "full",
+    checkpoint_path: Optional[str] = None,
+    parse_retries: int = 2,
+    structured_output: bool = True,
+    bundle_dir: str = DEFAULT_PROMPT_BUNDLE_DIR,
 ) -> Dict[str, Any]:
-    if num_fs_examples > 0:
-        fs_prompt = get_review_fewshot_examples(num_fs_examples)
-        base_prompt = reviewer_neurips_form + fs_prompt
-    else:
-        base_prompt = reviewer_neurips_form
-
-    base_prompt += reviewer_base_prompt.format(text=text)
+    # The form and few-shot examples are identical for every paper, so they
+    # lead the prompt and only the paper text varies at the end
+    prompt_prefix = load_review_prompt_prefix(num_fs_examples, bundle_dir)
+    base_prompt = prompt_prefix + reviewer_base_prompt.format(text=text)
+    params = review_output_params(model, structured_output)
+    checkpoint = ReviewCheckpoint(
+        checkpoint_path,
+        checkpoint_key(
+            text,
+            model,
+            num_fs_examples,
+            num_reviews_ensemble,
+            temperature,
+            structured_output,
+        ),
+    )
 
-    if num_reviews_ensemble > 1:
-        llm_review, msg_histories = get_batch_responses_from_llm(
+    # Each ensemble member is requested until it is valid, without redoing
+    # the members that already are
+    members = checkpoint.state["members"]
+    attempts = 0
+    while len(members) < num_reviews_ensemble and attempts <= parse_retries:
+        attempts += 1
+        contents, _ = get_batch_responses_from_llm(
             base_prompt,
             model=model,
             client=client,
             system_message=reviewer_system_prompt_neg,
+            lane=LLM_LANE,
             print_debug=False,
-            msg_history=msg_history,
             # Higher temperature to encourage diversity.
-            temperature=0.75,
-            n_responses=num_reviews_ensemble,
+            temperature=0.75 if num_reviews_ensemble > 1 else temperature,
+            n_responses=num_reviews_ensemble - len(members),
+            cache_prefix=prompt_prefix,
+            **params,
         )
-        parsed_reviews = []
-        for idx, rev in enumerate(llm_review):
+        for content in contents:
             try:
-                parsed_reviews.append(extract_json_between_markers(rev))
-            except Exception as e:
-                print(f"Ensemble review {idx} failed: {e}")
-        parsed_reviews = [r for r in parsed_reviews if r is not None]
-        review = get_meta_review(model, client, temperature, parsed_reviews)
+                members.append({"content": content, "review": parse_review(content)})
+                checkpoint.save()
+            except ReviewFormatError as e:
+                print(f"Ensemble review failed (attempt {attempts}): {e}")
+    if not members:
+        raise ReviewFormatError(
+            f"No valid review after {attempts} attempts of {num_reviews_ensemble} reviews"
+        )
 
+    user_message = get_adapter(model).user_message(base_prompt, prompt_prefix)
+    if num_reviews_ensemble > 1:
+        parsed_reviews = [member["review"] for member in members]
+        if checkpoint.state["meta_review"] is None:
+            checkpoint.state["meta_review"] = get_meta_review(
+                model, client, temperature, parsed_reviews, parse_retries, params
+            )
+            checkpoint.save()
         # take first valid in case meta-reviewer fails
-        if review is None:
-            review = parsed_reviews[0]
+        review = dict(checkpoint.state["meta_review"] or parsed_reviews[0])
 
         # Replace numerical scores with the average of the ensemble.
-        for score, limits in [
-            ("Originality", (1, 4)),
-            ("Quality", (1, 4)),
-            ("Clarity", (1, 4)),
-            ("Significance", (1, 4)),
-            ("Soundness", (1, 4)),
-            ("Presentation", (1, 4)),
-            ("Contribution", (1, 4)),
-            ("Overall", (1, 10)),
-            ("Confidence", (1, 5)),
-        ]:
-            scores = []
-            for r in parsed_reviews:
-                if score in r and limits[1] >= r[score] >= limits[0]:
-                    scores.append(r[score])
-            review[score] = int(round(np.mean(scores)))
-
-        # Rewrite the message history with the valid one and new aggregated review.
-        msg_history = msg_histories[0][:-1]
-        msg_history += [
+        review.update(aggregate_scores(parsed_reviews))
+
+        # Rewrite the message history with the aggregated review.
+        msg_history = [
+            user_message,
             {
                 "role": "assistant",
                 "content": reviewer_reviews_aggregation.format(
-                    num_reviews_ensemble=num_reviews_ensemble,
+                    num_reviews_ensemble=len(parsed_reviews),
                     aggregated_review=json.dumps(review),
                 ),
-            }
+            },
         ]
     else:
-        llm_review, msg_history = get_response_from_llm(
-            base_prompt,
+        review = members[0]["review"]
+        msg_history = [
+            user_message,
+            get_adapter(model).assistant_message(members[0]["content"]),
+        ]
+
+    if num_reflections > 1:
+        reflect = partial(
+            reflect_with_full_history,
             model=model,
             client=client,
-            system_message=reviewer_system_prompt_neg,
-            print_debug=False,
-            msg_history=msg_history,
+            num_reflections=num_reflections,
             temperature=temperature,
+            checkpoint=checkpoint,
+            parse_retries=parse_retries,
+            params=params,
         )
-        review = extract_json_between_markers(llm_review)
+        if reflection_mode == "full":
+            review, stats = reflect(review, msg_history)
+        elif reflection_mode in ("compact", "compare"):
+            digest = paper_digest(text)
+            review_full = review
+            if reflection_mode == "compare":
+                review_full, stats_full = reflect(review, msg_history)
+            review, stats = reflect_with_compact_history(
+                review,
+                msg_history,
+                digest,
+                model,
+                client,
+                num_reflections,
+                temperature,
+                checkpoint=checkpoint,
+                parse_retries=parse_retries,
+                params=params,
+            )
+            if reflection_mode == "compare":
+                print_score_changes(review_full, review)
+                stats["tokens_sent_full_history"] = stats_full["tokens_sent"]
+        else:
+            raise ValueError(f"Unknown reflection mode {reflection_mode}")
 
-    if num_reflections > 1:
-        for j in range(num_reflections - 1):
+        print(
+            f"Reflection ({reflection_mode}): {stats['rounds']} rounds, "
+            f"~{stats['tokens_sent']} input tokens sent, "
+            f"~{stats['tokens_sent_full_history'] - stats['tokens_sent']} saved "
+            "compared with full-history reflection"
+        )
+    return review
+
+
+def estimate_tokens(messages: List[Dict[str, Any]], system_message: str = "") -> int:
+    """Rough input-token count (4 characters per token) of a request."""
+    chars = len(system_message)
+    for message in messages:
+        content = message["content"]
+        if isinstance(content, list):
+            chars += sum(len(block.get("text", "")) for block in content)
+        else:
+            chars += len(content)
+    return chars // 4
+
+
+def reflect_with_full_history(
+    review: Dict[str, Any],
+    msg_history: List[Dict[str, Any]],
+    model: str,
+    client: Any,
+    num_reflections: int,
+    temperature: float,
+    checkpoint: Optional[ReviewCheckpoint] = None,
+    parse_retries: int = 2,
+    params: Optional[Dict[str, Any]] = None,
+) -> Tuple[Dict[str, Any], Dict[str, int]]:
+    """Reflection rounds that resend the whole conversation, paper included."""
+    stats = {"rounds": 0, "tokens_sent": 0}
+    done = checkpoint.rounds("full") if checkpoint else []
+    for j in range(num_reflections - 1):
+        prompt = reviewer_reflection_prompt.format(
+            current_round=j + 2, num_reflections=num_reflections
+        )
+        if j < len(done):
+            # Answered before the last interruption
+            text = done[j]["content"]
+            msg_history = msg_history + [
+                get_adapter(model).user_message(prompt, None),
+                get_adapter(model).assistant_message(text),
+            ]
+            new_review = done[j]["review"]
+        else:
             print(f"Relection: {j + 2}/{num_reflections}")
-            text, msg_history = get_response_from_llm(
-                reviewer_reflection_prompt.format(
-                    current_round=j + 2, num_reflections=num_reflections
+            stats["rounds"] += 1
+            stats["tokens_sent"] += estimate_tokens(
+                msg_history + [{"role": "user", "content": prompt}],
+                reviewer_system_prompt_neg,
+            )
+            answer = valid_review(
+                partial(
+                    get_response_from_llm,
+                    prompt,
+                    client=client,
+                    model=model,
+                    system_message=reviewer_system_prompt_neg,
+                    lane=LLM_LANE,
+                    msg_history=msg_history,
+                    temperature=temperature,
+                    **(params or {}),
                 ),
-                client=client,
-                model=model,
-                system_message=reviewer_system_prompt_neg,
-                msg_history=msg_history,
-                temperature=temperature,
+                parse_retries,
+                f"Reflection {j + 2}",
             )
-            review = extract_json_between_markers(text)
-            assert review is not None, "Failed to extract JSON from LLM output"
-
-            if "I am done" in text:
-                print(f"Review generation converged after {j + 2} iterations.")
+            if answer is None:
+                # Keep the last valid review rather than lose the paper
                 break
-    return review
+            text, msg_history, new_review = answer
+            if checkpoint:
+                done.append({"content": text, "review": new_review})
+                checkpoint.save()
+
+        converged = "I am done" in text or new_review == review
+        review = new_review
+        if converged:
+            print(f"Review generation converged after {j + 2} iterations.")
+            break
+    stats["tokens_sent_full_history"] = stats["tokens_sent"]
+    return review, stats
+
+
+def reflect_with_compact_history(
+    review: Dict[str, Any],
+    msg_history: List[Dict[str, Any]],
+    digest: str,
+    model: str,
+    client: Any,
+    num_reflections: int,
+    temperature: float,
+    checkpoint: Optional[ReviewCheckpoint] = None,
+    parse_retries: int = 2,
+    params: Optional[Dict[str, Any]] = None,
+) -> Tuple[Dict[str, Any], Dict[str, int]]:
+    """Reflection rounds that send only a paper digest and the current review.
+
+    Also tracks what full-history reflection would have sent for the same
+    rounds, so the saving can be reported.
+    """
+    stats = {"rounds": 0, "tokens_sent": 0, "tokens_sent_full_history": 0}
+    full_history = list(msg_history)
+    done = checkpoint.rounds("compact") if checkpoint else []
+    for j in range(num_reflections - 1):
+        reflection_prompt = reviewer_reflection_prompt.format(
+            current_round=j + 2, num_reflections=num_reflections
+        )
+        full_history.append({"role": "user", "content": reflection_prompt})
+        if j < len(done):
+            # Answered before the last interruption
+            text, new_review = done[j]["content"], done[j]["review"]
+        else:
+            print(f"Relection: {j + 2}/{num_reflections}")
+            prompt = (
+                reviewer_compact_reflection_prompt.format(
+                    digest=digest, review=json.dumps(review, indent=2)
+                )
+                + "\n"
+                + reviewer_template_instructions
+                + "\n\n"
+                + reflection_prompt
+            )
+            stats["rounds"] += 1
+            stats["tokens_sent"] += estimate_tokens(
+                [{"role": "user", "content": prompt}], reviewer_system_prompt_neg
+            )
+            stats["tokens_sent_full_history"] += estimate_tokens(
+                full_history, reviewer_system_prompt_neg
+            )
+            answer = valid_review(
+                partial(
+                    get_response_from_llm,
+                    prompt,
+                    client=client,
+                    model=model,
+                    system_message=reviewer_system_prompt_neg,
+                    lane=LLM_LANE,
+                    msg_history=None,
+                    temperature=temperature,
+                    **(params or {}),
+                ),
+                parse_retries,
+                f"Reflection {j + 2}",
+            )
+            if answer is None:
+                # Keep the last valid review rather than lose the paper
+                break
+            text, _, new_review = answer
+            if checkpoint:
+                done.append({"content": text, "review": new_review})
+                checkpoint.save()
+        full_history.append({"role": "assistant", "content": text})
+
+        converged = "I am done" in text or new_review == review
+        review = new_review
+        if converged:
+            print(f"Review generation converged after {j + 2} iterations.")
+            break
+    return review, stats
+
+
+def paper_digest(text: str, max_chars: int = 4000) -> str:
+    """Title and abstract, section headings and the closing section of a paper."""
+    head = text[: max_chars // 2].strip()
+    headings = [
+        line.strip()
+        for line in text.splitlines()
+        if re.match(
+            r"^(#{1,3}\s+\S|\d{1,2}(\.\d{1,2})?\.?\s+[A-Z][^.]{2,60}$)", line.strip()
+        )
+    ]
+    outline = "\n".join(headings)[: max_chars // 4]
+    conclusion_start = max(
+        text.rfind("Conclusion"), text.rfind("CONCLUSION"), len(text) - max_chars // 4
+    )
+    conclusion = text[conclusion_start : conclusion_start + max_chars // 4].strip()
+    return f"{head}\n\n[Sections]\n{outline}\n\n[Closing section]\n{conclusion}"
+
+
+def print_score_changes(
+    full_review: Dict[str, Any], compact_review: Dict[str, Any]
+) -> None:
+    changes = [
+        f"{score} {full_review.get(score)} -> {compact_review.get(score)}"
+        for score in SCORE_LIMITS
+        if full_review.get(score) != compact_review.get(score)
+    ]
+    print(
+        "Score changes compared with full-history reflection: "
+        + (", ".join(changes) if changes else "none")
+    )
 
 
 def load_paper(pdf_path, num_pages=None, min_size=100):
@@ -239,7 +680,7 @@ def load_review(path):
     return loaded["review"]
 
 
-fewshot_dir = os.path.join(project_root, "scripts/prompts/review/fewshot_examples")
+fewshot_dir = os.path.join(project_root, "scripts/prompts/review/few_shot")
 fewshot_papers = [
     os.path.join(fewshot_dir, "132_automated_relational.pdf"),
     os.path.join(fewshot_dir, "attention.pdf"),
@@ -273,26 +714,122 @@ def get_review_fewshot_examples(num_fs_examples=1):
     return fewshot_prompt
 
 
-def get_meta_review(model, client, temperature, reviews):
+# Bump when the layout of the bundle changes so stale bundles are rebuilt
+PROMPT_BUNDLE_VERSION = 1
+
+
+def prompt_bundle_dir(review_config: Any) -> str:
+    """The [review] prompt_bundle_dir of the config being run."""
+    return os.path.join(
+        project_root,
+        review_config.get("prompt_bundle_dir", DEFAULT_PROMPT_BUNDLE_DIR),
+    )
+
+
+def prompt_bundle_sources(num_fs_examples: int) -> List[str]:
+    sources = []
+    for paper, review in zip(
+        fewshot_papers[:num_fs_examples], fewshot_reviews[:num_fs_examples]
+    ):
+        txt_path = paper.replace(".pdf", ".txt")
+        sources += [txt_path if os.path.exists(txt_path) else paper, review]
+    return sources
+
+
+def prompt_bundle_path(num_fs_examples: int, bundle_dir: str) -> str:
+    """Bundle file name derived from the format version and every input's content."""
+    digest = hashlib.sha256(reviewer_neurips_form.encode("utf-8"))
+    for source in prompt_bundle_sources(num_fs_examples):
+        with open(source, "rb") as f:
+            digest.update(f.read())
+    return os.path.join(
+        bundle_dir,
+        f"review_prefix_v{PROMPT_BUNDLE_VERSION}_fs{num_fs_examples}_{digest.hexdigest()[:16]}.txt",
+    )
+
+
+def build_review_prompt_bundle(num_fs_examples: int, bundle_path: str) -> None:
+    prefix = reviewer_neurips_form
+    if num_fs_examples > 0:
+        prefix += get_review_fewshot_examples(num_fs_examples)
+
+    os.makedirs(os.path.dirname(bundle_path), exist_ok=True)
+    # Every writer gets its own temp file, so concurrent builds (in other
+    # processes) never move each other's file away
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(bundle_path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(prefix)
+        os.replace(tmp_path, bundle_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    print(f"Built review prompt bundle {os.path.basename(bundle_path)}")
+
+
+# Review threads of one process load the prefix at the same time on a cold
+# cache; only the first builds the bundle
+prompt_bundle_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def cached_review_prompt_prefix(num_fs_examples: int, bundle_dir: str) -> str:
+    bundle_path = prompt_bundle_path(num_fs_examples, bundle_dir)
+    if not os.path.exists(bundle_path):
+        build_review_prompt_bundle(num_fs_examples, bundle_path)
+    with open(bundle_path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def load_review_prompt_prefix(
+    num_fs_examples: int, bundle_dir: str = DEFAULT_PROMPT_BUNDLE_DIR
+) -> str:
+    """Static review prompt prefix (form, instructions and few-shot examples),
+    bundled in `bundle_dir`."""
+    with prompt_bundle_lock:
+        return cached_review_prompt_prefix(num_fs_examples, bundle_dir)
+
+
+def get_meta_review(
+    model: str,
+    client: Any,
+    temperature: float,
+    reviews: List[Dict[str, Any]],
+    parse_retries: int = 2,
+    params: Optional[Dict[str, Any]] = None,
+) -> Optional[Dict[str, Any]]:
     # Write a meta-review from a set of individual reviews
     review_text = ""
     for i, r in enumerate(reviews):
         review_text += f"Review {i + 1}/{len(reviews)}:\n```\n{json.dumps(r)}\n```\n"
     base_prompt = reviewer_neurips_form + review_text
 
-    llm_review, msg_history = get_response_from_llm(
-        base_prompt,
-        model=model,
-        client=client,
-        system_message=reviewer_meta_system_prompt.format(reviewer_count=len(reviews)),
-        print_debug=False,
-        msg_history=None,
-        temperature=temperature,
+    answer = valid_review(
+        partial(
+            get_response_from_llm,
+            base_prompt,
+            model=model,
+            client=client,
+            system_message=reviewer_meta_system_prompt.format(
+                reviewer_count=len(reviews)
+            ),
+            lane=LLM_LANE,
+            print_debug=False,
+            msg_history=None,
+            temperature=temperature,
+            **(params or {}),
+        ),
+        parse_retries,
+        "Meta-review",
     )
-    meta_review = extract_json_between_markers(llm_review)
-    return meta_review
+    return answer[2] if answer else None
 
 
 def perform_improvement(review, coder):
     improvement_prompt = improvement_prompt.format(review=json.dumps(review))
     coder_out = coder.run(improvement_prompt)
+
+
+def run(config: configparser.ConfigParser) -> None:
+    perform_review(config)
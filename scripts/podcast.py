@@ -1,11 +1,24 @@
 from openai import OpenAI
 from datetime import datetime
 import os
+import re
 from pathlib import Path
 from pydub import AudioSegment
 import configparser
-from typing import List
+from typing import Callable, Dict, Iterable, List, Optional
 from utils.utils import open_file, cut_off_string
+from utils.paper_store import get_paper_store
+from utils.episode import Episode, open_episode
+from utils.tts import (
+    Replacements,
+    discard_stream_manifest,
+    load_streamed_segments,
+    pack_sentences,
+    prepare_tts_text,
+    replacements_from_config,
+    section_hash,
+    synthesize_segment,
+)
 
 
 def generate_podcast(config: configparser.ConfigParser) -> None:
@@ -15,44 +28,93 @@ def generate_podcast(config: configparser.ConfigParser) -> None:
 
     newsletter_content: str = open_file(newsletter_text_location).strip()
     audio_files_path: Path = Path(audio_files_path)
-    audio_files_path.mkdir(exist_ok=True)
+    audio_files_path.mkdir(parents=True, exist_ok=True)
 
-    segment_files: List[Path] = generate_audio_segments(
-        newsletter_content, audio_files_path, config
-    )
-    full_audio: AudioSegment = concatenate_audio_segments(segment_files)
+    output_mode: str = config.get("podcast", "output_mode", fallback="single")
+    if output_mode == "single":
+        segment_files: List[Path] = generate_audio_segments(
+            newsletter_content, audio_files_path, config
+        )
+        full_audio: AudioSegment = concatenate_audio_segments(segment_files)
+        save_final_audio(full_audio, audio_files_path)
+    else:
+        # Playable while the remaining segments are still being synthesized
+        episode: Episode = open_episode(
+            final_audio_path(audio_files_path),
+            f"Newsletter {datetime.now().strftime('%Y-%m-%d')}",
+            output_mode,
+            config.getfloat("podcast", "chunk_seconds", fallback=10),
+        )
+        print(f"Publishing the episode progressively ({output_mode})")
+        segment_files = generate_audio_segments(
+            newsletter_content, audio_files_path, config, episode.add_segment
+        )
+        print(f"Saved final audio to {episode.finish()}")
 
-    save_final_audio(full_audio, audio_files_path)
-    cleanup_segment_files(segment_files)
+    mark_papers_voiced(newsletter_content, config)
+    cleanup_segment_files(
+        set(segment_files) | set(audio_files_path.glob("stream_segment_*.mp3"))
+    )
+    discard_stream_manifest(audio_files_path)
 
 
 def generate_audio_segments(
-    content: str, audio_path: Path, config: configparser.ConfigParser
+    content: str,
+    audio_path: Path,
+    config: configparser.ConfigParser,
+    on_segment: Optional[Callable[[Path, Optional[str]], None]] = None,
 ) -> List[Path]:
-    """Generate audio segments from text content."""
+    """Generate audio segments from text content.
+
+    `on_segment` gets each segment as soon as it exists, in episode order,
+    with the section's heading for the first segment of every section."""
     cutoff_str: str = "\n" * 4
     remaining_text: str = content
     segment_files: List[Path] = []
     client: OpenAI = OpenAI(
         api_key=open(config.get("openai", "api_key_location")).read().strip()
     )
+    streamed: Dict[str, List[Path]] = load_streamed_segments(audio_path)
+    replacements: Replacements = replacements_from_config(config)
+    # Prepared text of the sections that still have to be voiced
+    pending: List[str] = []
+
+    def add_segment(segment_file: Path, chapter: Optional[str]) -> None:
+        segment_files.append(segment_file)
+        if on_segment:
+            on_segment(segment_file, chapter)
+
+    def voice_pending(chapter: Optional[str]) -> None:
+        for i, piece in enumerate(pack_sentences("\n\n".join(pending))):
+            segment_file_path: Path = audio_path / f"segment_{len(segment_files)}.mp3"
+            add_segment(
+                synthesize_segment(client, piece, segment_file_path),
+                chapter if i == 0 else None,
+            )
+        pending.clear()
 
     while remaining_text:
         segment_text, remaining_text = cut_off_string(remaining_text, cutoff_str)
 
         if not segment_text.strip():
             continue
+        heading = re.match(r"#+\s*(.+)", segment_text.strip())
+        chapter: Optional[str] = heading.group(1).strip() if heading else None
+
+        # Voiced already while summarize_papers was generating the text
+        if section_hash(segment_text) in streamed:
+            voice_pending(None)
+            for i, segment_file in enumerate(streamed[section_hash(segment_text)]):
+                add_segment(segment_file, chapter if i == 0 else None)
+            continue
 
-        response = client.audio.speech.create(
-            model="tts-1", voice="alloy", input=segment_text[:4096]
-        )
-
-        segment_file_path: Path = audio_path / f"segment_{len(segment_files)}.mp3"
-        with open(segment_file_path, "wb") as f:
-            for chunk in response.iter_bytes():
-                f.write(chunk)
-        segment_files.append(segment_file_path)
+        pending.append(prepare_tts_text(segment_text, replacements))
+        # Chapters have to start on a segment, so progressive output voices
+        # each section on its own; otherwise sections share requests
+        if on_segment:
+            voice_pending(chapter)
 
+    voice_pending(None)
     return segment_files
 
 
@@ -65,15 +127,27 @@ def concatenate_audio_segments(segment_files: List[Path]) -> AudioSegment:
     return full_audio
 
 
+def final_audio_path(audio_path: Path) -> Path:
+    date_str: str = datetime.now().strftime("%Y-%m-%d")
+    return audio_path / f"{date_str}_newsletter_podcast.mp3"
+
+
 def save_final_audio(audio: AudioSegment, audio_path: Path) -> None:
     """Save the final concatenated audio file."""
-    date_str: str = datetime.now().strftime("%Y-%m-%d")
-    print(f"Saving final audio to {audio_path} / {date_str}_newsletter_podcast.mp3")
-    final_audio_path: Path = audio_path / f"{date_str}_newsletter_podcast.mp3"
-    audio.export(final_audio_path, format="mp3")
+    print(f"Saving final audio to {final_audio_path(audio_path)}")
+    audio.export(final_audio_path(audio_path), format="mp3")
+
+
+def mark_papers_voiced(content: str, config: configparser.ConfigParser) -> None:
+    """Record every paper with a section in the newsletter as voiced."""
+    store = get_paper_store(config)
+    for base_filename in re.findall(r"^# (.+)$", content, flags=re.MULTILINE):
+        paper_id = store.find_by_filename(base_filename.strip())
+        if paper_id:
+            store.complete(paper_id, "voiced")
 
 
-def cleanup_segment_files(segment_files: List[Path]) -> None:
+def cleanup_segment_files(segment_files: Iterable[Path]) -> None:
     """Remove temporary audio segment files."""
     for segment_file in segment_files:
         os.remove(segment_file)
@@ -1,21 +1,167 @@
 import configparser
 import csv
+import hashlib
 import os
+import shutil
+import time
 import backoff
 import requests
 from configparser import ConfigParser
-from utils.weaviate_client import get_or_create_class, get_weaviate_client
+from utils.weaviate_client import (
+    get_or_create_class,
+    get_weaviate_client,
+    release_client,
+)
+from typing import Any, Dict, List, Optional, Set, Tuple
+from weaviate.classes.query import MetadataQuery
+from weaviate.util import generate_uuid5
+from utils.paper_store import PaperStore, file_hash, get_paper_store
+from utils.job_queue import get_job_queue, queue_enabled
+from utils.profiles import job_key, job_payload
+from utils.minhash import NearDuplicateIndex, dedupe_enabled, get_duplicate_index
+from utils.query_cache import QueryCache, cached_or_computed
+from utils.triage import get_triage, triage_enabled
+from utils.http_cache import CachedSession, OfflineCacheMiss, get_http_session
+
+
+def is_representative(
+    paper: Dict[str, Any],
+    index: NearDuplicateIndex,
+    store: PaperStore,
+    selected_clusters: Set[str],
+) -> bool:
+    """Whether `paper` is the first of its near-duplicate cluster to be picked.
+
+    Papers found before the index existed are added to it here."""
+    cluster_id = index.add(paper["arxiv_id"], paper["title"], paper["abstract"])
+    if cluster_id in selected_clusters:
+        print(f"Skipping near-duplicate {paper['arxiv_id']}: {paper['title']}")
+        return False
+    summarized = [
+        paper_id
+        for paper_id in index.members(cluster_id)
+        if paper_id != paper["arxiv_id"] and store.is_done(paper_id, "summarized")
+    ]
+    if summarized:
+        print(
+            f"Skipping {paper['arxiv_id']}: near-duplicate of {summarized[0]}, which is already summarized"
+        )
+        return False
+    selected_clusters.add(cluster_id)
+    return True
+
+
+def passage_hits(
+    chunk_class: Any, query_text: str, limit: int, alpha: float
+) -> List[Dict[str, Any]]:
+    return [
+        {"arxiv_id": o.properties["arxiv_id"], "score": o.metadata.score or 0.0}
+        for o in chunk_class.query.hybrid(
+            query=query_text,
+            limit=limit,
+            alpha=alpha,
+            return_metadata=MetadataQuery(score=True),
+        ).objects
+    ]
+
+
+def papers_by_passage(hits: List[Dict[str, Any]]) -> List[str]:
+    """Papers ordered by their best passage, ties broken by how many matched."""
+    best: Dict[str, Tuple[float, int]] = {}
+    for hit in hits:
+        score, matches = best.get(hit["arxiv_id"], (hit["score"], 0))
+        best[hit["arxiv_id"]] = (max(score, hit["score"]), matches + 1)
+    return sorted(best, key=lambda arxiv_id: best[arxiv_id], reverse=True)
+
+
+def fuse_rankings(rankings: List[List[str]], k: int = 60) -> List[str]:
+    """Reciprocal rank fusion: scores from different searches are not
+    comparable, but ranks are."""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, arxiv_id in enumerate(ranking):
+            scores[arxiv_id] = scores.get(arxiv_id, 0.0) + 1 / (k + rank + 1)
+    return sorted(scores, key=lambda arxiv_id: scores[arxiv_id], reverse=True)
+
+
+def with_passage_matches(
+    hybrid_results: List[Dict[str, Any]],
+    hits: List[Dict[str, Any]],
+    paper_class: Any,
+    cache: Optional[QueryCache],
+) -> List[Dict[str, Any]]:
+    """The abstract-level results re-ranked with the papers whose full text
+    matched, fetching the properties of papers only found by passage."""
+    found = {paper["arxiv_id"]: paper for paper in hybrid_results}
+    ranked = fuse_rankings(
+        [[paper["arxiv_id"] for paper in hybrid_results], papers_by_passage(hits)]
+    )
+    results = []
+    for arxiv_id in ranked:
+        if arxiv_id not in found:
+            found[arxiv_id] = cached_or_computed(
+                cache,
+                "paper",
+                {"arxiv_id": arxiv_id},
+                lambda: getattr(
+                    paper_class.query.fetch_object_by_id(generate_uuid5(arxiv_id)),
+                    "properties",
+                    None,
+                ),
+            )
+        if found[arxiv_id]:
+            results.append(found[arxiv_id])
+    return results
+
+
+def place_pdf(cached_path: str, pdf_path: str) -> None:
+    """Hardlink a downloaded PDF into the output folder, copying it where
+    links are not possible."""
+    if os.path.exists(pdf_path):
+        return
+    try:
+        os.link(cached_path, pdf_path)
+    except OSError:
+        shutil.copyfile(cached_path, pdf_path)
+
+
+def link_cached_body(session: requests.Session, url: str, path: str) -> bool:
+    """Hardlink the HTTP cache's copy of `url` to `path`, so a PDF is not
+    kept twice; False if it is not cached or links are not possible."""
+    body_path = (
+        session.cache.body_path(url) if isinstance(session, CachedSession) else None
+    )
+    if body_path is None:
+        return False
+    try:
+        os.link(body_path, path)
+    except OSError:
+        return False
+    return True
 
 
 @backoff.on_exception(backoff.expo, (requests.exceptions.RequestException,))
 def select_top_papers(config: ConfigParser) -> None:
     weaviate_config = config["weaviate"]
-    weaviate_client = get_weaviate_client()
+    weaviate_client = get_weaviate_client(weaviate_config)
     paper_class = get_or_create_class(
         weaviate_client, weaviate_config.get("papers_class_name")
     )
+    store = get_paper_store(config)
+    # Searches are answered from the cache until arxiv_search adds papers
+    cache = (
+        QueryCache(store, weaviate_config.get("papers_class_name"))
+        if config.getboolean("select_papers", "query_cache", fallback=True)
+        else None
+    )
+
     # Print the number of documents currently indexed in Weaviate
-    paper_count = paper_class.aggregate.over_all(total_count=True)
+    paper_count = cached_or_computed(
+        cache,
+        "count",
+        {},
+        lambda: paper_class.aggregate.over_all(total_count=True).total_count,
+    )
 
     print(f"Number of documents currently indexed in Weaviate: {paper_count}")
 
@@ -25,24 +171,125 @@ def select_top_papers(config: ConfigParser) -> None:
 
     queries = config.get("select_papers", "queries").split(",")
     results = []
+    limit = config.getint("select_papers", "number_of_papers_to_summarize")
+    alpha = config.getfloat("select_papers", "alpha", fallback=0.7)
+    # One paper per cluster of near-duplicates (other versions, cross-lists,
+    # companion papers), across all queries and earlier runs
+    index = get_duplicate_index(config) if dedupe_enabled(config) else None
+    selected_clusters: Set[str] = set()
+    # Full-text passages from index_chunks, once there are any
+    chunks_class_name = weaviate_config.get("chunks_class_name", "PaperChunks")
+    chunk_class = (
+        weaviate_client.collections.get(chunks_class_name)
+        if config.getboolean("select_papers", "passage_search", fallback=False)
+        and chunks_class_name in weaviate_client.collections.list_all()
+        else None
+    )
+    chunk_cache = (
+        QueryCache(store, chunks_class_name)
+        if cache is not None and chunk_class is not None
+        else None
+    )
+    passage_limit = config.getint("select_papers", "passage_limit", fallback=50)
+    # Abstracts below the triage threshold are never downloaded
+    triage = (
+        get_triage(
+            config,
+            [
+                config.get("select_papers", query_name.strip()).strip()
+                for query_name in queries
+            ],
+        )
+        if triage_enabled(config)
+        else None
+    )
+    threshold = config.getfloat("triage", "threshold", fallback=6)
+    rejected = 0
 
     for query_name in queries:
         query_name = query_name.strip()
         query_terms = config.get("select_papers", query_name).split(",")
         query_text = " ".join(query_terms)
 
-        # Perform hybrid search
-        hybrid_results = paper_class.query.hybrid(
-            query=query_text,
-            limit=config.getint("select_papers", "number_of_papers_to_summarize"),
+        # Perform hybrid search, with spare results to replace duplicates
+        search_limit = limit * 2 if index else limit
+        if triage is not None:
+            search_limit = max(
+                search_limit,
+                config.getint("triage", "candidates_per_query", fallback=limit * 5),
+            )
+        hybrid_results = cached_or_computed(
+            cache,
+            "hybrid",
+            {"query": query_text, "limit": search_limit, "alpha": alpha},
+            lambda: [
+                o.properties
+                for o in paper_class.query.hybrid(
+                    query=query_text, limit=search_limit, alpha=alpha
+                ).objects
+            ],
         )
 
-        for o in hybrid_results.objects:
-            print(o.properties)
-            results.append(o.properties)
+        if chunk_class is not None:
+            hits = cached_or_computed(
+                chunk_cache,
+                "hybrid",
+                {"query": query_text, "limit": passage_limit, "alpha": alpha},
+                lambda: passage_hits(chunk_class, query_text, passage_limit, alpha),
+            )
+            hybrid_results = with_passage_matches(
+                hybrid_results, hits, paper_class, cache
+            )
+
+        # Papers this profile already summarized would only take up a slot
+        hybrid_results = [
+            properties
+            for properties in hybrid_results
+            if not store.is_done(properties["arxiv_id"], "summarized")
+        ]
+
+        scores = triage.scores(hybrid_results) if triage is not None else {}
+        picked = 0
+        for properties in hybrid_results:
+            if picked == limit:
+                break
+            # Papers the model could not score are let through
+            score = scores.get(properties["arxiv_id"])
+            if score is not None and score < threshold:
+                rejected += 1
+                continue
+            if index is not None and not is_representative(
+                properties, index, store, selected_clusters
+            ):
+                continue
+            print(properties)
+            results.append(properties)
+            picked += 1
+    if triage is not None:
+        print(
+            f"Triage: {triage.scored} abstracts scored, {rejected} candidates below {threshold:g}"
+        )
+    caches = [c for c in (cache, chunk_cache) if c is not None]
+    answered = sum(c.hits for c in caches)
+    if answered:
+        print(
+            f"{answered} of {answered + sum(c.misses for c in caches)} Weaviate requests answered from cache"
+        )
 
     output_dir = config.get("select_papers", "output_dir")
     os.makedirs(output_dir, exist_ok=True)
+    # Every profile's downloads go through one folder, so a paper selected
+    # by several profiles is fetched once
+    pdf_cache = config.get("select_papers", "pdf_cache", fallback="")
+    if pdf_cache:
+        os.makedirs(pdf_cache, exist_ok=True)
+    # With the queue on, worker.py processes can start on a paper as soon
+    # as its PDF is here
+    queue = get_job_queue(config) if queue_enabled(config) else None
+    # A PDF URL names one version of a paper, so a cached PDF stays valid
+    session = get_http_session(
+        config, config.getfloat("http_cache", "settled_ttl_seconds", fallback=2592000)
+    )
 
     with open(
         os.path.join(output_dir, "papers_to_summarize.csv"),
@@ -70,8 +317,54 @@ def select_top_papers(config: ConfigParser) -> None:
             # potentially rewrite this title to look nicer
             filename = f"{published_date}-{paper['title'].replace(' ', '_').replace(':', '').replace(',', '')[:50]}"
 
-            with open(os.path.join(output_dir, f"{filename}.pdf"), "wb") as f:
-                f.write(requests.get(paper["pdf_url"]).content)
+            paper_id = store.add_paper(dict(paper, filename=filename))
+            for stage in ("found", "selected"):
+                if not store.is_done(paper_id, stage):
+                    store.complete(paper_id, stage)
+
+            pdf_path = os.path.join(output_dir, f"{filename}.pdf")
+            cached_path = (
+                os.path.join(pdf_cache, f"{filename}.pdf") if pdf_cache else ""
+            )
+            # Papers processed in an earlier run keep their PDF out of the
+            # folder (cleanup moves it to the vault) and are not fetched again
+            if store.is_done(paper_id, "downloaded") and (
+                os.path.exists(pdf_path) or store.is_done(paper_id, "summarized")
+            ):
+                print(f"Already downloaded {filename}.pdf")
+            elif cached_path and os.path.exists(cached_path):
+                place_pdf(cached_path, pdf_path)
+                if not store.is_done(paper_id, "downloaded"):
+                    store.complete(paper_id, "downloaded", file_hash(cached_path))
+                print(f"Reused the downloaded {filename}.pdf")
+            else:
+                start_time = time.time()
+                try:
+                    content = session.get(paper["pdf_url"]).content
+                except OfflineCacheMiss:
+                    print(
+                        f"{filename}.pdf is not in the HTTP cache; skipping it offline"
+                    )
+                    continue
+                if not (
+                    cached_path
+                    and link_cached_body(session, paper["pdf_url"], cached_path)
+                ):
+                    with open(cached_path or pdf_path, "wb") as f:
+                        f.write(content)
+                if cached_path:
+                    place_pdf(cached_path, pdf_path)
+                store.complete(
+                    paper_id,
+                    "downloaded",
+                    hashlib.sha256(content).hexdigest(),
+                    time.time() - start_time,
+                )
+                print(f"Downloaded {filename}.pdf")
+
+            if queue is not None and not store.is_done(paper_id, "summarized"):
+                payload = job_payload(config, paper_id, filename)
+                queue.enqueue("extract", payload, key=job_key("extract", payload))
 
             writer.writerow(
                 [
@@ -83,10 +376,9 @@ def select_top_papers(config: ConfigParser) -> None:
                     filename,
                 ]
             )
-            print(f"Downloaded {filename}.pdf")
 
     print(f"Selected top {len(results)} papers.")
-    weaviate_client.close()
+    release_client(weaviate_client)
 
 
 def run(config: configparser.ConfigParser) -> None:
@@ -1,93 +1,394 @@
 import configparser
 import os
-from typing import List, Dict, Optional
+from functools import partial
+from pathlib import Path
+from typing import Any, Callable, List, Dict, Optional, Tuple
 import openai
 from openai import OpenAI
-from utils.utils import read_lines_from_file, get_link, extract_text_from_pdf
+from utils.utils import (
+    read_lines_from_file,
+    extract_text_cached,
+    open_file,
+    pipeline_steps,
+)
+from utils.sections import text_for_step
+from utils.profiles import job_config, job_key, job_payload
+from utils.summary_cache import get_summary_cache
+from utils.paper_index import PaperIndex, paper_index_from_config
+from utils.paper_store import PaperStore, file_hash, get_paper_store, text_hash
+from utils.llm_gateway import get_gateway, get_openai_client
+from utils.tts import ParagraphSplitter, TTSWorker, replacements_from_config
+from utils.vault_sync import SyncItem, sync_to_vault
+from scripts.newsletter import assemble_newsletter
+from utils.job_queue import Job, get_job_queue, queue_enabled, work
 from configparser import ConfigParser
 import time
-import backoff
+
+# Gateway lane for this step's LLM calls, see [llm_gateway] lanes
+LLM_LANE = "summarize_papers"
+
+SUMMARY_MODEL = "gpt-4o-mini"
+
+SYNTHESIS_PROMPT = (
+    "Synthesize the above information into a concise summary of the paper's key contributions and significance. "
+    "Additionally, consider the practical implications of this research for a job search and recommendation system. "
+    "How could the findings or methods be applied to improve job matching, enhance candidate profiling, or optimize "
+    "search algorithms in the context of employment platforms? Provide specific examples of potential "
+    "applications or improvements."
+)
 
 
 def summarize_papers(config: ConfigParser) -> None:
     input_folder: str = config.get("summarize_papers", "input_folder")
     output_folder: str = config.get("summarize_papers", "output_folder")
-    csv_path: str = config.get(
-        "summarize_papers",
-        "csv_path",
-        fallback="data/pdfs-to-summarize/papers_to_summarize.csv",
-    )
 
     print("Starting summarization process...")
     os.makedirs(output_folder, exist_ok=True)
     pdf_files: List[str] = [f for f in os.listdir(input_folder) if f.endswith(".pdf")]
     print(f"Found {len(pdf_files)} PDF files to process")
 
-    summaries: str = ""
-    for i, pdf_file in enumerate(pdf_files, 1):
-        print(f"\nProcessing file {i}/{len(pdf_files)}: {pdf_file}")
-        start_time: float = time.time()
-
+    store: PaperStore = get_paper_store(config)
+    paper_ids: Dict[str, str] = {}
+    for pdf_file in pdf_files:
         base_filename: str = pdf_file.replace(".pdf", "")
+        paper_id: str = store.paper_for_file(base_filename)
         filename: str = f"{output_folder}/{base_filename}.md"
-        if os.path.exists(filename):
-            print("File already processed, skipping...")
-            continue
+        if os.path.exists(filename) and not store.is_done(paper_id, "summarized"):
+            # Summarized before the paper store tracked it
+            store.complete(paper_id, "summarized", file_hash(filename))
+        paper_ids[paper_id] = base_filename
+    pending: List[Tuple[str, str]] = [
+        (p["paper_id"], paper_ids[p["paper_id"]])
+        for p in store.pending("summarized")
+        if p["paper_id"] in paper_ids
+    ]
+    print(f"{len(pending)} of them still need a summary")
 
-        paper: Optional[str] = extract_text_from_pdf(f"{input_folder}/{pdf_file}")
-        print("Extracted text from PDF")
-        if paper:
-            summaries += (
-                f"\n\n\n\n# {base_filename}\n{get_link(base_filename, csv_path)}"
-            )
-            summaries += generate_summary(paper, config)
+    if queue_enabled(config):
+        summarize_with_workers(pending, store, config)
+        assemble_newsletter(config)
+        return
+
+    tts_worker: Optional[TTSWorker] = start_tts_worker(config)
+    paper_index: PaperIndex = paper_index_from_config(config)
 
-        with open(filename, "w", encoding="utf-8") as summary_file:
-            summary_file.write(summaries)
+    for i, (paper_id, base_filename) in enumerate(pending, 1):
+        print(f"\nProcessing file {i}/{len(pending)}: {base_filename}.pdf")
+        start_time: float = time.time()
 
-        print("Wrote summary to file")
+        if not store.claim(paper_id, "summarized"):
+            print("Claimed by another worker, skipping...")
+            continue
 
-        if config.getboolean("Obsidian", "send_to_obsidian", fallback=False):
-            try:
-                write_to_obsidian(base_filename, paper, summaries, config)
-            except Exception as e:
-                print(f"Error writing to Obsidian: {e}")
+        try:
+            with store.track(paper_id, "summarized") as result:
+                summarize_paper(
+                    paper_id,
+                    base_filename,
+                    input_folder,
+                    output_folder,
+                    paper_index,
+                    store,
+                    tts_worker,
+                    config,
+                )
+                result["content_hash"] = file_hash(
+                    f"{output_folder}/{base_filename}.md"
+                )
+        except Exception as e:
+            print(f"Error summarizing {base_filename}: {e}")
+            continue
 
         print(f"Processed in {time.time() - start_time:.2f} seconds")
-        print_progress_bar(i, len(pdf_files))
+        print_progress_bar(i, len(pending))
 
     print("\nAll files processed.")
-    with open("data/txt-summaries/newsletter.md", "w", encoding="utf-8") as outfile:
-        outfile.write(summaries)
+    if tts_worker:
+        tts_worker.close()
+    assemble_newsletter(config)
+
+
+def summarize_paper(
+    paper_id: str,
+    base_filename: str,
+    input_folder: str,
+    output_folder: str,
+    paper_index: PaperIndex,
+    store: PaperStore,
+    tts_worker: Optional[TTSWorker],
+    config: ConfigParser,
+) -> None:
+    filename: str = f"{output_folder}/{base_filename}.md"
+    extract_start: float = time.time()
+    paper: Optional[str] = extract_text_cached(
+        f"{input_folder}/{base_filename}.pdf",
+        config.get("queue", "text_folder", fallback=None),
+        config,
+    )
+    store.complete(
+        paper_id, "extracted", text_hash(paper or ""), time.time() - extract_start
+    )
+    print("Extracted text from PDF")
+    paper = text_for_step(paper or "", config, "summarize_papers")
+    summary: str = ""
+    if paper:
+        header: str = f"\n\n\n\n# {base_filename}\n{paper_index.link(base_filename)}"
+        summary = header + stream_summary(
+            paper, header, f"{filename}.partial", tts_worker, config
+        )
+        os.replace(f"{filename}.partial", filename)
+    else:
+        open(filename, "w", encoding="utf-8").close()
+
+    print("Wrote summary to file")
+
+    if config.getboolean("Obsidian", "send_to_obsidian", fallback=False):
+        try:
+            write_to_obsidian(base_filename, paper, summary, config)
+        except Exception as e:
+            print(f"Error writing to Obsidian: {e}")
+
+
+def summarize_with_workers(
+    pending: List[Tuple[str, str]], store: PaperStore, config: ConfigParser
+) -> None:
+    """Queue the pending papers and work the queue along with any worker.py
+    processes until nothing is left."""
+    queue = get_job_queue(config)
+    for paper_id, base_filename in pending:
+        payload = job_payload(config, paper_id, base_filename)
+        if store.is_done(paper_id, "extracted"):
+            queue.enqueue("summarize", payload, key=job_key("summarize", payload))
+        else:
+            queue.enqueue("extract", payload, key=job_key("extract", payload))
+    completed = work(
+        queue,
+        job_handlers(queue, config, ["extract", "summarize", "tts"]),
+        heartbeat_seconds=config.getfloat("queue", "heartbeat_seconds", fallback=60),
+        until_empty=True,
+    )
+    print(f"\nCompleted {completed} jobs in this process")
+
+
+def job_handlers(
+    queue: Any, config: ConfigParser, kinds: List[str]
+) -> Dict[str, Callable[[Job], None]]:
+    handlers = {
+        "extract": handle_extract_job,
+        "summarize": handle_summarize_job,
+        "tts": handle_tts_job,
+    }
+    return {kind: partial(handlers[kind], queue=queue, config=config) for kind in kinds}
+
+
+def handle_extract_job(job: Job, queue: Any, config: ConfigParser) -> None:
+    """Save a PDF's text for the summarize and review jobs, then queue them."""
+    config = job_config(config, job.payload)
+    paper_id: str = job.payload["paper_id"]
+    pdf_path: str = os.path.join(
+        config.get("summarize_papers", "input_folder"), f"{job.payload['filename']}.pdf"
+    )
+    start_time: float = time.time()
+    # Another profile's extract job may already have saved the text
+    text: str = extract_text_cached(
+        pdf_path, config.get("queue", "text_folder"), config
+    )
+    if not text:
+        # Retried, then dead-lettered, instead of summarizing an empty text
+        raise ValueError(f"No text could be extracted from {pdf_path}")
+    get_paper_store(config).complete(
+        paper_id, "extracted", text_hash(text), time.time() - start_time
+    )
+
+    queue.enqueue("summarize", job.payload, key=job_key("summarize", job.payload))
+    if "perform_review" in pipeline_steps(config):
+        queue.enqueue("review", job.payload, key=job_key("review", job.payload))
+
+
+def handle_summarize_job(job: Job, queue: Any, config: ConfigParser) -> None:
+    config = job_config(config, job.payload)
+    paper_id: str = job.payload["paper_id"]
+    base_filename: str = job.payload["filename"]
+    output_folder: str = config.get("summarize_papers", "output_folder")
+    store: PaperStore = get_paper_store(config)
+    if store.claim(paper_id, "summarized"):
+        os.makedirs(output_folder, exist_ok=True)
+        with store.track(paper_id, "summarized") as result:
+            summarize_paper(
+                paper_id,
+                base_filename,
+                config.get("summarize_papers", "input_folder"),
+                output_folder,
+                paper_index_from_config(config),
+                store,
+                None,
+                config,
+            )
+            result["content_hash"] = file_hash(f"{output_folder}/{base_filename}.md")
+    elif not store.is_done(paper_id, "summarized"):
+        raise RuntimeError(f"{base_filename} is being summarized by another worker")
+
+    if "podcast" in pipeline_steps(config) and config.getboolean(
+        "podcast", "synthesize_while_summarizing", fallback=False
+    ):
+        queue.enqueue("tts", job.payload, key=job_key("tts", job.payload))
+
+
+def handle_tts_job(job: Job, queue: Any, config: ConfigParser) -> None:
+    """Voice a paper's summary ahead of the podcast step, which reuses the audio."""
+    config = job_config(config, job.payload)
+    summary: str = open_file(
+        os.path.join(
+            config.get("summarize_papers", "output_folder"),
+            f"{job.payload['filename']}.md",
+        )
+    )
+    tts_worker = TTSWorker(
+        get_openai_client(config.get("openai", "api_key_location")),
+        Path(config.get("podcast", "audio_files_directory_path")),
+        replacements=replacements_from_config(config),
+    )
+    splitter = ParagraphSplitter()
+    for paragraph in splitter.feed(summary) + splitter.flush():
+        tts_worker.submit(paragraph)
+    tts_worker.end_section(summary)
+    tts_worker.close(raise_errors=True)
+
+
+def start_tts_worker(config: ConfigParser) -> Optional[TTSWorker]:
+    """Voice paragraphs as they are written when the podcast step will run."""
+    if "podcast" not in pipeline_steps(config) or not config.getboolean(
+        "podcast", "synthesize_while_summarizing", fallback=False
+    ):
+        return None
+    client: OpenAI = get_openai_client(config.get("openai", "api_key_location"))
+    return TTSWorker(
+        client,
+        Path(config.get("podcast", "audio_files_directory_path")),
+        replacements=replacements_from_config(config),
+    )
+
+
+def stream_summary(
+    paper: str,
+    header: str,
+    partial_filename: str,
+    tts_worker: Optional[TTSWorker],
+    config: ConfigParser,
+) -> str:
+    """Generate a paper's summary, appending it to its file as it arrives and
+    passing each finished paragraph on to the TTS worker."""
+    splitter = ParagraphSplitter()
+    written: List[str] = []
+    try:
+        with open(partial_filename, "w", encoding="utf-8") as summary_file:
+
+            def on_token(text: str) -> None:
+                summary_file.write(text)
+                written.append(text)
+                summary_file.flush()
+                if tts_worker:
+                    for paragraph in splitter.feed(text):
+                        tts_worker.submit(paragraph)
+
+            on_token(header)
+            # The same text and prompts were summarized before, e.g. for another profile
+            cache = get_summary_cache(config)
+            cache_key = (
+                cache.key(
+                    paper,
+                    SUMMARY_MODEL,
+                    config.get("summarize_papers", "prompts").split(",")
+                    + [SYNTHESIS_PROMPT],
+                )
+                if cache
+                else ""
+            )
+            cached = cache.get(cache_key) if cache else None
+            if cached is not None:
+                print("Reusing the summary of the same text with the same prompts")
+                summary: str = cached
+                on_token(summary)
+            elif config.getboolean("summarize_papers", "stream", fallback=True):
+                summary = generate_summary(paper, config, on_token)
+            else:
+                summary = generate_summary(paper, config)
+                on_token(summary)
+            if (
+                cache
+                and cached is None
+                and summary
+                and not summary.startswith("Error:")
+            ):
+                cache.put(cache_key, summary)
+    except BaseException:
+        # A summary cut off mid-stream is not kept, voiced or marked done
+        if os.path.exists(partial_filename):
+            os.remove(partial_filename)
+        if tts_worker:
+            tts_worker.discard_section()
+        raise
+    if tts_worker:
+        for paragraph in splitter.flush():
+            tts_worker.submit(paragraph)
+        tts_worker.end_section("".join(written))
+    return summary
 
 
-@backoff.on_exception(backoff.expo, (openai.RateLimitError, openai.APITimeoutError))
 def chatbot(
     conversation: List[Dict[str, str]],
     config: ConfigParser,
     model: str = "gpt-4o-mini",
     temperature: float = 0.7,
+    on_token: Optional[Callable[[str], None]] = None,
 ) -> str:
-    client: OpenAI = OpenAI(
-        api_key=open(config.get("openai", "api_key_location")).read().strip()
-    )
+    client: OpenAI = get_openai_client(config.get("openai", "api_key_location"))
+    system_message: str = conversation[0]["content"]
+
+    if on_token:
+        # Failures propagate so the summary is not stored half-written; once
+        # tokens were written the stream is not retried, as they would be
+        # written and voiced twice
+        parts: List[str] = []
+        try:
+            for text in get_gateway().stream(
+                client,
+                model,
+                system_message,
+                conversation[1:],
+                temperature=temperature,
+                max_tokens=16384,
+                lane=LLM_LANE,
+            ):
+                on_token(text)
+                parts.append(text)
+        except Exception as e:
+            if parts:
+                raise RuntimeError(
+                    f"Summary stream failed after {len(parts)} chunks: {e}"
+                ) from e
+            raise
+        return "".join(parts).strip()
 
     try:
-        response = client.chat.completions.create(
-            model=model,
-            messages=conversation,
-            temperature=temperature,
-            max_tokens=32768,
-            n=1,
-            stream=False,
+        result = (
+            get_gateway()
+            .complete(
+                client,
+                model,
+                system_message,
+                conversation[1:],
+                temperature=temperature,
+                # gpt-4o-mini's output limit
+                max_tokens=16384,
+                lane=LLM_LANE,
+            )[0]
+            .strip()
         )
-        result = "".join(
-            chunk.choices[0].delta.content or "" for chunk in response
-        ).strip()
+    except openai.RateLimitError:
+        raise
     except Exception as e:
         result = f"Error: {str(e)}"
-    finally:
-        client.close()
     return result
 
 
@@ -102,28 +403,24 @@ def determine_tags(abstract: str, config: ConfigParser) -> List[str]:
     return [term for term in include_terms if term.lower() in abstract.lower()][:10]
 
 
-def generate_summary(paper: str, config: ConfigParser) -> str:
+def generate_summary(
+    paper: str,
+    config: ConfigParser,
+    on_token: Optional[Callable[[str], None]] = None,
+) -> str:
     all_messages: List[Dict[str, str]] = [{"role": "system", "content": paper}]
     for prompt in config.get("summarize_papers", "prompts").split(","):
         all_messages.append({"role": "user", "content": prompt})
         all_messages.append(
-            {"role": "assistant", "content": chatbot(all_messages, config)}
+            {
+                "role": "assistant",
+                "content": chatbot(all_messages, config, model=SUMMARY_MODEL),
+            }
         )
 
-    all_messages.append(
-        {
-            "role": "user",
-            "content": (
-                "Synthesize the above information into a concise summary of the paper's key contributions and significance. "
-                "Additionally, consider the practical implications of this research for a job search and recommendation system. "
-                "How could the findings or methods be applied to improve job matching, enhance candidate profiling, or optimize "
-                "search algorithms in the context of employment platforms? Provide specific examples of potential "
-                "applications or improvements."
-            ),
-        }
-    )
+    all_messages.append({"role": "user", "content": SYNTHESIS_PROMPT})
     print("All messages : %s" % all_messages)
-    return chatbot(all_messages, config)
+    return chatbot(all_messages, config, model=SUMMARY_MODEL, on_token=on_token)
 
 
 def write_to_obsidian(
@@ -148,15 +445,13 @@ def write_to_obsidian(
         obsidian_attachments_location, f"{base_filename}.md"
     )
 
-    # Check if the file already exists
-    if os.path.exists(obsidian_filename):
-        print(f"Warning: File already exists: {obsidian_filename}")
-        return
-
+    # Rewrites the note when the summary changed, unless it was edited in Obsidian
     try:
-        with open(obsidian_filename, "w", encoding="utf-8") as f:
-            f.write(obsidian_content)
-        print(f"Wrote Obsidian file: {obsidian_filename}")
+        result = sync_to_vault(
+            [SyncItem(obsidian_filename, content=obsidian_content)],
+            config.get("Obsidian", "sync_link_mode", fallback="auto"),
+        )[obsidian_filename]
+        print(f"Obsidian file {obsidian_filename}: {result}")
     except IOError as e:
         print(f"Error writing file {obsidian_filename}: {e}")
 
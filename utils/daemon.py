@@ -0,0 +1,204 @@
+import json
+import signal
+import threading
+import time
+import traceback
+from configparser import ConfigParser
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, ContextManager, Dict, Iterator, List, Optional
+from utils.paper_store import get_paper_store
+from utils.query_cache import collection_version
+from utils.utils import pipeline_steps
+
+# `python main.py --daemon`: one long-lived process instead of a cron job.
+# Steps are imported once, and the Weaviate client, OpenAI client, LLM
+# gateway, paper store, review prompt bundle and marker service stay warm
+# between runs. arXiv is polled on a schedule; when a poll finds new papers
+# the rest of the pipeline runs right away, and the paper store makes each
+# run do only the work that is still missing. A local HTTP endpoint reports
+# status and takes requests to run now or stop:
+#
+#     curl localhost:8765/status
+#     curl -X POST localhost:8765/run
+#     curl -X POST localhost:8765/stop
+
+# The step that polls for new papers
+SEARCH_STEP = "arxiv_search"
+
+# Runs the given steps, entering the context returned for each step around it
+RunSteps = Callable[[List[str], Callable[[str], ContextManager]], None]
+
+
+class Daemon:
+    def __init__(self, config: ConfigParser, run_steps: RunSteps):
+        self.config = config
+        self.run_steps = run_steps
+        self.poll_seconds = config.getfloat("daemon", "poll_minutes", fallback=15) * 60
+        self.wake = threading.Event()
+        self.stopping = threading.Event()
+        self.forced = False
+        self.lock = threading.Lock()
+        self.status: Dict[str, Any] = {
+            "state": "starting",
+            "started_at": time.time(),
+            "runs": 0,
+            "last_poll": None,
+            "last_run": None,
+            "last_error": None,
+            "next_poll": None,
+        }
+
+    # Resources
+    def warm_up(self) -> None:
+        """Connect and load everything the steps would otherwise set up on
+        every run."""
+        from utils import weaviate_client
+        from utils.llm_gateway import get_gateway, get_openai_client
+
+        weaviate_client.keep_shared_client = True
+        weaviate_client.get_weaviate_client(self.config["weaviate"])
+        get_gateway()
+        get_openai_client(self.config.get("openai", "api_key_location"))
+        get_paper_store(self.config)
+        steps = pipeline_steps(self.config)
+        if "perform_review" in steps:
+            from scripts.perform_review import (
+                load_review_prompt_prefix,
+                prompt_bundle_dir,
+            )
+
+            load_review_prompt_prefix(
+                self.config.getint("review", "num_fs_examples", fallback=1),
+                prompt_bundle_dir(self.config["review"]),
+            )
+        if self.config.getboolean("marker", "use_for_extraction", fallback=False):
+            from utils.marker_service import ensure_service
+
+            ensure_service(self.config)
+
+    # Runs
+    def update(self, **values: Any) -> None:
+        with self.lock:
+            self.status.update(values)
+
+    @contextmanager
+    def tracking(self, step: str) -> Iterator[None]:
+        self.update(step=step)
+        yield
+
+    def papers_version(self) -> int:
+        return collection_version(
+            get_paper_store(self.config),
+            self.config.get("weaviate", "papers_class_name"),
+        )
+
+    def cycle(self, forced: bool) -> None:
+        """Poll arXiv, then run the other steps if it found papers (or always,
+        when the run was asked for)."""
+        steps = pipeline_steps(self.config)
+        started = time.time()
+        if SEARCH_STEP in steps:
+            before = self.papers_version()
+            self.update(state="polling")
+            self.run_steps([SEARCH_STEP], self.tracking)
+            self.update(last_poll=time.time())
+            found = self.papers_version() != before
+        else:
+            found = False
+        rest = [step for step in steps if step != SEARCH_STEP]
+        if rest and (found or forced):
+            self.update(state="running")
+            self.run_steps(rest, self.tracking)
+            self.update(last_run={"started_at": started, "finished_at": time.time()})
+            with self.lock:
+                self.status["runs"] += 1
+
+    def serve_forever(self) -> None:
+        self.warm_up()
+        forced = True
+        while not self.stopping.is_set():
+            try:
+                self.cycle(forced)
+                self.update(last_error=None)
+            except Exception as e:
+                traceback.print_exc()
+                self.update(last_error={"at": time.time(), "error": repr(e)})
+            self.update(
+                state="idle", step=None, next_poll=time.time() + self.poll_seconds
+            )
+            self.wake.wait(self.poll_seconds)
+            self.wake.clear()
+            with self.lock:
+                forced, self.forced = self.forced, False
+        self.update(state="stopped")
+
+    # Control
+    def trigger(self) -> None:
+        with self.lock:
+            self.forced = True
+        self.wake.set()
+
+    def stop(self) -> None:
+        self.stopping.set()
+        self.wake.set()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.lock:
+            status = dict(self.status)
+        status["papers"] = get_paper_store(self.config).counts()
+        return status
+
+
+def control_handler(daemon: Daemon) -> type:
+    class ControlHandler(BaseHTTPRequestHandler):
+        def log_message(self, format: str, *args: Any) -> None:
+            pass
+
+        def send_json(self, status: int, body: Dict[str, Any]) -> None:
+            data = json.dumps(body, indent=2).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self) -> None:
+            if self.path == "/status":
+                self.send_json(200, daemon.snapshot())
+            else:
+                self.send_json(404, {"error": "not found"})
+
+        def do_POST(self) -> None:
+            if self.path == "/run":
+                daemon.trigger()
+                self.send_json(202, {"queued": True})
+            elif self.path == "/stop":
+                daemon.stop()
+                self.send_json(202, {"stopping": True})
+            else:
+                self.send_json(404, {"error": "not found"})
+
+    return ControlHandler
+
+
+def run_daemon(config: ConfigParser, run_steps: RunSteps) -> None:
+    daemon = Daemon(config, run_steps)
+    host = config.get("daemon", "host", fallback="127.0.0.1")
+    port = config.getint("daemon", "port", fallback=8765)
+    server: Optional[ThreadingHTTPServer] = None
+    if port:
+        server = ThreadingHTTPServer((host, port), control_handler(daemon))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f"Daemon control endpoint on http://{host}:{port}")
+    if threading.current_thread() is threading.main_thread():
+        # Finish the run in progress on kill, as on Ctrl-C
+        signal.signal(signal.SIGTERM, lambda *_: daemon.stop())
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        daemon.stop()
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
@@ -0,0 +1,193 @@
+import json
+import math
+import os
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from utils.mp3 import Frame, chapter_tag, id3_length, read_frames, timestamp_tag
+
+# Progressive podcast output. Segments are added as soon as they are
+# synthesized and become playable right away, either as chunks of an HLS
+# playlist or appended to a growing MP3. The finished episode is built from
+# the same MP3 frames, so nothing is decoded or re-encoded.
+
+# Room left in the appendable MP3's ID3 tag so chapters can be rewritten in
+# place as they are added (a chapter takes roughly 100 bytes)
+CHAPTER_TAG_SIZE = 32 * 1024
+
+
+def write_atomically(path: Path, data: bytes) -> None:
+    temp_path = path.with_name(f".{path.name}.tmp")
+    with open(temp_path, "wb") as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+
+class Episode:
+    """Collects segments and chapter start times; subclasses decide where the
+    audio goes while the episode is still being generated."""
+
+    def __init__(self, final_path: Path, title: str):
+        self.final_path = final_path
+        self.title = title
+        self.seconds = 0.0
+        self.chapter_starts: List[Tuple[str, float]] = []
+
+    def add_segment(self, segment_file: Path, chapter: Optional[str] = None) -> None:
+        if chapter:
+            self.chapter_starts.append((chapter, self.seconds))
+        frames = read_frames(str(segment_file))
+        self.write_frames(frames)
+        self.seconds += sum(frame.seconds for frame in frames)
+
+    def chapters(self) -> List[Tuple[str, float, float]]:
+        ends = [start for _, start in self.chapter_starts[1:]] + [self.seconds]
+        return [
+            (title, start, end)
+            for (title, start), end in zip(self.chapter_starts, ends)
+        ]
+
+    def write_chapters_json(self) -> None:
+        # Podcasting 2.0 chapters file, for players that read chapters from
+        # the feed rather than from the MP3
+        chapters: Dict = {
+            "version": "1.2.0",
+            "chapters": [
+                {"startTime": round(start, 3), "title": title}
+                for title, start, _ in self.chapters()
+            ],
+        }
+        write_atomically(
+            self.final_path.with_suffix(".chapters.json"),
+            json.dumps(chapters, indent=2).encode("utf-8"),
+        )
+
+    def write_frames(self, frames: List[Frame]) -> None:
+        raise NotImplementedError
+
+    def finish(self) -> Path:
+        raise NotImplementedError
+
+
+class HLSEpisode(Episode):
+    """Writes fixed-duration MP3 chunks and an HLS event playlist that lists
+    each chunk once it is complete."""
+
+    def __init__(self, final_path: Path, title: str, chunk_seconds: float):
+        super().__init__(final_path, title)
+        self.chunk_seconds = chunk_seconds
+        self.chunk_dir = final_path.with_suffix("")
+        self.chunk_dir.mkdir(parents=True, exist_ok=True)
+        for old_chunk in self.chunk_dir.glob("chunk_*.mp3"):
+            os.remove(old_chunk)
+        self.playlist_path = self.chunk_dir / "index.m3u8"
+        self.chunks: List[Tuple[str, float]] = []
+        self.pending: List[Frame] = []
+        self.pending_seconds = 0.0
+        self.write_playlist(ended=False)
+
+    def write_frames(self, frames: List[Frame]) -> None:
+        for frame in frames:
+            if (
+                self.pending
+                and self.pending_seconds + frame.seconds > self.chunk_seconds
+            ):
+                self.write_chunk()
+            self.pending.append(frame)
+            self.pending_seconds += frame.seconds
+
+    def write_chunk(self) -> None:
+        start = sum(seconds for _, seconds in self.chunks)
+        name = f"chunk_{len(self.chunks):05d}.mp3"
+        write_atomically(
+            self.chunk_dir / name,
+            timestamp_tag(start) + b"".join(frame.data for frame in self.pending),
+        )
+        self.chunks.append((name, self.pending_seconds))
+        self.pending, self.pending_seconds = [], 0.0
+        self.write_playlist(ended=False)
+
+    def write_playlist(self, ended: bool) -> None:
+        lines = [
+            "#EXTM3U",
+            "#EXT-X-VERSION:3",
+            "#EXT-X-PLAYLIST-TYPE:EVENT",
+            f"#EXT-X-TARGETDURATION:{math.ceil(self.chunk_seconds)}",
+            "#EXT-X-MEDIA-SEQUENCE:0",
+        ]
+        for name, seconds in self.chunks:
+            lines += [f"#EXTINF:{seconds:.3f},", name]
+        if ended:
+            lines.append("#EXT-X-ENDLIST")
+        write_atomically(self.playlist_path, ("\n".join(lines) + "\n").encode("utf-8"))
+
+    def finish(self) -> Path:
+        if self.pending:
+            self.write_chunk()
+        self.write_playlist(ended=True)
+        # The full episode is the chunks' frames behind a tag with the chapters
+        temp_path = self.final_path.with_name(f".{self.final_path.name}.tmp")
+        with open(temp_path, "wb") as out:
+            out.write(chapter_tag(self.title, self.chapters()))
+            for name, _ in self.chunks:
+                with open(self.chunk_dir / name, "rb") as f:
+                    data = f.read()
+                out.write(data[id3_length(data) :])
+        os.replace(temp_path, self.final_path)
+        self.write_chapters_json()
+        return self.final_path
+
+
+class AppendableEpisode(Episode):
+    """Appends frames to the episode MP3 as they arrive, so it can be played
+    while it grows. The chapter tag at the start of the file is padded and
+    rewritten in place whenever a chapter is added."""
+
+    def __init__(self, final_path: Path, title: str):
+        super().__init__(final_path, title)
+        final_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(final_path, "wb") as f:
+            f.write(chapter_tag(title, [], padding=CHAPTER_TAG_SIZE))
+        self.tag_size = CHAPTER_TAG_SIZE + len(chapter_tag(title, []))
+
+    def add_segment(self, segment_file: Path, chapter: Optional[str] = None) -> None:
+        super().add_segment(segment_file, chapter)
+        if chapter:
+            self.write_tag()
+
+    def write_frames(self, frames: List[Frame]) -> None:
+        with open(self.final_path, "ab") as f:
+            f.write(b"".join(frame.data for frame in frames))
+
+    def write_tag(self) -> None:
+        tag = chapter_tag(self.title, self.chapters())
+        if len(tag) > self.tag_size:
+            self.rewrite_with_tag()
+            return
+        tag = chapter_tag(self.title, self.chapters(), self.tag_size - len(tag))
+        with open(self.final_path, "r+b") as f:
+            f.write(tag)
+
+    def rewrite_with_tag(self) -> None:
+        """More chapters than the padding holds: copy the audio behind a bigger tag."""
+        with open(self.final_path, "rb") as f:
+            f.seek(self.tag_size)
+            audio = f.read()
+        tag = chapter_tag(self.title, self.chapters(), CHAPTER_TAG_SIZE)
+        write_atomically(self.final_path, tag + audio)
+        self.tag_size = len(tag)
+
+    def finish(self) -> Path:
+        # The last chapter ends where the audio ends
+        self.write_tag()
+        self.write_chapters_json()
+        return self.final_path
+
+
+def open_episode(
+    final_path: Path, title: str, mode: str, chunk_seconds: float = 10
+) -> Episode:
+    if mode == "hls":
+        return HLSEpisode(final_path, title, chunk_seconds)
+    if mode == "appendable":
+        return AppendableEpisode(final_path, title)
+    raise ValueError(f"Unknown podcast output mode: {mode}")
@@ -0,0 +1,245 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from functools import lru_cache
+from typing import Any, Dict, Optional
+import requests
+from requests.structures import CaseInsensitiveDict
+
+# On-disk HTTP cache for arXiv traffic (API pages and PDFs). A response is
+# reused without a request while it is younger than its TTL; after that it
+# is revalidated with If-None-Match / If-Modified-Since when the server
+# sent an ETag or Last-Modified, so an unchanged resource costs a 304 and
+# no body. The least recently used responses are evicted beyond the size
+# limit. In offline mode every response comes from the cache (replaying
+# what earlier runs fetched) and nothing goes to the network.
+#
+# Each response is kept as <key>.body plus <key>.json (URL, validators,
+# when it was stored), keyed by the hash of the URL.
+
+# Response headers kept with the body
+KEPT_HEADERS = ["Content-Type", "ETag", "Last-Modified"]
+
+
+class OfflineCacheMiss(LookupError):
+    """Offline mode and the URL was never fetched."""
+
+
+class HTTPCache:
+    def __init__(
+        self,
+        folder: str,
+        ttl_seconds: float = 3600,
+        max_bytes: int = 2 * 1024**3,
+        offline: bool = False,
+    ):
+        os.makedirs(folder, exist_ok=True)
+        self.folder = folder
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.lock = threading.Lock()
+        self.total_bytes: Optional[int] = None
+        self.stats = {"fresh": 0, "revalidated": 0, "fetched": 0}
+
+    def paths(self, url: str) -> Dict[str, str]:
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        base = os.path.join(self.folder, key)
+        return {"body": f"{base}.body", "meta": f"{base}.json"}
+
+    def load(self, url: str) -> Optional[Dict[str, Any]]:
+        paths = self.paths(url)
+        try:
+            with open(paths["meta"]) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if meta.get("url") != url or not os.path.exists(paths["body"]):
+            return None
+        return meta
+
+    def body_path(self, url: str) -> Optional[str]:
+        """Where the cached body of `url` is kept, if it is cached."""
+        return self.paths(url)["body"] if self.load(url) is not None else None
+
+    def body(self, url: str) -> bytes:
+        path = self.paths(url)["body"]
+        with open(path, "rb") as f:
+            content = f.read()
+        # Recently used entries are the last to be evicted
+        os.utime(path)
+        return content
+
+    def is_fresh(self, meta: Dict[str, Any], ttl: Optional[float]) -> bool:
+        ttl = self.ttl_seconds if ttl is None else ttl
+        return self.offline or time.time() - meta["stored_at"] < ttl
+
+    def fresh_body(self, url: str, ttl: Optional[float] = None) -> Optional[bytes]:
+        """The cached body if it can be used without asking the server."""
+        meta = self.load(url)
+        if meta is None:
+            if self.offline:
+                raise OfflineCacheMiss(url)
+            return None
+        if not self.is_fresh(meta, ttl):
+            return None
+        self.stats["fresh"] += 1
+        return self.body(url)
+
+    def store(self, url: str, response: requests.Response) -> None:
+        paths = self.paths(url)
+        meta = {
+            "url": url,
+            "status": response.status_code,
+            "headers": {
+                name: response.headers[name]
+                for name in KEPT_HEADERS
+                if name in response.headers
+            },
+            "stored_at": time.time(),
+        }
+        with self.lock:
+            old_size = (
+                os.path.getsize(paths["body"]) if os.path.exists(paths["body"]) else 0
+            )
+            for path, data in (
+                (paths["body"], response.content),
+                (paths["meta"], json.dumps(meta).encode("utf-8")),
+            ):
+                with open(f"{path}.tmp", "wb") as f:
+                    f.write(data)
+                os.replace(f"{path}.tmp", path)
+            if self.total_bytes is not None:
+                self.total_bytes += len(response.content) - old_size
+        self.evict()
+
+    def refresh(self, url: str, meta: Dict[str, Any]) -> None:
+        """The server confirmed the cached response; it is fresh again."""
+        meta["stored_at"] = time.time()
+        path = self.paths(url)["meta"]
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(meta, f)
+        os.replace(f"{path}.tmp", path)
+
+    def evict(self) -> None:
+        with self.lock:
+            if self.total_bytes is None:
+                self.total_bytes = sum(
+                    entry.stat().st_size
+                    for entry in os.scandir(self.folder)
+                    if entry.name.endswith(".body")
+                )
+            if self.total_bytes <= self.max_bytes:
+                return
+            bodies = sorted(
+                (
+                    entry
+                    for entry in os.scandir(self.folder)
+                    if entry.name.endswith(".body")
+                ),
+                key=lambda entry: entry.stat().st_mtime,
+            )
+            for entry in bodies:
+                if self.total_bytes <= self.max_bytes:
+                    break
+                self.total_bytes -= entry.stat().st_size
+                os.remove(entry.path)
+                meta_path = entry.path[: -len(".body")] + ".json"
+                if os.path.exists(meta_path):
+                    os.remove(meta_path)
+
+    def cached_response(self, url: str, meta: Dict[str, Any]) -> requests.Response:
+        response = requests.Response()
+        response.status_code = meta["status"]
+        response.headers = CaseInsensitiveDict(meta["headers"])
+        response.url = url
+        response._content = self.body(url)
+        response.from_cache = True
+        return response
+
+    def get(
+        self,
+        session: requests.Session,
+        url: str,
+        ttl: Optional[float] = None,
+        **kwargs: Any,
+    ) -> requests.Response:
+        """GET `url` through the cache."""
+        meta = self.load(url)
+        if meta is None and self.offline:
+            raise OfflineCacheMiss(url)
+        if meta is not None and self.is_fresh(meta, ttl):
+            self.stats["fresh"] += 1
+            return self.cached_response(url, meta)
+
+        headers = dict(kwargs.pop("headers", None) or {})
+        if meta is not None:
+            if "ETag" in meta["headers"]:
+                headers["If-None-Match"] = meta["headers"]["ETag"]
+            if "Last-Modified" in meta["headers"]:
+                headers["If-Modified-Since"] = meta["headers"]["Last-Modified"]
+        response = requests.Session.request(
+            session, "GET", url, headers=headers, **kwargs
+        )
+        if response.status_code == 304 and meta is not None:
+            self.stats["revalidated"] += 1
+            self.refresh(url, meta)
+            return self.cached_response(url, meta)
+        self.stats["fetched"] += 1
+        if response.status_code == 200:
+            self.store(url, response)
+        return response
+
+    def summary(self) -> str:
+        return (
+            f"{self.stats['fresh']} from cache, {self.stats['revalidated']} "
+            f"revalidated, {self.stats['fetched']} fetched"
+        )
+
+
+class CachedSession(requests.Session):
+    """A requests session whose GETs go through an `HTTPCache`. Set `ttl`
+    to override the cache's TTL for the following requests."""
+
+    def __init__(self, cache: HTTPCache):
+        super().__init__()
+        self.cache = cache
+        self.ttl: Optional[float] = None
+
+    def request(self, method: str, url: str, **kwargs: Any) -> requests.Response:
+        if method.upper() != "GET" or kwargs.get("stream"):
+            return super().request(method, url, **kwargs)
+        return self.cache.get(self, url, self.ttl, **kwargs)
+
+
+@lru_cache(maxsize=None)
+def open_http_cache(
+    folder: str, ttl_seconds: float, max_bytes: int, offline: bool
+) -> HTTPCache:
+    return HTTPCache(folder, ttl_seconds, max_bytes, offline)
+
+
+def http_cache_enabled(config: Any) -> bool:
+    return config.getboolean("http_cache", "enabled", fallback=False)
+
+
+def get_http_cache(config: Any) -> HTTPCache:
+    """The shared cache for the configured [http_cache] folder."""
+    return open_http_cache(
+        config.get("http_cache", "folder", fallback="data/http-cache"),
+        config.getfloat("http_cache", "ttl_seconds", fallback=3600),
+        int(config.getfloat("http_cache", "max_size_mb", fallback=2048) * 1024**2),
+        config.getboolean("http_cache", "offline", fallback=False),
+    )
+
+
+def get_http_session(config: Any, ttl: Optional[float] = None) -> requests.Session:
+    """A session for arXiv requests: cached, with `ttl` or the configured
+    TTL, when [http_cache] is enabled."""
+    if not http_cache_enabled(config):
+        return requests.Session()
+    session = CachedSession(get_http_cache(config))
+    session.ttl = ttl
+    return session
@@ -0,0 +1,513 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from utils.paper_store import worker_name
+
+# Work queue for running extract, summarize, review and TTS jobs in several
+# worker processes, on one machine or many. A worker leases a job for
+# `lease_seconds` and keeps the lease alive with heartbeats; a job whose
+# worker died is handed out again once its lease runs out. Failed jobs are
+# retried with a growing delay and moved to the dead-letter list after
+# `max_attempts`. Jobs are deduplicated by key, so enqueueing the same work
+# twice is harmless.
+#
+# Two backends: a SQLite file (one machine, or a shared disk) and Redis or
+# any Redis-compatible server (several machines), selected by [queue] backend.
+
+JOB_KINDS = ["extract", "summarize", "review", "tts"]
+
+
+class Job:
+    def __init__(
+        self,
+        job_id: str,
+        kind: str,
+        payload: Dict[str, Any],
+        attempts: int = 0,
+        worker: Optional[str] = None,
+    ):
+        self.id = job_id
+        self.kind = kind
+        self.payload = payload
+        self.attempts = attempts
+        self.worker = worker
+
+    def __repr__(self) -> str:
+        return f"Job({self.kind}, {self.payload}, attempts={self.attempts})"
+
+
+class SQLiteJobQueue:
+    def __init__(
+        self,
+        db_path: str,
+        lease_seconds: float = 300,
+        max_attempts: int = 3,
+        retry_delay_seconds: float = 30,
+    ):
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_delay_seconds = retry_delay_seconds
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(
+            db_path, timeout=30, check_same_thread=False, isolation_level=None
+        )
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                job_key TEXT NOT NULL UNIQUE,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                worker TEXT,
+                available_at REAL NOT NULL,
+                lease_until REAL,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (status, kind, available_at);
+            """)
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.connection
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.connection.execute("COMMIT")
+
+    def enqueue(
+        self, kind: str, payload: Dict[str, Any], key: Optional[str] = None
+    ) -> bool:
+        """Add a job; False if a job with the same key is already queued or done."""
+        now = time.time()
+        with self.transaction() as db:
+            cursor = db.execute(
+                """INSERT INTO jobs (id, kind, job_key, payload, status,
+                    available_at, created_at, updated_at)
+                VALUES (?, ?, ?, ?, 'queued', ?, ?, ?)
+                ON CONFLICT (job_key) DO NOTHING""",
+                [
+                    uuid.uuid4().hex,
+                    kind,
+                    key or f"{kind}:{json.dumps(payload, sort_keys=True)}",
+                    json.dumps(payload),
+                    now,
+                    now,
+                    now,
+                ],
+            )
+            return cursor.rowcount == 1
+
+    def lease(self, kinds: List[str], worker: Optional[str] = None) -> Optional[Job]:
+        """Take the oldest ready job of one of `kinds`, or None if there is none."""
+        now = time.time()
+        worker = worker or worker_name()
+        with self.transaction() as db:
+            # Jobs whose worker stopped sending heartbeats go back to the
+            # queue, or to the dead letters if that was their last attempt
+            db.execute(
+                """UPDATE jobs SET status = 'dead', worker = NULL, lease_until = NULL,
+                    error = 'lease expired', updated_at = ?
+                WHERE status = 'leased' AND lease_until < ? AND attempts >= ?""",
+                [now, now, self.max_attempts],
+            )
+            db.execute(
+                """UPDATE jobs SET status = 'queued', worker = NULL, updated_at = ?
+                WHERE status = 'leased' AND lease_until < ?""",
+                [now, now],
+            )
+            row = db.execute(
+                f"""SELECT * FROM jobs
+                WHERE status = 'queued' AND available_at <= ?
+                AND kind IN ({', '.join('?' for _ in kinds)})
+                ORDER BY available_at LIMIT 1""",
+                [now, *kinds],
+            ).fetchone()
+            if row is None:
+                return None
+            db.execute(
+                """UPDATE jobs SET status = 'leased', worker = ?, lease_until = ?,
+                    attempts = attempts + 1, updated_at = ?
+                WHERE id = ?""",
+                [worker, now + self.lease_seconds, now, row["id"]],
+            )
+        return Job(
+            row["id"],
+            row["kind"],
+            json.loads(row["payload"]),
+            row["attempts"] + 1,
+            worker,
+        )
+
+    def heartbeat(self, job: Job) -> bool:
+        """Extend the lease; False if the job was meanwhile handed to someone else."""
+        now = time.time()
+        with self.transaction() as db:
+            cursor = db.execute(
+                """UPDATE jobs SET lease_until = ?, updated_at = ?
+                WHERE id = ? AND status = 'leased' AND worker = ?""",
+                [now + self.lease_seconds, now, job.id, job.worker],
+            )
+            return cursor.rowcount == 1
+
+    def complete(self, job: Job) -> None:
+        with self.transaction() as db:
+            db.execute(
+                """UPDATE jobs SET status = 'done', lease_until = NULL, error = NULL,
+                    updated_at = ?
+                WHERE id = ? AND worker = ?""",
+                [time.time(), job.id, job.worker],
+            )
+
+    def fail(self, job: Job, error: str) -> None:
+        """Retry the job later, or dead-letter it once it is out of attempts."""
+        now = time.time()
+        dead = job.attempts >= self.max_attempts
+        with self.transaction() as db:
+            db.execute(
+                """UPDATE jobs SET status = ?, lease_until = NULL, worker = NULL,
+                    available_at = ?, error = ?, updated_at = ?
+                WHERE id = ? AND worker = ?""",
+                [
+                    "dead" if dead else "queued",
+                    now + self.retry_delay_seconds * 2 ** (job.attempts - 1),
+                    error,
+                    now,
+                    job.id,
+                    job.worker,
+                ],
+            )
+
+    def dead_letters(self) -> List[Dict[str, Any]]:
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT * FROM jobs WHERE status = 'dead' ORDER BY updated_at"
+            ).fetchall()
+        return [dict(row, payload=json.loads(row["payload"])) for row in rows]
+
+    def requeue_dead(self) -> int:
+        """Give every dead-lettered job a fresh set of attempts."""
+        now = time.time()
+        with self.transaction() as db:
+            return db.execute(
+                """UPDATE jobs SET status = 'queued', attempts = 0, available_at = ?,
+                    updated_at = ?
+                WHERE status = 'dead'""",
+                [now, now],
+            ).rowcount
+
+    def outstanding(self, kinds: List[str]) -> int:
+        """Jobs of `kinds` that are queued or being worked on."""
+        with self.lock:
+            return self.connection.execute(
+                f"""SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'leased')
+                AND kind IN ({', '.join('?' for _ in kinds)})""",
+                kinds,
+            ).fetchone()[0]
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT kind, status, COUNT(*) AS n FROM jobs GROUP BY kind, status"
+            ).fetchall()
+        stats: Dict[str, Dict[str, int]] = {}
+        for row in rows:
+            stats.setdefault(row["kind"], {})[row["status"]] = row["n"]
+        return stats
+
+
+# Moves between the ready list, the leased set and the delayed set run as
+# Lua scripts, so a worker that dies halfway never loses a job, and only the
+# worker holding a lease can complete or fail its job.
+
+# KEYS: ready list, leased set. ARGV: job key prefix, lease expiry, worker
+LEASE_SCRIPT = """
+local job_id = redis.call('RPOP', KEYS[1])
+if not job_id then return nil end
+local job_key = ARGV[1] .. job_id
+redis.call('ZADD', KEYS[2], ARGV[2], job_id)
+local attempts = redis.call('HINCRBY', job_key, 'attempts', 1)
+redis.call('HSET', job_key, 'status', 'leased', 'worker', ARGV[3])
+return {job_id, attempts, redis.call('HGET', job_key, 'payload')}
+"""
+
+# KEYS: leased or delayed set, job hash, dead list.
+# ARGV: job id, ready list prefix, max attempts ("" to always requeue)
+RELEASE_SCRIPT = """
+if redis.call('ZREM', KEYS[1], ARGV[1]) == 0 then return 0 end
+redis.call('HDEL', KEYS[2], 'worker')
+local attempts = tonumber(redis.call('HGET', KEYS[2], 'attempts'))
+if ARGV[3] ~= '' and attempts >= tonumber(ARGV[3]) then
+    redis.call('HSET', KEYS[2], 'status', 'dead', 'error', 'lease expired')
+    redis.call('RPUSH', KEYS[3], ARGV[1])
+    return 1
+end
+redis.call('HSET', KEYS[2], 'status', 'queued')
+redis.call('RPUSH', ARGV[2] .. redis.call('HGET', KEYS[2], 'kind'), ARGV[1])
+return 1
+"""
+
+# KEYS: job hash, leased set. ARGV: job id, worker
+COMPLETE_SCRIPT = """
+if redis.call('HGET', KEYS[1], 'worker') ~= ARGV[2] then return 0 end
+redis.call('ZREM', KEYS[2], ARGV[1])
+redis.call('HSET', KEYS[1], 'status', 'done')
+redis.call('HDEL', KEYS[1], 'worker', 'error')
+return 1
+"""
+
+# KEYS: job hash, leased set, dead list, delayed set.
+# ARGV: job id, worker, error, dead ("1" or "0"), retry time
+FAIL_SCRIPT = """
+if redis.call('HGET', KEYS[1], 'worker') ~= ARGV[2] then return 0 end
+redis.call('ZREM', KEYS[2], ARGV[1])
+redis.call('HDEL', KEYS[1], 'worker')
+if ARGV[4] == '1' then
+    redis.call('HSET', KEYS[1], 'status', 'dead', 'error', ARGV[3])
+    redis.call('RPUSH', KEYS[3], ARGV[1])
+else
+    redis.call('HSET', KEYS[1], 'status', 'queued', 'error', ARGV[3])
+    redis.call('ZADD', KEYS[4], ARGV[5], ARGV[1])
+end
+return 1
+"""
+
+
+class RedisJobQueue:
+    """The same queue on a Redis-compatible server.
+
+    Each kind has a ready list; leased jobs sit in a sorted set scored by
+    lease expiry, delayed retries in one scored by when they become ready."""
+
+    def __init__(
+        self,
+        url: str,
+        prefix: str = "paper_pipeline",
+        lease_seconds: float = 300,
+        max_attempts: int = 3,
+        retry_delay_seconds: float = 30,
+    ):
+        try:
+            import redis
+        except ImportError as e:
+            raise ImportError(
+                "The redis queue backend needs the redis package: pip install redis"
+            ) from e
+        self.redis = redis.Redis.from_url(url, decode_responses=True)
+        self.prefix = prefix
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_delay_seconds = retry_delay_seconds
+        self.lease_script = self.redis.register_script(LEASE_SCRIPT)
+        self.release_script = self.redis.register_script(RELEASE_SCRIPT)
+        self.complete_script = self.redis.register_script(COMPLETE_SCRIPT)
+        self.fail_script = self.redis.register_script(FAIL_SCRIPT)
+
+    def key(self, *parts: str) -> str:
+        return ":".join([self.prefix, *parts])
+
+    def enqueue(
+        self, kind: str, payload: Dict[str, Any], key: Optional[str] = None
+    ) -> bool:
+        job_key = key or f"{kind}:{json.dumps(payload, sort_keys=True)}"
+        job_id = uuid.uuid4().hex
+        if not self.redis.set(self.key("jobkey", job_key), job_id, nx=True):
+            return False
+        pipe = self.redis.pipeline()
+        pipe.hset(
+            self.key("job", job_id),
+            mapping={
+                "kind": kind,
+                "payload": json.dumps(payload),
+                "status": "queued",
+                "attempts": 0,
+            },
+        )
+        pipe.lpush(self.key("ready", kind), job_id)
+        pipe.execute()
+        return True
+
+    def release_expired(self) -> None:
+        """Requeue delayed jobs that are due and jobs whose lease expired;
+        an expired lease on the last attempt dead-letters the job."""
+        now = time.time()
+        for queue, max_attempts in (("leased", self.max_attempts), ("delayed", "")):
+            for job_id in self.redis.zrangebyscore(self.key(queue), 0, now):
+                self.release_script(
+                    keys=[self.key(queue), self.key("job", job_id), self.key("dead")],
+                    args=[job_id, self.key("ready", ""), max_attempts],
+                )
+
+    def lease(self, kinds: List[str], worker: Optional[str] = None) -> Optional[Job]:
+        self.release_expired()
+        worker = worker or worker_name()
+        for kind in kinds:
+            leased = self.lease_script(
+                keys=[self.key("ready", kind), self.key("leased")],
+                args=[self.key("job", ""), time.time() + self.lease_seconds, worker],
+            )
+            if leased is None:
+                continue
+            job_id, attempts, payload = leased
+            return Job(job_id, kind, json.loads(payload), int(attempts), worker)
+        return None
+
+    def heartbeat(self, job: Job) -> bool:
+        if self.redis.hget(self.key("job", job.id), "worker") != job.worker:
+            return False
+        return (
+            self.redis.zadd(
+                self.key("leased"),
+                {job.id: time.time() + self.lease_seconds},
+                xx=True,
+                ch=True,
+            )
+            == 1
+        )
+
+    def complete(self, job: Job) -> None:
+        self.complete_script(
+            keys=[self.key("job", job.id), self.key("leased")],
+            args=[job.id, job.worker],
+        )
+
+    def fail(self, job: Job, error: str) -> None:
+        self.fail_script(
+            keys=[
+                self.key("job", job.id),
+                self.key("leased"),
+                self.key("dead"),
+                self.key("delayed"),
+            ],
+            args=[
+                job.id,
+                job.worker,
+                error,
+                "1" if job.attempts >= self.max_attempts else "0",
+                time.time() + self.retry_delay_seconds * 2 ** (job.attempts - 1),
+            ],
+        )
+
+    def dead_letters(self) -> List[Dict[str, Any]]:
+        jobs = []
+        for job_id in self.redis.lrange(self.key("dead"), 0, -1):
+            job = self.redis.hgetall(self.key("job", job_id))
+            jobs.append(dict(job, id=job_id, payload=json.loads(job["payload"])))
+        return jobs
+
+    def requeue_dead(self) -> int:
+        count = 0
+        while (job_id := self.redis.lpop(self.key("dead"))) is not None:
+            job_key = self.key("job", job_id)
+            self.redis.hset(job_key, mapping={"status": "queued", "attempts": 0})
+            self.redis.rpush(
+                self.key("ready", self.redis.hget(job_key, "kind")), job_id
+            )
+            count += 1
+        return count
+
+    def outstanding(self, kinds: List[str]) -> int:
+        count = self.redis.zcard(self.key("leased")) + self.redis.zcard(
+            self.key("delayed")
+        )
+        return count + sum(self.redis.llen(self.key("ready", kind)) for kind in kinds)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        stats: Dict[str, Dict[str, int]] = {
+            kind: {"queued": self.redis.llen(self.key("ready", kind))}
+            for kind in JOB_KINDS
+        }
+        stats["all"] = {
+            "leased": self.redis.zcard(self.key("leased")),
+            "delayed": self.redis.zcard(self.key("delayed")),
+            "dead": self.redis.llen(self.key("dead")),
+        }
+        return stats
+
+
+def get_job_queue(config: Any) -> Any:
+    section = config["queue"]
+    options = {
+        "lease_seconds": section.getfloat("lease_seconds", 300),
+        "max_attempts": section.getint("max_attempts", 3),
+        "retry_delay_seconds": section.getfloat("retry_delay_seconds", 30),
+    }
+    if section.get("backend", "sqlite") == "redis":
+        return RedisJobQueue(section.get("redis_url"), **options)
+    return SQLiteJobQueue(section.get("db_path", "data/state/jobs.db"), **options)
+
+
+def queue_enabled(config: Any) -> bool:
+    return config.getboolean("queue", "enabled", fallback=False)
+
+
+def run_job(
+    queue: Any,
+    job: Job,
+    handler: Callable[[Job], None],
+    heartbeat_seconds: float,
+) -> bool:
+    """Run one leased job, heartbeating while it runs; True if it succeeded."""
+    stop = threading.Event()
+
+    def beat() -> None:
+        while not stop.wait(heartbeat_seconds):
+            if not queue.heartbeat(job):
+                print(f"Lost the lease on {job}")
+                return
+
+    heart = threading.Thread(target=beat, daemon=True)
+    heart.start()
+    try:
+        handler(job)
+    except Exception as e:
+        print(f"{job} failed: {e!r}")
+        queue.fail(job, repr(e))
+        return False
+    finally:
+        stop.set()
+        heart.join()
+    queue.complete(job)
+    return True
+
+
+def work(
+    queue: Any,
+    handlers: Dict[str, Callable[[Job], None]],
+    heartbeat_seconds: float = 60,
+    poll_seconds: float = 2,
+    until_empty: bool = False,
+    stop: Optional[threading.Event] = None,
+) -> int:
+    """Process jobs of the kinds in `handlers`; returns the number completed.
+
+    With `until_empty`, return once no job of those kinds is queued or
+    leased by anyone, otherwise keep polling until `stop` is set."""
+    kinds = list(handlers)
+    worker = worker_name()
+    completed = 0
+    while not (stop and stop.is_set()):
+        job = queue.lease(kinds, worker)
+        if job is None:
+            if until_empty and queue.outstanding(kinds) == 0:
+                break
+            time.sleep(poll_seconds)
+            continue
+        print(f"[{worker}] {job.kind} {job.payload} (attempt {job.attempts})")
+        completed += run_job(queue, job, handlers[job.kind], heartbeat_seconds)
+    return completed
@@ -0,0 +1,625 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+import openai
+
+try:
+    import anthropic
+except ImportError:
+    anthropic = None
+
+# Every LLM call in the pipeline goes through one gateway. Provider adapters
+# hide the API differences, and per-model token buckets for requests and
+# tokens per minute hold calls back *before* they would be rejected, instead
+# of backing off after a 429. Waiting calls are released by priority lane
+# first and round-robin across pipeline steps within a lane.
+
+CHARS_PER_TOKEN = 4
+# The gateway is the only place calls are retried: provider clients are
+# created with their own retries off, so every 429 reaches rate_limited()
+# and holds back all callers of the model at once
+MAX_RETRIES = 5
+MAX_RETRY_DELAY_SECONDS = 30
+
+RATE_LIMIT_ERRORS: Tuple[type, ...] = (openai.RateLimitError,)
+# Timeouts, dropped connections and 5xx responses
+TRANSIENT_ERRORS: Tuple[type, ...] = (
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+if anthropic is not None:
+    RATE_LIMIT_ERRORS += (anthropic.RateLimitError,)
+    TRANSIENT_ERRORS += (anthropic.APIConnectionError, anthropic.InternalServerError)
+RETRYABLE_ERRORS = RATE_LIMIT_ERRORS + TRANSIENT_ERRORS
+
+
+def estimate_tokens(messages: List[Dict[str, Any]], system_message: str = "") -> int:
+    """Rough token count of a request (4 characters per token)."""
+    chars = len(system_message)
+    for message in messages:
+        content = message["content"]
+        if isinstance(content, list):
+            chars += sum(len(block.get("text", "")) for block in content)
+        else:
+            chars += len(content)
+    return chars // CHARS_PER_TOKEN
+
+
+# Provider adapters
+class OpenAIAdapter:
+    """Chat completions API, also used for OpenAI-compatible providers."""
+
+    def __init__(
+        self,
+        api_model: Optional[str] = None,
+        supports_n: bool = False,
+        json_output: Optional[str] = None,
+    ):
+        self.api_model = api_model
+        self.supports_n = supports_n
+        # "schema" (structured output), "object" (JSON mode) or None
+        self.json_output = json_output
+
+    def user_message(self, msg: str, cache_prefix: Optional[str]) -> Dict[str, Any]:
+        # OpenAI caches repeated prompt prefixes without any markup
+        return {"role": "user", "content": msg}
+
+    def assistant_message(self, content: str) -> Dict[str, Any]:
+        return {"role": "assistant", "content": content}
+
+    def complete(
+        self,
+        client: Any,
+        model: str,
+        system_message: str,
+        messages: List[Dict[str, Any]],
+        temperature: float,
+        max_tokens: int,
+        n: int,
+        **params: Any,
+    ) -> Tuple[List[str], Optional[int]]:
+        if self.supports_n:
+            params.setdefault("seed", 0)
+        response = client.chat.completions.create(
+            model=self.api_model or model,
+            messages=[{"role": "system", "content": system_message}, *messages],
+            temperature=temperature,
+            max_tokens=max_tokens,
+            n=n,
+            stop=None,
+            **params,
+        )
+        usage = response.usage.total_tokens if response.usage else None
+        return [choice.message.content for choice in response.choices], usage
+
+    def stream(
+        self,
+        client: Any,
+        model: str,
+        system_message: str,
+        messages: List[Dict[str, Any]],
+        temperature: float,
+        max_tokens: int,
+        **params: Any,
+    ) -> Iterator[Tuple[str, Optional[int]]]:
+        """Yield `(text, usage)` pairs; usage is only set on the final chunk."""
+        response = client.chat.completions.create(
+            model=self.api_model or model,
+            messages=[{"role": "system", "content": system_message}, *messages],
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=True,
+            stream_options={"include_usage": True},
+            **params,
+        )
+        for chunk in response:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content, None
+            if chunk.usage:
+                yield "", chunk.usage.total_tokens
+
+
+class AnthropicAdapter:
+    supports_n = False
+    json_output = None
+
+    def user_message(self, msg: str, cache_prefix: Optional[str]) -> Dict[str, Any]:
+        if cache_prefix and msg.startswith(cache_prefix):
+            # The shared prefix gets its own block with a cache breakpoint
+            blocks = [
+                {
+                    "type": "text",
+                    "text": cache_prefix,
+                    "cache_control": {"type": "ephemeral"},
+                },
+                {"type": "text", "text": msg[len(cache_prefix) :]},
+            ]
+        else:
+            blocks = [{"type": "text", "text": msg}]
+        return {"role": "user", "content": blocks}
+
+    def assistant_message(self, content: str) -> Dict[str, Any]:
+        return {"role": "assistant", "content": [{"type": "text", "text": content}]}
+
+    def complete(
+        self,
+        client: Any,
+        model: str,
+        system_message: str,
+        messages: List[Dict[str, Any]],
+        temperature: float,
+        max_tokens: int,
+        n: int,
+        **params: Any,
+    ) -> Tuple[List[str], Optional[int]]:
+        response = client.messages.create(
+            model=model,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            system=system_message,
+            messages=messages,
+            **params,
+        )
+        usage = response.usage.input_tokens + response.usage.output_tokens
+        return [response.content[0].text], usage
+
+    def stream(
+        self,
+        client: Any,
+        model: str,
+        system_message: str,
+        messages: List[Dict[str, Any]],
+        temperature: float,
+        max_tokens: int,
+        **params: Any,
+    ) -> Iterator[Tuple[str, Optional[int]]]:
+        with client.messages.stream(
+            model=model,
+            max_tokens=max_tokens,
+            temperature=temperature,
+            system=system_message,
+            messages=messages,
+            **params,
+        ) as response:
+            for text in response.text_stream:
+                yield text, None
+            usage = response.get_final_message().usage
+        yield "", usage.input_tokens + usage.output_tokens
+
+
+ADAPTERS: Dict[str, Any] = {
+    "gpt-4o": OpenAIAdapter(supports_n=True, json_output="schema"),
+    "gpt-4o-mini": OpenAIAdapter(supports_n=True, json_output="schema"),
+    "gpt-4o-mini-2024-07-18": OpenAIAdapter(supports_n=True, json_output="schema"),
+    "gpt-4o-2024-08-06": OpenAIAdapter(supports_n=True, json_output="schema"),
+    "deepseek-coder-v2-0724": OpenAIAdapter(
+        api_model="deepseek-coder", json_output="object"
+    ),
+    "llama-3-1-405b-instruct": OpenAIAdapter(
+        api_model="meta-llama/llama-3.1-405b-instruct"
+    ),
+    "meta-llama/llama-3.1-405b-instruct": OpenAIAdapter(),
+}
+
+
+def get_adapter(model: str) -> Any:
+    if model in ADAPTERS:
+        return ADAPTERS[model]
+    if "claude" in model:
+        return AnthropicAdapter()
+    raise ValueError(f"Model {model} not supported.")
+
+
+# Rate limiting
+class TokenBucket:
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.level = min(
+            self.capacity, self.level + (now - self.updated) * self.capacity / 60
+        )
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        self.refill(now)
+        # A single call larger than the whole bucket waits for a full bucket
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) * 60 / self.capacity
+
+    def consume(self, amount: float) -> None:
+        self.level -= min(amount, self.capacity)
+
+
+class Ticket:
+    def __init__(self, lane: str, priority: int, tokens: int):
+        self.lane = lane
+        self.priority = priority
+        self.tokens = tokens
+
+
+class ModelLimiter:
+    """Request and token buckets for one model, with a fair queue of waiters."""
+
+    def __init__(self, rpm: Optional[float], tpm: Optional[float]):
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.blocked_until = 0.0
+        # priority -> lane -> waiting tickets; lanes rotate for round-robin
+        self.queues: Dict[int, Dict[str, Deque[Ticket]]] = {}
+        self.lane_order: Dict[int, Deque[str]] = {}
+
+    def enqueue(self, ticket: Ticket) -> None:
+        lanes = self.queues.setdefault(ticket.priority, {})
+        order = self.lane_order.setdefault(ticket.priority, deque())
+        if ticket.lane not in lanes:
+            lanes[ticket.lane] = deque()
+            order.append(ticket.lane)
+        lanes[ticket.lane].append(ticket)
+
+    def head(self) -> Optional[Ticket]:
+        for priority in sorted(self.queues):
+            for lane in self.lane_order[priority]:
+                if self.queues[priority][lane]:
+                    return self.queues[priority][lane][0]
+        return None
+
+    def release(self, ticket: Ticket) -> None:
+        self.queues[ticket.priority][ticket.lane].popleft()
+        # The lane just served goes to the back of its priority's rotation
+        order = self.lane_order[ticket.priority]
+        order.remove(ticket.lane)
+        order.append(ticket.lane)
+
+    def wait_time(self, ticket: Ticket, now: float) -> float:
+        wait = max(0.0, self.blocked_until - now)
+        if self.requests:
+            wait = max(wait, self.requests.wait_time(1, now))
+        if self.tokens:
+            wait = max(wait, self.tokens.wait_time(ticket.tokens, now))
+        return wait
+
+    def consume(self, ticket: Ticket) -> None:
+        if self.requests:
+            self.requests.consume(1)
+        if self.tokens:
+            self.tokens.consume(ticket.tokens)
+
+
+class LLMGateway:
+    def __init__(
+        self,
+        limits: Dict[str, Tuple[Optional[float], Optional[float]]],
+        lane_priorities: Dict[str, int],
+        max_tokens_per_call: int = 3000,
+    ):
+        self.limits = limits
+        self.lane_priorities = lane_priorities
+        self.max_tokens_per_call = max_tokens_per_call
+        self.limiters: Dict[str, ModelLimiter] = {}
+        self.condition = threading.Condition()
+
+    def limiter(self, model: str) -> Optional[ModelLimiter]:
+        if model not in self.limits:
+            return None
+        if model not in self.limiters:
+            self.limiters[model] = ModelLimiter(*self.limits[model])
+        return self.limiters[model]
+
+    def try_acquire(self, limiter: ModelLimiter, ticket: Ticket) -> float:
+        """Grant `ticket` if it is next in line and within quota; else return a wait."""
+        if limiter.head() is not ticket:
+            return 0.05
+        wait = limiter.wait_time(ticket, time.monotonic())
+        if wait <= 0:
+            limiter.consume(ticket)
+            limiter.release(ticket)
+            self.condition.notify_all()
+        return wait
+
+    def enqueue(self, model: str, lane: str, tokens: int) -> Optional[Ticket]:
+        limiter = self.limiter(model)
+        if limiter is None:
+            return None
+        ticket = Ticket(lane, self.lane_priorities.get(lane, 1), tokens)
+        limiter.enqueue(ticket)
+        return ticket
+
+    def acquire(self, model: str, lane: str, tokens: int) -> None:
+        """Block until `model` has quota for a call of about `tokens` tokens."""
+        with self.condition:
+            ticket = self.enqueue(model, lane, tokens)
+            if ticket is None:
+                return
+            while True:
+                wait = self.try_acquire(self.limiters[model], ticket)
+                if wait <= 0:
+                    return
+                self.condition.wait(timeout=wait)
+
+    async def acquire_async(self, model: str, lane: str, tokens: int) -> None:
+        with self.condition:
+            ticket = self.enqueue(model, lane, tokens)
+        if ticket is None:
+            return
+        while True:
+            with self.condition:
+                wait = self.try_acquire(self.limiters[model], ticket)
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    def settle(self, model: str, estimated: int, actual: Optional[int]) -> None:
+        """Correct the token bucket once the provider reports real usage."""
+        with self.condition:
+            limiter = self.limiter(model)
+            if limiter and limiter.tokens and actual is not None:
+                # consume() charged at most a full bucket
+                charged = min(estimated, limiter.tokens.capacity)
+                limiter.tokens.level = min(
+                    limiter.tokens.capacity, limiter.tokens.level + charged - actual
+                )
+                self.condition.notify_all()
+
+    def rate_limited(self, model: str, retry_after: float) -> None:
+        """A 429 got through anyway: hold every caller of this model back."""
+        with self.condition:
+            limiter = self.limiter(model)
+            if limiter:
+                limiter.blocked_until = time.monotonic() + retry_after
+                if limiter.requests:
+                    limiter.requests.level = 0
+                if limiter.tokens:
+                    limiter.tokens.level = 0
+
+    def retry_delay(self, model: str, error: Exception, attempt: int) -> float:
+        """Seconds to wait before retrying a call that failed with `error`,
+        or -1 when it has been tried often enough."""
+        if attempt == MAX_RETRIES:
+            return -1
+        if isinstance(error, RATE_LIMIT_ERRORS):
+            # acquire() waits out the block for every caller
+            self.rate_limited(model, retry_after_seconds(error))
+            return 0.0
+        return min(2.0**attempt, MAX_RETRY_DELAY_SECONDS)
+
+    def prepare(
+        self,
+        model: str,
+        system_message: str,
+        messages: List[Dict[str, Any]],
+        max_tokens: Optional[int],
+        n: int,
+    ) -> Tuple[Any, int, int]:
+        adapter = get_adapter(model)
+        max_tokens = max_tokens or self.max_tokens_per_call
+        # Output is budgeted at its maximum and corrected by settle() afterwards
+        estimated = estimate_tokens(messages, system_message) + max_tokens * n
+        return adapter, max_tokens, estimated
+
+    def complete(
+        self,
+        client: Any,
+        model: str,
+        system_message: str,
+        messages: List[Dict[str, Any]],
+        temperature: float = 0.75,
+        max_tokens: Optional[int] = None,
+        n: int = 1,
+        lane: str = "default",
+        **params: Any,
+    ) -> List[str]:
+        """Send one request through the rate limiter and return the completions."""
+        adapter, max_tokens, estimated = self.prepare(
+            model, system_message, messages, max_tokens, n
+        )
+        for attempt in range(MAX_RETRIES + 1):
+            self.acquire(model, lane, estimated)
+            try:
+                content, usage = adapter.complete(
+                    client,
+                    model,
+                    system_message,
+                    messages,
+                    temperature,
+                    max_tokens,
+                    n,
+                    **params,
+                )
+            except RETRYABLE_ERRORS as e:
+                delay = self.retry_delay(model, e, attempt)
+                if delay < 0:
+                    raise
+                time.sleep(delay)
+                continue
+            self.settle(model, estimated, usage)
+            return content
+
+    async def complete_async(
+        self,
+        client: Any,
+        model: str,
+        system_message: str,
+        messages: List[Dict[str, Any]],
+        temperature: float = 0.75,
+        max_tokens: Optional[int] = None,
+        n: int = 1,
+        lane: str = "default",
+        **params: Any,
+    ) -> List[str]:
+        """Async variant of `complete`; waiting for quota does not hold a thread."""
+        adapter, max_tokens, estimated = self.prepare(
+            model, system_message, messages, max_tokens, n
+        )
+        for attempt in range(MAX_RETRIES + 1):
+            await self.acquire_async(model, lane, estimated)
+            try:
+                # The provider SDK clients are synchronous
+                content, usage = await asyncio.to_thread(
+                    adapter.complete,
+                    client,
+                    model,
+                    system_message,
+                    messages,
+                    temperature,
+                    max_tokens,
+                    n,
+                    **params,
+                )
+            except RETRYABLE_ERRORS as e:
+                delay = self.retry_delay(model, e, attempt)
+                if delay < 0:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            self.settle(model, estimated, usage)
+            return content
+
+    def stream(
+        self,
+        client: Any,
+        model: str,
+        system_message: str,
+        messages: List[Dict[str, Any]],
+        temperature: float = 0.75,
+        max_tokens: Optional[int] = None,
+        lane: str = "default",
+        **params: Any,
+    ) -> Iterator[str]:
+        """Like `complete`, but yield the completion's text as it is generated."""
+        adapter, max_tokens, estimated = self.prepare(
+            model, system_message, messages, max_tokens, 1
+        )
+        for attempt in range(MAX_RETRIES + 1):
+            self.acquire(model, lane, estimated)
+            usage = None
+            started = False
+            try:
+                for text, chunk_usage in adapter.stream(
+                    client,
+                    model,
+                    system_message,
+                    messages,
+                    temperature,
+                    max_tokens,
+                    **params,
+                ):
+                    if chunk_usage is not None:
+                        usage = chunk_usage
+                    if text:
+                        started = True
+                        yield text
+            except RETRYABLE_ERRORS as e:
+                # Text already handed out cannot be taken back, so only retry
+                # a stream that failed before it started
+                delay = -1 if started else self.retry_delay(model, e, attempt)
+                if delay < 0:
+                    raise
+                time.sleep(delay)
+                continue
+            self.settle(model, estimated, usage)
+            return
+
+    def complete_many(
+        self,
+        client: Any,
+        model: str,
+        system_message: str,
+        messages: List[Dict[str, Any]],
+        n: int,
+        **kwargs: Any,
+    ) -> List[str]:
+        """`n` completions of one request: a single call when the API has `n`,
+        otherwise one call per completion, issued in parallel."""
+        if get_adapter(model).supports_n or n == 1:
+            return self.complete(client, model, system_message, messages, n=n, **kwargs)
+        with ThreadPoolExecutor(max_workers=n) as executor:
+            futures = [
+                executor.submit(
+                    self.complete, client, model, system_message, messages, **kwargs
+                )
+                for _ in range(n)
+            ]
+            return [future.result()[0] for future in futures]
+
+
+def retry_after_seconds(error: Exception) -> float:
+    try:
+        return float(error.response.headers.get("retry-after", 1.0))
+    except (AttributeError, TypeError, ValueError):
+        return 1.0
+
+
+def parse_limits(section: Any) -> Dict[str, Tuple[Optional[float], Optional[float]]]:
+    """`model = rpm, tpm` entries; either value may be left empty."""
+    limits = {}
+    for model, value in section.items():
+        if model in ("lanes", "max_tokens_per_call"):
+            continue
+        rpm, _, tpm = value.partition(",")
+        limits[model] = (
+            float(rpm) if rpm.strip() else None,
+            float(tpm) if tpm.strip() else None,
+        )
+    return limits
+
+
+def parse_lanes(value: str) -> Dict[str, int]:
+    """`lane:priority` pairs; lower numbers are served first."""
+    lanes = {}
+    for entry in value.split(","):
+        if entry.strip():
+            lane, _, priority = entry.partition(":")
+            lanes[lane.strip()] = int(priority or 1)
+    return lanes
+
+
+def gateway_from_config(config: Any) -> LLMGateway:
+    if not config.has_section("llm_gateway"):
+        return LLMGateway({}, {})
+    section = config["llm_gateway"]
+    return LLMGateway(
+        parse_limits(section),
+        parse_lanes(section.get("lanes", "")),
+        section.getint("max_tokens_per_call", 3000),
+    )
+
+
+shared_gateway: Optional[LLMGateway] = None
+shared_gateway_lock = threading.Lock()
+
+
+def get_gateway() -> LLMGateway:
+    """The process-wide gateway, with the limits of config/config.ini unless
+    `configure_gateway` was called first."""
+    global shared_gateway
+    with shared_gateway_lock:
+        if shared_gateway is None:
+            from utils.utils import resolve_config
+
+            shared_gateway = gateway_from_config(resolve_config())
+        return shared_gateway
+
+
+def configure_gateway(config: Any) -> LLMGateway:
+    """Use `config`'s [llm_gateway] limits for every later call in this process."""
+    global shared_gateway
+    with shared_gateway_lock:
+        shared_gateway = gateway_from_config(config)
+        return shared_gateway
+
+
+@lru_cache(maxsize=None)
+def get_openai_client(api_key_location: str) -> openai.OpenAI:
+    """Shared OpenAI client per key file, so connections are pooled across calls.
+    The gateway retries its calls, so the client does not."""
+    with open(api_key_location) as f:
+        return openai.OpenAI(api_key=f.read().strip(), max_retries=0)
@@ -0,0 +1,355 @@
+import argparse
+import os
+import secrets
+import signal
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing import TimeoutError as PoolTimeout, get_context
+from multiprocessing.connection import Client, Connection, Listener
+from multiprocessing.pool import AsyncResult
+from typing import Any, Dict, Optional
+from utils.paper_store import file_hash
+
+# A long-lived marker service. Loading marker's layout and OCR models takes
+# far longer than converting a paper, so the service loads them once in each
+# of its worker processes and takes PDFs over a local socket. Results are
+# cached by the PDF's content hash, so a paper is converted once no matter
+# how many folders, runs or steps ask for it.
+#
+#     python -m utils.marker_service            # run in the foreground
+#     python -m utils.marker_service --status
+#     python -m utils.marker_service --stop
+#
+# Clients start the service on first use when [marker] autostart is set.
+
+# [marker] options the service itself reads
+SERVICE_OPTIONS = [
+    "socket_path",
+    "cache_folder",
+    "memory_per_worker_gb",
+    "max_workers",
+    "convert_timeout_seconds",
+]
+
+# Set in each worker process by load_models()
+converter: Any = None
+
+
+def available_memory_bytes() -> int:
+    """Memory that can be used without swapping (GPU memory if marker will use CUDA)."""
+    try:
+        import torch
+
+        if torch.cuda.is_available():
+            return torch.cuda.mem_get_info()[0]
+    except ImportError:
+        pass
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+
+
+def usable_cores() -> int:
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def worker_count(memory_per_worker_gb: float, max_workers: int = 0) -> int:
+    """As many workers as there are cores and memory for a copy of the models."""
+    by_memory = int(available_memory_bytes() // (memory_per_worker_gb * 1024**3))
+    workers = min(usable_cores(), by_memory)
+    if max_workers > 0:
+        workers = min(workers, max_workers)
+    return max(1, workers)
+
+
+# Worker processes
+def load_models(threads: int) -> None:
+    global converter
+    try:
+        import torch
+
+        # Workers share the cores instead of each trying to use all of them
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    try:
+        from marker.converters.pdf import PdfConverter
+        from marker.models import create_model_dict
+
+        converter = PdfConverter(artifact_dict=create_model_dict())
+    except ImportError:
+        # marker < 1.0
+        from marker.models import load_all_models
+
+        converter = load_all_models()
+
+
+def convert(pdf_path: str) -> str:
+    if callable(converter):
+        from marker.output import text_from_rendered
+
+        return text_from_rendered(converter(pdf_path))[0]
+    from marker.convert import convert_single_pdf
+
+    return convert_single_pdf(pdf_path, converter)[0]
+
+
+# Cache
+def cache_path(cache_folder: str, content_hash: str) -> str:
+    return os.path.join(cache_folder, content_hash[:2], f"{content_hash}.md")
+
+
+def read_cached(cache_folder: str, content_hash: str) -> Optional[str]:
+    path = cache_path(cache_folder, content_hash)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+
+def write_cached(cache_folder: str, content_hash: str, markdown: str) -> None:
+    path = cache_path(cache_folder, content_hash)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        f.write(markdown)
+    os.replace(f"{path}.tmp", path)
+
+
+# Service
+class MarkerService:
+    def __init__(self, config: Any):
+        self.socket_path = config.get(
+            "marker", "socket_path", fallback="data/state/marker.sock"
+        )
+        self.cache_folder = config.get(
+            "marker", "cache_folder", fallback="data/marker-cache"
+        )
+        self.workers = worker_count(
+            config.getfloat("marker", "memory_per_worker_gb", fallback=4),
+            config.getint("marker", "max_workers", fallback=0),
+        )
+        # A PDF that hangs marker fails its request instead of blocking the
+        # clients waiting on it (0 = wait as long as it takes)
+        self.convert_timeout = (
+            config.getfloat("marker", "convert_timeout_seconds", fallback=600) or None
+        )
+        threads = max(1, usable_cores() // self.workers)
+        # Spawned, so CUDA and the models start cleanly in every worker
+        self.pool = get_context("spawn").Pool(
+            self.workers, initializer=load_models, initargs=(threads,)
+        )
+        # Conversions in progress by content hash; a PDF asked for twice
+        # while it converts is converted once
+        self.in_flight: Dict[str, AsyncResult] = {}
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.converted = 0
+
+    def serve(self) -> None:
+        os.makedirs(os.path.dirname(self.socket_path) or ".", exist_ok=True)
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        self.authkey = secrets.token_bytes(32)
+        listener = Listener(self.socket_path, family="AF_UNIX", authkey=self.authkey)
+        write_authkey(self.socket_path, self.authkey)
+        print(f"Marker service on {self.socket_path} with {self.workers} workers")
+        try:
+            while not self.stopping.is_set():
+                try:
+                    connection = listener.accept()
+                except OSError:
+                    break
+                threading.Thread(
+                    target=self.handle, args=(connection,), daemon=True
+                ).start()
+        finally:
+            self.pool.terminate()
+            # Closing the listener removes the socket file
+            listener.close()
+            if os.path.exists(f"{self.socket_path}.key"):
+                os.remove(f"{self.socket_path}.key")
+
+    def handle(self, connection: Connection) -> None:
+        with connection:
+            try:
+                request: Dict[str, Any] = connection.recv()
+            except EOFError:
+                return
+            if request["command"] == "status":
+                connection.send(
+                    {
+                        "workers": self.workers,
+                        "in_flight": len(self.in_flight),
+                        "converted": self.converted,
+                    }
+                )
+            elif request["command"] == "stop":
+                self.stopping.set()
+                connection.send({"stopping": True})
+                # Wake the accept() in serve() so it sees the flag
+                Client(self.socket_path, family="AF_UNIX", authkey=self.authkey).close()
+            elif request["command"] == "convert":
+                try:
+                    connection.send(self.convert(request))
+                except Exception as e:
+                    connection.send({"error": repr(e)})
+
+    def convert(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        content_hash = file_hash(request["pdf_path"])
+        if request.get("use_cache", True):
+            markdown = read_cached(self.cache_folder, content_hash)
+            if markdown is not None:
+                return {"markdown": markdown, "hash": content_hash, "cached": True}
+        with self.lock:
+            result = self.in_flight.get(content_hash)
+            if result is None:
+                result = self.pool.apply_async(convert, (request["pdf_path"],))
+                self.in_flight[content_hash] = result
+        try:
+            markdown = result.get(self.convert_timeout)
+        except PoolTimeout:
+            return {
+                "error": f"conversion took longer than {self.convert_timeout:g}s",
+                "hash": content_hash,
+            }
+        finally:
+            with self.lock:
+                self.in_flight.pop(content_hash, None)
+        write_cached(self.cache_folder, content_hash, markdown)
+        self.converted += 1
+        return {"markdown": markdown, "hash": content_hash, "cached": False}
+
+
+def write_authkey(socket_path: str, authkey: bytes) -> None:
+    # Only this user may talk to the service
+    fd = os.open(f"{socket_path}.key", os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(authkey)
+
+
+# Client
+def send_request(config: Any, request: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Send one request to the service; None if it is not running."""
+    socket_path = config.get("marker", "socket_path", fallback="data/state/marker.sock")
+    try:
+        with open(f"{socket_path}.key", "rb") as f:
+            authkey = f.read()
+        with Client(socket_path, family="AF_UNIX", authkey=authkey) as connection:
+            connection.send(request)
+            return connection.recv()
+    except (OSError, EOFError):
+        return None
+
+
+def marker_installed() -> bool:
+    import importlib.util
+
+    return importlib.util.find_spec("marker") is not None
+
+
+def ensure_service(config: Any) -> bool:
+    """Whether the service is up, starting it in the background if allowed."""
+    if send_request(config, {"command": "status"}) is not None:
+        return True
+    if not config.getboolean("marker", "autostart", fallback=True):
+        return False
+    if not marker_installed():
+        return False
+    log_path = config.get("marker", "log_path", fallback="data/state/marker.log")
+    os.makedirs(os.path.dirname(log_path) or ".", exist_ok=True)
+    # The service gets this process's settings, not just those in config.ini
+    settings = [
+        f"{option}={config.get('marker', option)}"
+        for option in SERVICE_OPTIONS
+        if config.has_option("marker", option)
+    ]
+    with open(log_path, "a") as log:
+        subprocess.Popen(
+            [sys.executable, "-m", "utils.marker_service", "--set", *settings],
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            start_new_session=True,
+            cwd=os.path.abspath(os.path.join(os.path.dirname(__file__), "..")),
+        )
+    deadline = time.time() + config.getfloat(
+        "marker", "startup_timeout_seconds", fallback=60
+    )
+    while time.time() < deadline:
+        time.sleep(0.5)
+        if send_request(config, {"command": "status"}) is not None:
+            return True
+    print(f"Marker service did not start, see {log_path}")
+    return False
+
+
+def convert_pdf(pdf_path: str, config: Any, use_cache: bool = True) -> Optional[str]:
+    """Markdown of a PDF from the cache or the service; None if neither can
+    provide it (marker not installed, or the conversion failed)."""
+    cache_folder = config.get("marker", "cache_folder", fallback="data/marker-cache")
+    if use_cache:
+        markdown = read_cached(cache_folder, file_hash(pdf_path))
+        if markdown is not None:
+            return markdown
+    if not ensure_service(config):
+        return None
+    response = send_request(
+        config,
+        {
+            "command": "convert",
+            "pdf_path": os.path.abspath(pdf_path),
+            "use_cache": use_cache,
+        },
+    )
+    if response is None or "error" in response:
+        print(
+            f"Marker could not convert {pdf_path}: {(response or {}).get('error', 'service stopped')}"
+        )
+        return None
+    return response["markdown"]
+
+
+def main() -> None:
+    from utils.utils import resolve_config
+
+    parser = argparse.ArgumentParser(description="Warm marker conversion service")
+    parser.add_argument("--status", action="store_true", help="print service status")
+    parser.add_argument("--stop", action="store_true", help="stop the service")
+    parser.add_argument(
+        "--set",
+        nargs="*",
+        default=[],
+        metavar="OPTION=VALUE",
+        help="override [marker] options from config.ini",
+    )
+    args = parser.parse_args()
+
+    config = resolve_config()
+    if not config.has_section("marker"):
+        config.add_section("marker")
+    for setting in args.set:
+        option, value = setting.split("=", 1)
+        config.set("marker", option, value)
+    running = send_request(config, {"command": "status"}) is not None
+    if not (args.status or args.stop) and running:
+        print("Marker service is already running")
+        return
+    if args.status or args.stop:
+        response = send_request(config, {"command": "stop" if args.stop else "status"})
+        print(response if response is not None else "Marker service is not running")
+        return
+    # Clean up the socket when stopped with kill as well
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    MarkerService(config).serve()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+import math
+import re
+import threading
+import uuid as uuid_lib
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+from weaviate.classes.config import DataType
+
+# In-process stand-in for the subset of the Weaviate v4 client used by the
+# pipeline. Selected with `[weaviate] backend = memory`; data lives for the
+# lifetime of the process and is shared by every client handed out.
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class MemoryMetadata:
+    def __init__(self, score: float):
+        self.score = score
+
+
+class MemoryObject:
+    def __init__(self, uuid: str, properties: Dict[str, Any], score: float = 0.0):
+        self.uuid = uuid
+        self.properties = properties
+        self.score = score
+        self.metadata = MemoryMetadata(score)
+
+
+class MemoryQueryReturn:
+    def __init__(self, objects: List[MemoryObject]):
+        self.objects = objects
+
+
+class MemoryAggregateReturn:
+    def __init__(self, total_count: int):
+        self.total_count = total_count
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, int):
+            return self.total_count == other
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"AggregateReturn(total_count={self.total_count})"
+
+
+class MemoryBatch:
+    def __init__(self, collection: "MemoryCollection"):
+        self.collection = collection
+        self.failed_objects: List[Any] = []
+
+    def add_object(
+        self, properties: Dict[str, Any], uuid: Optional[str] = None, **kwargs: Any
+    ) -> str:
+        return self.collection.data.insert(properties=properties, uuid=uuid)
+
+    @contextmanager
+    def dynamic(self) -> Iterator["MemoryBatch"]:
+        yield self
+
+    @contextmanager
+    def fixed_size(
+        self, batch_size: int = 100, **kwargs: Any
+    ) -> Iterator["MemoryBatch"]:
+        yield self
+
+
+class MemoryData:
+    def __init__(self, collection: "MemoryCollection"):
+        self.collection = collection
+
+    def insert(
+        self, properties: Dict[str, Any], uuid: Optional[str] = None, **kwargs: Any
+    ) -> str:
+        obj_uuid = str(uuid or uuid_lib.uuid4())
+        self.collection.store(obj_uuid, properties)
+        return obj_uuid
+
+    def insert_many(self, objects: List[Any]) -> Any:
+        for obj in objects:
+            if isinstance(obj, dict):
+                self.insert(properties=obj)
+            else:
+                self.insert(properties=obj.properties, uuid=obj.uuid)
+
+    def exists(self, uuid: str) -> bool:
+        return str(uuid) in self.collection.objects
+
+
+class MemoryQuery:
+    def __init__(self, collection: "MemoryCollection"):
+        self.collection = collection
+
+    def hybrid(
+        self,
+        query: str,
+        limit: Optional[int] = None,
+        alpha: Optional[float] = None,
+        **kwargs: Any,
+    ) -> MemoryQueryReturn:
+        """Rank objects by BM25 over their text properties (no vectors are kept)."""
+        return MemoryQueryReturn(self.collection.bm25(query, limit))
+
+    def bm25(
+        self, query: str, limit: Optional[int] = None, **kwargs: Any
+    ) -> MemoryQueryReturn:
+        return MemoryQueryReturn(self.collection.bm25(query, limit))
+
+    def fetch_object_by_id(self, uuid: str, **kwargs: Any) -> Optional[MemoryObject]:
+        with self.collection.lock:
+            properties = self.collection.objects.get(str(uuid))
+        if properties is None:
+            return None
+        return MemoryObject(str(uuid), self.collection.read(properties))
+
+    def fetch_objects(
+        self, limit: Optional[int] = None, **kwargs: Any
+    ) -> MemoryQueryReturn:
+        with self.collection.lock:
+            items = list(self.collection.objects.items())[:limit]
+        return MemoryQueryReturn(
+            [MemoryObject(u, self.collection.read(p)) for u, p in items]
+        )
+
+
+class MemoryAggregate:
+    def __init__(self, collection: "MemoryCollection"):
+        self.collection = collection
+
+    def over_all(
+        self, total_count: bool = True, **kwargs: Any
+    ) -> MemoryAggregateReturn:
+        return MemoryAggregateReturn(len(self.collection.objects))
+
+
+class MemoryCollection:
+    def __init__(self, name: str, properties: Optional[List[Any]] = None):
+        self.name = name
+        self.date_properties = {
+            p.name for p in properties or [] if p.dataType == DataType.DATE
+        }
+        self.text_properties = [
+            p.name for p in properties or [] if p.dataType == DataType.TEXT
+        ]
+        self.objects: Dict[str, Dict[str, Any]] = {}
+        self.term_counts: Dict[str, Counter] = {}
+        self.document_frequency: Counter = Counter()
+        self.lock = threading.Lock()
+        self.batch = MemoryBatch(self)
+        self.data = MemoryData(self)
+        self.query = MemoryQuery(self)
+        self.aggregate = MemoryAggregate(self)
+
+    def store(self, obj_uuid: str, properties: Dict[str, Any]) -> None:
+        text = " ".join(
+            str(properties.get(name) or "") for name in self.text_properties
+        )
+        counts = Counter(tokenize(text))
+        with self.lock:
+            if obj_uuid in self.term_counts:
+                self.document_frequency.subtract(self.term_counts[obj_uuid].keys())
+            self.objects[obj_uuid] = dict(properties)
+            self.term_counts[obj_uuid] = counts
+            self.document_frequency.update(counts.keys())
+
+    def read(self, properties: Dict[str, Any]) -> Dict[str, Any]:
+        """Return a copy with DATE properties parsed, as the Weaviate client does."""
+        result = dict(properties)
+        for name in self.date_properties:
+            if isinstance(result.get(name), str):
+                result[name] = datetime.fromisoformat(result[name])
+        return result
+
+    def bm25(self, query: str, limit: Optional[int]) -> List[MemoryObject]:
+        terms = set(tokenize(query))
+        with self.lock:
+            n_docs = len(self.objects) or 1
+            avg_len = sum(sum(c.values()) for c in self.term_counts.values()) / n_docs
+            scored = []
+            for obj_uuid, counts in self.term_counts.items():
+                length = sum(counts.values())
+                score = 0.0
+                for term in terms & counts.keys():
+                    df = self.document_frequency[term]
+                    idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+                    tf = counts[term]
+                    score += (
+                        idf
+                        * tf
+                        * 2.2
+                        / (tf + 1.2 * (0.25 + 0.75 * length / (avg_len or 1)))
+                    )
+                scored.append((score, obj_uuid))
+            scored.sort(key=lambda item: item[0], reverse=True)
+            return [
+                MemoryObject(u, self.read(self.objects[u]), s)
+                for s, u in scored[:limit]
+            ]
+
+
+class MemoryCollections:
+    def __init__(self):
+        self.collections: Dict[str, MemoryCollection] = {}
+
+    def list_all(self) -> Dict[str, MemoryCollection]:
+        return dict(self.collections)
+
+    def create(
+        self, name: str, properties: Optional[List[Any]] = None, **kwargs: Any
+    ) -> MemoryCollection:
+        self.collections[name] = MemoryCollection(name, properties)
+        return self.collections[name]
+
+    def get(self, name: str) -> MemoryCollection:
+        return self.collections[name]
+
+    def delete(self, name: str) -> None:
+        self.collections.pop(name, None)
+
+
+class MemoryClient:
+    def __init__(self, collections: MemoryCollections):
+        self.collections = collections
+        self.connected = True
+
+    def is_connected(self) -> bool:
+        return self.connected
+
+    def close(self) -> None:
+        self.connected = False
+
+
+collections = MemoryCollections()
+
+
+def connect_to_memory() -> MemoryClient:
+    return MemoryClient(collections)
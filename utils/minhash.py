@@ -0,0 +1,230 @@
+import hashlib
+import random
+import re
+from array import array
+from typing import Any, Dict, List, Optional, Set
+import numpy as np
+from utils.paper_index import arxiv_id_key
+from utils.paper_store import PaperStore, get_paper_store
+
+# Near-duplicate detection over title and abstract. Each paper gets a MinHash
+# signature of its word shingles; papers whose signatures agree on every row
+# of at least one LSH band are compared, and those whose estimated Jaccard
+# similarity reaches the threshold share a cluster. Signatures, bands and
+# clusters live in the paper store, so the index grows across runs and a
+# paper is never compared with the whole collection.
+
+# Mersenne prime for the universal hash family (a * x + b) mod p
+MERSENNE_PRIME = (1 << 61) - 1
+LOW_31 = (1 << 31) - 1
+LOW_30 = (1 << 30) - 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS minhash_signatures (
+    paper_id TEXT PRIMARY KEY,
+    signature BLOB NOT NULL,
+    cluster_id TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS minhash_signatures_cluster
+    ON minhash_signatures (cluster_id);
+CREATE TABLE IF NOT EXISTS minhash_bands (
+    band INTEGER NOT NULL,
+    bucket BLOB NOT NULL,
+    paper_id TEXT NOT NULL,
+    PRIMARY KEY (band, bucket, paper_id)
+);
+"""
+
+
+def shingles(text: str, size: int = 3) -> Set[bytes]:
+    """Word n-grams of the lowercased text, ignoring punctuation and LaTeX."""
+    words = re.findall(r"[a-z0-9]+", text.lower())
+    if len(words) <= size:
+        return {" ".join(words).encode("utf-8")}
+    return {
+        " ".join(words[i : i + size]).encode("utf-8")
+        for i in range(len(words) - size + 1)
+    }
+
+
+def shingle_hash(shingle: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(shingle, digest_size=8).digest(), "big")
+
+
+class MinHasher:
+    def __init__(self, num_perm: int = 128, seed: int = 1):
+        # Fixed seed: signatures stored in earlier runs must stay comparable
+        rng = random.Random(seed)
+        self.permutations = [
+            (rng.randrange(1, MERSENNE_PRIME), rng.randrange(0, MERSENNE_PRIME))
+            for _ in range(num_perm)
+        ]
+        a = np.array([a for a, _ in self.permutations], dtype=np.uint64)[:, None]
+        self.a_low = a & np.uint64(LOW_31)
+        self.a_high = a >> np.uint64(31)
+        self.b = np.array([b for _, b in self.permutations], dtype=np.uint64)[:, None]
+
+    def signature(self, items: Set[bytes]) -> List[int]:
+        """min((a * h + b) mod p) over the shingle hashes h, for every
+        permutation at once. The products are taken in 31-bit halves, using
+        2 ** 61 = 1 (mod p), so no partial result overflows 64 bits and the
+        signature is exactly that of the plain integer arithmetic."""
+        prime = np.uint64(MERSENNE_PRIME)
+        hashes = np.array(
+            [shingle_hash(item) % MERSENNE_PRIME for item in items], dtype=np.uint64
+        )[None, :]
+        h_low = hashes & np.uint64(LOW_31)
+        h_high = hashes >> np.uint64(31)
+        # a_high * h_high * 2 ** 62 = a_high * h_high * 2
+        total = self.a_high * h_high
+        total <<= np.uint64(1)
+        # mid * 2 ** 31 = (mid >> 30) * 2 ** 61 + (mid & LOW_30) * 2 ** 31
+        mid = self.a_high * h_low
+        scratch = self.a_low * h_high
+        mid += scratch
+        np.right_shift(mid, np.uint64(30), out=scratch)
+        total += scratch
+        mid &= np.uint64(LOW_30)
+        mid <<= np.uint64(31)
+        total += mid
+        # Every term is below 2 ** 62, so the sum stays below 2 ** 64
+        np.multiply(self.a_low, h_low, out=scratch)
+        total += scratch
+        total += self.b
+        for _ in range(2):
+            np.bitwise_and(total, prime, out=scratch)
+            total >>= np.uint64(61)
+            total += scratch
+        # total - p wraps around to a larger number unless total >= p
+        np.subtract(total, prime, out=scratch)
+        np.minimum(total, scratch, out=total)
+        return total.min(axis=1).tolist()
+
+
+def similarity(first: List[int], second: List[int]) -> float:
+    """Estimated Jaccard similarity of the sets behind two signatures."""
+    return sum(x == y for x, y in zip(first, second)) / len(first)
+
+
+class NearDuplicateIndex:
+    """Persistent MinHash/LSH index that assigns every paper a cluster id.
+
+    With `bands` bands of `num_perm / bands` rows, pairs above roughly
+    (1 / bands) ** (bands / num_perm) similarity become candidates; they
+    are then checked against `threshold`."""
+
+    def __init__(
+        self,
+        store: PaperStore,
+        num_perm: int = 128,
+        bands: int = 16,
+        threshold: float = 0.8,
+        shingle_size: int = 3,
+    ):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.store = store
+        self.hasher = MinHasher(num_perm)
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        with store.lock:
+            store.connection.executescript(SCHEMA)
+
+    def band_buckets(self, signature: List[int]) -> List[bytes]:
+        return [
+            hashlib.blake2b(
+                array(
+                    "Q", signature[band * self.rows : (band + 1) * self.rows]
+                ).tobytes(),
+                digest_size=8,
+            ).digest()
+            for band in range(self.bands)
+        ]
+
+    def cluster_of(self, paper_id: str) -> Optional[str]:
+        with self.store.lock:
+            row = self.store.connection.execute(
+                "SELECT cluster_id FROM minhash_signatures WHERE paper_id = ?",
+                [paper_id],
+            ).fetchone()
+        return row["cluster_id"] if row else None
+
+    def add(self, paper_id: str, title: str, abstract: str) -> str:
+        """Index a paper and return its cluster id (its own id if it is new)."""
+        cluster_id = self.cluster_of(paper_id)
+        if cluster_id:
+            return cluster_id
+        signature = self.hasher.signature(
+            shingles(f"{title} {abstract}", self.shingle_size)
+        )
+        buckets = self.band_buckets(signature)
+
+        with self.store.transaction() as db:
+            candidates: Dict[str, str] = {}
+            # Other versions of the same arXiv paper belong together even if
+            # the abstract was rewritten
+            if not paper_id.startswith("file:"):
+                for row in db.execute(
+                    "SELECT paper_id, cluster_id FROM minhash_signatures "
+                    "WHERE paper_id = ? OR paper_id LIKE ?",
+                    [arxiv_id_key(paper_id), f"{arxiv_id_key(paper_id)}v%"],
+                ):
+                    candidates[row["paper_id"]] = row["cluster_id"]
+            for band, bucket in enumerate(buckets):
+                for row in db.execute(
+                    """SELECT s.paper_id, s.cluster_id, s.signature
+                    FROM minhash_bands AS b
+                    JOIN minhash_signatures AS s ON s.paper_id = b.paper_id
+                    WHERE b.band = ? AND b.bucket = ?""",
+                    [band, bucket],
+                ):
+                    if row["paper_id"] in candidates:
+                        continue
+                    other = list(array("Q", row["signature"]))
+                    if similarity(signature, other) >= self.threshold:
+                        candidates[row["paper_id"]] = row["cluster_id"]
+
+            clusters = sorted(set(candidates.values()))
+            cluster_id = clusters[0] if clusters else paper_id
+            # The new paper can bridge clusters that were apart until now
+            for other_cluster in clusters[1:]:
+                db.execute(
+                    "UPDATE minhash_signatures SET cluster_id = ? WHERE cluster_id = ?",
+                    [cluster_id, other_cluster],
+                )
+            db.execute(
+                "INSERT INTO minhash_signatures (paper_id, signature, cluster_id) "
+                "VALUES (?, ?, ?)",
+                [paper_id, array("Q", signature).tobytes(), cluster_id],
+            )
+            db.executemany(
+                "INSERT OR IGNORE INTO minhash_bands (band, bucket, paper_id) "
+                "VALUES (?, ?, ?)",
+                [(band, bucket, paper_id) for band, bucket in enumerate(buckets)],
+            )
+        return cluster_id
+
+    def members(self, cluster_id: str) -> List[str]:
+        with self.store.lock:
+            rows = self.store.connection.execute(
+                "SELECT paper_id FROM minhash_signatures WHERE cluster_id = ?",
+                [cluster_id],
+            ).fetchall()
+        return [row["paper_id"] for row in rows]
+
+
+def dedupe_enabled(config: Any) -> bool:
+    return config.getboolean("dedupe", "enabled", fallback=False)
+
+
+def get_duplicate_index(config: Any) -> NearDuplicateIndex:
+    """The index over the configured paper store, with `[dedupe]` settings."""
+    return NearDuplicateIndex(
+        get_paper_store(config),
+        config.getint("dedupe", "num_perm", fallback=128),
+        config.getint("dedupe", "bands", fallback=16),
+        config.getfloat("dedupe", "threshold", fallback=0.8),
+        config.getint("dedupe", "shingle_size", fallback=3),
+    )
@@ -0,0 +1,152 @@
+import struct
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+# Just enough of the MP3 format to join files without decoding them: the
+# audio is a sequence of self-describing frames, so segments can be cut and
+# concatenated at frame boundaries, and chapters are ID3v2 CHAP frames.
+
+# Bitrates in kbit/s by (MPEG-1?, layer) and the header's bitrate index
+BITRATES = {
+    (True, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (True, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (True, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (False, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (False, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (False, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+# Sample rates by the header's version bits (0 is MPEG-2.5, 1 is reserved)
+SAMPLE_RATES = {
+    0: [11025, 12000, 8000],
+    2: [22050, 24000, 16000],
+    3: [44100, 48000, 32000],
+}
+
+
+class Frame(NamedTuple):
+    data: bytes
+    seconds: float
+
+
+def frame_header(data: bytes, offset: int) -> Optional[Tuple[int, float]]:
+    """Length and duration of the frame starting at `offset`, or None."""
+    if offset + 4 > len(data):
+        return None
+    b1, b2 = data[offset + 1], data[offset + 2]
+    if data[offset] != 0xFF or b1 & 0xE0 != 0xE0:
+        return None
+    version, layer = (b1 >> 3) & 3, 4 - ((b1 >> 1) & 3)
+    bitrate_index, rate_index = b2 >> 4, (b2 >> 2) & 3
+    if version == 1 or layer == 4 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    mpeg1 = version == 3
+    bitrate = BITRATES[(mpeg1, layer)][bitrate_index] * 1000
+    sample_rate = SAMPLE_RATES[version][rate_index]
+    padding = (b2 >> 1) & 1
+    if layer == 1:
+        return (12 * bitrate // sample_rate + padding) * 4, 384 / sample_rate
+    samples = 1152 if layer == 2 or mpeg1 else 576
+    return samples // 8 * bitrate // sample_rate + padding, samples / sample_rate
+
+
+def is_info_frame(frame: bytes) -> bool:
+    """Xing/Info/VBRI frames hold no audio, only the length of their own file."""
+    mpeg1, mono = (frame[1] >> 3) & 3 == 3, frame[3] >> 6 == 3
+    side_info = (17 if mono else 32) if mpeg1 else (9 if mono else 17)
+    offset = 4 + (0 if frame[1] & 1 else 2) + side_info
+    return frame[offset : offset + 4] in (b"Xing", b"Info") or frame[36:40] == b"VBRI"
+
+
+def id3_length(data: bytes, offset: int = 0) -> int:
+    if data[offset : offset + 3] != b"ID3" or len(data) < offset + 10:
+        return 0
+    size = unsynchsafe(data[offset + 6 : offset + 10])
+    footer = 10 if data[offset + 5] & 0x10 else 0
+    return 10 + size + footer
+
+
+def iter_frames(data: bytes) -> Iterator[Frame]:
+    """The audio frames of an MP3 file, without tags or info frames."""
+    offset = id3_length(data)
+    while offset < len(data):
+        header = frame_header(data, offset)
+        if header is None or offset + header[0] > len(data):
+            # Junk between frames, or a trailing ID3v1 tag; look for the next frame
+            offset = data.find(b"\xff", offset + 1)
+            if offset == -1:
+                return
+            continue
+        length, seconds = header
+        frame = data[offset : offset + length]
+        offset += length
+        if not is_info_frame(frame):
+            yield Frame(frame, seconds)
+
+
+def read_frames(path: str) -> List[Frame]:
+    with open(path, "rb") as f:
+        return list(iter_frames(f.read()))
+
+
+# ID3v2 tags
+def synchsafe(n: int) -> bytes:
+    return bytes([(n >> 21) & 0x7F, (n >> 14) & 0x7F, (n >> 7) & 0x7F, n & 0x7F])
+
+
+def unsynchsafe(b: bytes) -> int:
+    return (b[0] << 21) | (b[1] << 14) | (b[2] << 7) | b[3]
+
+
+def id3_frame(frame_id: str, payload: bytes, version: int = 3) -> bytes:
+    size = synchsafe(len(payload)) if version == 4 else struct.pack(">I", len(payload))
+    return frame_id.encode("ascii") + size + b"\x00\x00" + payload
+
+
+def text_frame(frame_id: str, text: str) -> bytes:
+    # UTF-16 with a byte order mark is the one Unicode encoding ID3v2.3 allows
+    return id3_frame(frame_id, b"\x01" + text.encode("utf-16") + b"\x00\x00")
+
+
+def id3_tag(frames: bytes, version: int = 3, padding: int = 0) -> bytes:
+    size = len(frames) + padding
+    return (
+        b"ID3" + bytes([version, 0, 0]) + synchsafe(size) + frames + b"\x00" * padding
+    )
+
+
+def chapter_tag(
+    title: str, chapters: List[Tuple[str, float, float]], padding: int = 0
+) -> bytes:
+    """ID3v2.3 tag with the episode title and a table of contents of
+    (title, start seconds, end seconds) chapters."""
+    chapters = chapters[:255]
+    frames = text_frame("TIT2", title)
+    element_ids = [f"chp{i}".encode("ascii") + b"\x00" for i in range(len(chapters))]
+    # Top-level, ordered table of contents listing every chapter
+    frames += id3_frame(
+        "CTOC", b"toc\x00" + bytes([0x03, len(chapters)]) + b"".join(element_ids)
+    )
+    for element_id, (chapter_title, start, end) in zip(element_ids, chapters):
+        frames += id3_frame(
+            "CHAP",
+            element_id
+            + struct.pack(
+                ">IIII", int(start * 1000), int(end * 1000), 0xFFFFFFFF, 0xFFFFFFFF
+            )
+            + text_frame("TIT2", chapter_title),
+        )
+    return id3_tag(frames, padding=padding)
+
+
+def timestamp_tag(seconds: float) -> bytes:
+    """The ID3 tag that HLS expects at the start of each packed-audio chunk,
+    giving its start time on the 90 kHz MPEG clock."""
+    pts = int(seconds * 90000) & ((1 << 33) - 1)
+    return id3_tag(
+        id3_frame(
+            "PRIV",
+            b"com.apple.streaming.transportStreamTimestamp\x00"
+            + struct.pack(">Q", pts),
+            version=4,
+        ),
+        version=4,
+    )
@@ -0,0 +1,113 @@
+import csv
+import os
+import re
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# arxiv_search and select_papers write their CSVs with different column
+# names for the same fields; records in the index always use these keys.
+COLUMN_ALIASES: Dict[str, str] = {
+    "ID": "arxiv_id",
+    "Title": "title",
+    "ArXiv URL": "arxiv_url",
+    "ArXivURL": "arxiv_url",
+    "PDF URL": "pdf_url",
+    "Published Date": "published_date",
+    "PublishedDate": "published_date",
+    "Abstract": "abstract",
+    "Filename": "filename",
+}
+VERSION_SUFFIX = re.compile(r"v\d+$")
+
+
+def normalize_record(row: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        COLUMN_ALIASES.get(key, key): value
+        for key, value in row.items()
+        if key is not None
+    }
+
+
+def arxiv_id_key(arxiv_id: str) -> str:
+    """`2410.01234v2` and `http://arxiv.org/abs/2410.01234v2` both become `2410.01234`."""
+    return VERSION_SUFFIX.sub("", arxiv_id.strip().rsplit("/abs/", 1)[-1])
+
+
+class PaperIndex:
+    """Paper records by filename and by arXiv ID (with or without version)."""
+
+    def __init__(self, records: Iterable[Dict[str, Any]] = ()):
+        self.by_filename: Dict[str, Dict[str, Any]] = {}
+        self.by_arxiv_id: Dict[str, Dict[str, Any]] = {}
+        for record in records:
+            self.add(record)
+
+    def add(self, record: Dict[str, Any]) -> None:
+        record = normalize_record(record)
+        if record.get("arxiv_id"):
+            key = arxiv_id_key(record["arxiv_id"])
+            # Later sources fill in fields the earlier ones lacked
+            record = {**self.by_arxiv_id.get(key, {}), **record}
+            self.by_arxiv_id[key] = record
+        if record.get("filename"):
+            self.by_filename[record["filename"]] = record
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Look a paper up by base filename or arXiv ID."""
+        return self.by_filename.get(key) or self.by_arxiv_id.get(arxiv_id_key(key))
+
+    def link(self, key: str) -> str:
+        record = self.get(key)
+        return (record or {}).get("arxiv_url") or ""
+
+    def records(self) -> List[Dict[str, Any]]:
+        return list(self.by_arxiv_id.values())
+
+    def __len__(self) -> int:
+        return len(self.by_arxiv_id)
+
+
+def read_records(csv_path: str) -> List[Dict[str, Any]]:
+    with open(csv_path, mode="r", newline="", encoding="utf-8") as file:
+        return [normalize_record(row) for row in csv.DictReader(file)]
+
+
+index_cache: Dict[Tuple[str, ...], Tuple[Tuple[Any, ...], PaperIndex]] = {}
+index_lock = threading.Lock()
+
+
+def get_paper_index(*csv_paths: str) -> PaperIndex:
+    """Index of the given CSVs, rebuilt only when one of them has changed.
+
+    Files listed later take precedence for fields present in both."""
+    signature = tuple(
+        (
+            (os.stat(path).st_mtime_ns, os.stat(path).st_size)
+            if os.path.exists(path)
+            else None
+        )
+        for path in csv_paths
+    )
+    with index_lock:
+        cached = index_cache.get(csv_paths)
+        if cached and cached[0] == signature:
+            return cached[1]
+        index = PaperIndex()
+        for path, stat in zip(csv_paths, signature):
+            if stat is not None:
+                for record in read_records(path):
+                    index.add(record)
+        index_cache[csv_paths] = (signature, index)
+        return index
+
+
+def paper_index_from_config(config: Any) -> PaperIndex:
+    """Index over the papers found by arxiv_search and those selected for summaries."""
+    return get_paper_index(
+        os.path.join(config.get("arxiv_search", "output_dir"), "papers_found.csv"),
+        config.get(
+            "summarize_papers",
+            "csv_path",
+            fallback="data/pdfs-to-summarize/papers_to_summarize.csv",
+        ),
+    )
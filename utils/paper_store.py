@@ -0,0 +1,381 @@
+import hashlib
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, Optional
+
+# One SQLite database (WAL mode, so readers never block the writer) tracks
+# every paper through the pipeline. Each step asks the store for the papers
+# whose prerequisites are done but whose own stage is not, claims them one
+# at a time with a lease, and records the outcome with a content hash and
+# timing. Re-running a step therefore only does the work that is missing,
+# and several workers can share a database without doing anything twice.
+
+STAGES = [
+    "found",
+    "selected",
+    "downloaded",
+    "extracted",
+    "chunked",
+    "summarized",
+    "reviewed",
+    "voiced",
+    "exported",
+]
+
+# Stages that must be done before a paper is pending for a stage
+PREREQUISITES: Dict[str, List[str]] = {
+    "found": [],
+    "selected": ["found"],
+    "downloaded": ["selected"],
+    "extracted": ["downloaded"],
+    "chunked": ["downloaded"],
+    "summarized": ["downloaded"],
+    "reviewed": ["downloaded"],
+    "voiced": ["summarized"],
+    "exported": ["summarized"],
+}
+
+# Stages that each profile (see [profiles]) tracks for itself; search,
+# download, extraction and indexing are shared by all profiles
+PROFILE_STAGES = {"selected", "summarized", "reviewed", "voiced", "exported"}
+
+PAPER_FIELDS = [
+    "arxiv_id",
+    "title",
+    "arxiv_url",
+    "pdf_url",
+    "published_date",
+    "abstract",
+    "filename",
+]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS papers (
+    paper_id TEXT PRIMARY KEY,
+    arxiv_id TEXT,
+    title TEXT,
+    arxiv_url TEXT,
+    pdf_url TEXT,
+    published_date TEXT,
+    abstract TEXT,
+    filename TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS papers_filename ON papers (filename);
+CREATE TABLE IF NOT EXISTS paper_stages (
+    paper_id TEXT NOT NULL REFERENCES papers (paper_id),
+    stage TEXT NOT NULL,
+    status TEXT NOT NULL,
+    worker TEXT,
+    claimed_until REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    content_hash TEXT,
+    started_at REAL,
+    finished_at REAL,
+    seconds REAL,
+    error TEXT,
+    PRIMARY KEY (paper_id, stage)
+);
+CREATE INDEX IF NOT EXISTS paper_stages_status ON paper_stages (stage, status);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def worker_name() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+
+class PaperStore:
+    def __init__(self, db_path: str, profile: str = ""):
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.db_path = db_path
+        self.profile = profile
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(
+            db_path, timeout=30, check_same_thread=False, isolation_level=None
+        )
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        # BEGIN IMMEDIATE takes the write lock up front, so a check-then-update
+        # cannot interleave with another process doing the same
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.connection
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.connection.execute("COMMIT")
+
+    def stage_key(self, stage: str) -> str:
+        """How `stage` is stored: per-profile stages are suffixed with the
+        profile, so profiles sharing a database keep separate progress."""
+        if self.profile and stage in PROFILE_STAGES:
+            return f"{stage}@{self.profile}"
+        return stage
+
+    # Papers
+    def add_paper(self, record: Dict[str, Any], stage: Optional[str] = None) -> str:
+        """Insert or update a paper and optionally mark `stage` done; returns its id."""
+        return self.add_papers([record], stage)[0]
+
+    def add_papers(
+        self, records: List[Dict[str, Any]], stage: Optional[str] = None
+    ) -> List[str]:
+        """`add_paper` for many records in a single transaction."""
+        rows = []
+        now = time.time()
+        for record in records:
+            paper_id = record.get("arxiv_id") or f"file:{record['filename']}"
+            values = [
+                (
+                    record[field].isoformat()
+                    if hasattr(record.get(field), "isoformat")
+                    else record.get(field)
+                )
+                for field in PAPER_FIELDS
+            ]
+            rows.append([paper_id, *values, now, now])
+        with self.transaction() as db:
+            db.executemany(
+                f"""INSERT INTO papers (paper_id, {', '.join(PAPER_FIELDS)},
+                    created_at, updated_at)
+                VALUES (?, {', '.join('?' for _ in PAPER_FIELDS)}, ?, ?)
+                ON CONFLICT (paper_id) DO UPDATE SET
+                {', '.join(f'{f} = COALESCE(excluded.{f}, {f})' for f in PAPER_FIELDS)},
+                updated_at = excluded.updated_at""",
+                rows,
+            )
+            if stage:
+                for row in rows:
+                    self.set_done(db, row[0], stage, None, None)
+        return [row[0] for row in rows]
+
+    def get_paper(self, paper_id: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT * FROM papers WHERE paper_id = ?", [paper_id]
+            ).fetchone()
+        return dict(row) if row else None
+
+    def find_by_filename(self, filename: str) -> Optional[str]:
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT paper_id FROM papers WHERE filename = ?", [filename]
+            ).fetchone()
+        return row["paper_id"] if row else None
+
+    def paper_for_file(self, filename: str) -> str:
+        """Id of the paper stored as `filename`, registering unknown local files."""
+        paper_id = self.find_by_filename(filename)
+        if paper_id:
+            return paper_id
+        # A PDF that was put in the folder by hand counts as downloaded
+        return self.add_paper({"filename": filename}, stage="downloaded")
+
+    # Stages
+    def pending(self, stage: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Papers whose prerequisites for `stage` are done and which nobody holds."""
+        prerequisites = [self.stage_key(p) for p in PREREQUISITES[stage]]
+        query = f"""
+            SELECT papers.* FROM papers
+            LEFT JOIN paper_stages AS s
+                ON s.paper_id = papers.paper_id AND s.stage = ?
+            WHERE (s.status IS NULL OR s.status = 'failed'
+                   OR (s.status = 'claimed' AND s.claimed_until < ?))
+            {''.join(f'''
+            AND EXISTS (SELECT 1 FROM paper_stages AS p{i}
+                WHERE p{i}.paper_id = papers.paper_id AND p{i}.stage = ?
+                AND p{i}.status = 'done')''' for i in range(len(prerequisites)))}
+            ORDER BY papers.published_date DESC, papers.paper_id
+        """
+        params: List[Any] = [self.stage_key(stage), time.time(), *prerequisites]
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        with self.lock:
+            rows = self.connection.execute(query, params).fetchall()
+        return [dict(row) for row in rows]
+
+    def claim(
+        self,
+        paper_id: str,
+        stage: str,
+        worker: Optional[str] = None,
+        lease_seconds: float = 3600,
+    ) -> bool:
+        """Take `stage` of a paper for this worker; False if it is done or held."""
+        now = time.time()
+        with self.transaction() as db:
+            cursor = db.execute(
+                """INSERT INTO paper_stages
+                    (paper_id, stage, status, worker, claimed_until, attempts, started_at)
+                VALUES (?, ?, 'claimed', ?, ?, 1, ?)
+                ON CONFLICT (paper_id, stage) DO UPDATE SET
+                    status = 'claimed',
+                    worker = excluded.worker,
+                    claimed_until = excluded.claimed_until,
+                    attempts = attempts + 1,
+                    started_at = excluded.started_at,
+                    error = NULL
+                WHERE status = 'failed'
+                    OR (status = 'claimed' AND claimed_until < excluded.started_at)""",
+                [
+                    paper_id,
+                    self.stage_key(stage),
+                    worker or worker_name(),
+                    now + lease_seconds,
+                    now,
+                ],
+            )
+            return cursor.rowcount == 1
+
+    def set_done(
+        self,
+        db: sqlite3.Connection,
+        paper_id: str,
+        stage: str,
+        content_hash: Optional[str],
+        seconds: Optional[float],
+    ) -> None:
+        now = time.time()
+        db.execute(
+            """INSERT INTO paper_stages
+                (paper_id, stage, status, content_hash, finished_at, seconds)
+            VALUES (?, ?, 'done', ?, ?, ?)
+            ON CONFLICT (paper_id, stage) DO UPDATE SET
+                status = 'done',
+                claimed_until = NULL,
+                content_hash = excluded.content_hash,
+                finished_at = excluded.finished_at,
+                seconds = excluded.seconds,
+                error = NULL""",
+            [paper_id, self.stage_key(stage), content_hash, now, seconds],
+        )
+
+    def complete(
+        self,
+        paper_id: str,
+        stage: str,
+        content_hash: Optional[str] = None,
+        seconds: Optional[float] = None,
+    ) -> None:
+        with self.transaction() as db:
+            self.set_done(db, paper_id, stage, content_hash, seconds)
+
+    def fail(self, paper_id: str, stage: str, error: str) -> None:
+        with self.transaction() as db:
+            db.execute(
+                """UPDATE paper_stages SET status = 'failed', claimed_until = NULL,
+                    finished_at = ?, error = ?
+                WHERE paper_id = ? AND stage = ?""",
+                [time.time(), error, paper_id, self.stage_key(stage)],
+            )
+
+    @contextmanager
+    def track(self, paper_id: str, stage: str) -> Iterator[Dict[str, Any]]:
+        """Time a claimed stage and record it as done, or as failed if it raises.
+
+        Set `content_hash` on the yielded dict to store a hash of the output."""
+        result: Dict[str, Any] = {"content_hash": None}
+        start = time.time()
+        try:
+            yield result
+        except BaseException as e:
+            self.fail(paper_id, stage, repr(e))
+            raise
+        self.complete(paper_id, stage, result["content_hash"], time.time() - start)
+
+    def stage(self, paper_id: str, stage: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT * FROM paper_stages WHERE paper_id = ? AND stage = ?",
+                [paper_id, self.stage_key(stage)],
+            ).fetchone()
+        return dict(row) if row else None
+
+    def is_done(self, paper_id: str, stage: str) -> bool:
+        row = self.stage(paper_id, stage)
+        return bool(row) and row["status"] == "done"
+
+    def done_by_every_profile(self, paper_id: str, stage: str) -> bool:
+        """Whether every profile that selected the paper has done `stage`."""
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT stage FROM paper_stages WHERE paper_id = ? AND status = 'done'",
+                [paper_id],
+            ).fetchall()
+        done = {row["stage"] for row in rows}
+        selected = [s for s in done if s.split("@")[0] == "selected"]
+        return bool(selected) and all(
+            s.replace("selected", stage, 1) in done for s in selected
+        )
+
+    def counts(self) -> Dict[str, Dict[str, int]]:
+        """Number of papers per stage and status."""
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT stage, status, COUNT(*) AS n FROM paper_stages "
+                "GROUP BY stage, status"
+            ).fetchall()
+        counts: Dict[str, Dict[str, int]] = {stage: {} for stage in STAGES}
+        for row in rows:
+            counts.setdefault(row["stage"], {})[row["status"]] = row["n"]
+        return counts
+
+    # Checkpoints and other run state
+    def get_meta(self, key: str) -> Optional[str]:
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT value FROM meta WHERE key = ?", [key]
+            ).fetchone()
+        return row["value"] if row else None
+
+    def set_meta(self, key: str, value: str) -> None:
+        with self.transaction() as db:
+            db.execute(
+                "INSERT INTO meta (key, value) VALUES (?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+                [key, value],
+            )
+
+
+@lru_cache(maxsize=None)
+def open_paper_store(db_path: str, profile: str = "") -> PaperStore:
+    return PaperStore(db_path, profile)
+
+
+def get_paper_store(config: Any) -> PaperStore:
+    """The shared store for the configured `[state] db_path`, tracking the
+    stages of the profile being run (`[pipeline] profile`), if any."""
+    return open_paper_store(
+        config.get("state", "db_path", fallback="data/state/papers.db"),
+        config.get("pipeline", "profile", fallback=""),
+    )
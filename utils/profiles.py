@@ -0,0 +1,80 @@
+import configparser
+from typing import Any, Dict, List
+
+# Several teams can share one pipeline run. Each profile listed in
+# [profiles] names gets its own copy of the config, with the options of any
+# `[<profile>.<section>]` section laid over `[<section>]`, e.g.
+#
+#     [team_a.select_papers]
+#     queries = query1
+#     output_dir = data/team_a/pdfs-to-summarize
+#
+# The shared steps (search, backfill, passage indexing) run once with the
+# base config; every other step runs once per profile. All profiles use the
+# same paper store, which keeps their selection, summary, review, voice and
+# export stages apart, while downloads, extracted text and summaries of the
+# same text with the same prompts are reused across profiles.
+
+DEFAULT_SHARED_STEPS = "arxiv_search, backfill, index_chunks, benchmark"
+
+
+def profile_names(config: configparser.ConfigParser) -> List[str]:
+    names = config.get("profiles", "names", fallback="")
+    return [name.strip() for name in names.split(",") if name.strip()]
+
+
+def shared_steps(config: configparser.ConfigParser) -> List[str]:
+    steps = config.get("profiles", "shared_steps", fallback=DEFAULT_SHARED_STEPS)
+    return [step.strip() for step in steps.split(",") if step.strip()]
+
+
+def current_profile(config: Any) -> str:
+    return config.get("pipeline", "profile", fallback="")
+
+
+def profile_config(
+    config: configparser.ConfigParser, name: str
+) -> configparser.ConfigParser:
+    """`config` with the `[<name>.<section>]` overrides applied, for running
+    the steps of profile `name`."""
+    profile = configparser.ConfigParser()
+    profile.read_dict(
+        {
+            section: dict(config.items(section, raw=True))
+            for section in config.sections()
+        }
+    )
+    prefix = f"{name}."
+    for section in config.sections():
+        if not section.startswith(prefix):
+            continue
+        target = section[len(prefix) :]
+        if not profile.has_section(target):
+            profile.add_section(target)
+        for key, value in config.items(section, raw=True):
+            profile.set(target, key, value)
+    if not profile.has_section("pipeline"):
+        profile.add_section("pipeline")
+    profile.set("pipeline", "profile", name)
+    return profile
+
+
+# Queued jobs carry their profile, so a worker runs them with its config
+def job_payload(config: Any, paper_id: str, filename: str) -> Dict[str, Any]:
+    payload = {"paper_id": paper_id, "filename": filename}
+    if current_profile(config):
+        payload["profile"] = current_profile(config)
+    return payload
+
+
+def job_key(kind: str, payload: Dict[str, Any]) -> str:
+    key = f"{kind}:{payload['paper_id']}"
+    return f"{key}@{payload['profile']}" if payload.get("profile") else key
+
+
+def job_config(
+    config: configparser.ConfigParser, payload: Dict[str, Any]
+) -> configparser.ConfigParser:
+    if payload.get("profile") and not current_profile(config):
+        return profile_config(config, payload["profile"])
+    return config
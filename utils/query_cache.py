@@ -0,0 +1,115 @@
+import hashlib
+import json
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+from utils.paper_store import PaperStore
+
+# Results of searches over a Weaviate collection, cached in the paper store
+# under the collection's version. Ingestion bumps the version, which makes
+# every cached result for the collection stale at once; until then the same
+# query with the same parameters is answered without asking Weaviate.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS query_cache (
+    cache_key TEXT PRIMARY KEY,
+    collection TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    result TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS query_cache_collection ON query_cache (collection);
+"""
+
+
+def version_key(collection: str) -> str:
+    return f"collection_version:{collection}"
+
+
+def encode(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return {"__datetime__": value.isoformat()}
+    raise TypeError(f"Cannot cache {type(value).__name__}")
+
+
+def decode(value: Dict[str, Any]) -> Any:
+    if set(value) == {"__datetime__"}:
+        return datetime.fromisoformat(value["__datetime__"])
+    return value
+
+
+def collection_version(store: PaperStore, collection: str) -> int:
+    return int(store.get_meta(version_key(collection)) or 0)
+
+
+def bump_collection_version(store: PaperStore, collection: str) -> int:
+    """Mark the collection as changed; its cached results are dropped."""
+    with store.lock:
+        store.connection.executescript(SCHEMA)
+    with store.transaction() as db:
+        row = db.execute(
+            "SELECT value FROM meta WHERE key = ?", [version_key(collection)]
+        ).fetchone()
+        version = int(row["value"] if row else 0) + 1
+        db.execute(
+            "INSERT INTO meta (key, value) VALUES (?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+            [version_key(collection), str(version)],
+        )
+        db.execute("DELETE FROM query_cache WHERE collection = ?", [collection])
+    return version
+
+
+class QueryCache:
+    def __init__(self, store: PaperStore, collection: str):
+        self.store = store
+        self.collection = collection
+        with store.lock:
+            store.connection.executescript(SCHEMA)
+        self.hits = 0
+        self.misses = 0
+
+    def cached(
+        self, kind: str, params: Dict[str, Any], compute: Callable[[], Any]
+    ) -> Any:
+        """`compute()`'s JSON-serializable result, reused while the collection
+        version is unchanged."""
+        version = collection_version(self.store, self.collection)
+        cache_key = hashlib.sha256(
+            json.dumps([self.collection, version, kind, params], sort_keys=True).encode(
+                "utf-8"
+            )
+        ).hexdigest()
+        with self.store.lock:
+            row = self.store.connection.execute(
+                "SELECT result FROM query_cache WHERE cache_key = ?", [cache_key]
+            ).fetchone()
+        if row:
+            self.hits += 1
+            return json.loads(row["result"], object_hook=decode)
+
+        self.misses += 1
+        result = compute()
+        with self.store.transaction() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO query_cache "
+                "(cache_key, collection, version, result, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [
+                    cache_key,
+                    self.collection,
+                    version,
+                    json.dumps(result, default=encode),
+                    time.time(),
+                ],
+            )
+        return result
+
+
+def cached_or_computed(
+    cache: Optional[QueryCache],
+    kind: str,
+    params: Dict[str, Any],
+    compute: Callable[[], Any],
+) -> Any:
+    return cache.cached(kind, params, compute) if cache else compute()
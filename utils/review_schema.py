@@ -0,0 +1,141 @@
+import json
+from typing import Any, Dict, List, Literal, Tuple, Union
+from pydantic import ConfigDict, Field, ValidationError, create_model
+from utils.llm_gateway import get_adapter
+from utils.utils import extract_json_between_markers
+
+# The review form as a schema. Answers are validated against it, so a
+# review with a missing field or an out-of-range score counts as a failed
+# call (and is retried) instead of surfacing later. Models that support it
+# are asked for structured output in this schema, those with only a JSON
+# mode for a JSON object; the others answer in the THOUGHT / REVIEW JSON
+# text format of the prompts.
+
+SCORE_LIMITS = {
+    "Originality": (1, 4),
+    "Quality": (1, 4),
+    "Clarity": (1, 4),
+    "Significance": (1, 4),
+    "Soundness": (1, 4),
+    "Presentation": (1, 4),
+    "Contribution": (1, 4),
+    "Overall": (1, 10),
+    "Confidence": (1, 5),
+}
+
+DECISIONS = ["Accept", "Reject"]
+
+# The fields of the review form, in the order the prompts ask for them
+FORM = [
+    ("Summary", "text"),
+    ("Strengths", "list"),
+    ("Weaknesses", "list"),
+    ("Originality", "rating"),
+    ("Quality", "rating"),
+    ("Clarity", "rating"),
+    ("Significance", "rating"),
+    ("Questions", "list"),
+    ("Limitations", "list"),
+    ("Ethical Concerns", "flag"),
+    ("Soundness", "rating"),
+    ("Presentation", "rating"),
+    ("Contribution", "rating"),
+    ("Overall", "rating"),
+    ("Confidence", "rating"),
+    ("Decision", "decision"),
+]
+
+
+def field_definition(name: str, kind: str) -> Tuple[Any, Any]:
+    if kind == "rating":
+        low, high = SCORE_LIMITS[name]
+        return int, Field(alias=name, ge=low, le=high)
+    types = {
+        "text": str,
+        # Models sometimes answer a list field with a single paragraph
+        "list": Union[List[str], str],
+        "flag": bool,
+        "decision": Literal["Accept", "Reject"],
+    }
+    return types[kind], Field(alias=name)
+
+
+def schema_property(name: str, kind: str) -> Dict[str, Any]:
+    return {
+        "text": {"type": "string"},
+        "list": {"type": "array", "items": {"type": "string"}},
+        "flag": {"type": "boolean"},
+        "rating": {"type": "integer"},
+        "decision": {"type": "string", "enum": DECISIONS},
+    }[kind]
+
+
+Review = create_model(
+    "Review",
+    __config__=ConfigDict(extra="allow"),
+    **{
+        name.lower().replace(" ", "_"): field_definition(name, kind)
+        for name, kind in FORM
+    },
+)
+
+REVIEW_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "review",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "thought": {"type": "string"},
+                "review": {
+                    "type": "object",
+                    "properties": {
+                        name: schema_property(name, kind) for name, kind in FORM
+                    },
+                    "required": [name for name, _ in FORM],
+                    "additionalProperties": False,
+                },
+            },
+            "required": ["thought", "review"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+
+class ReviewFormatError(ValueError):
+    pass
+
+
+def review_output_params(model: str, structured: bool = True) -> Dict[str, Any]:
+    """Request parameters that make `model` answer in the review schema, or
+    at least in JSON, where its API supports it."""
+    json_output = getattr(get_adapter(model), "json_output", None)
+    if not structured or json_output is None:
+        return {}
+    if json_output == "schema":
+        return {"response_format": REVIEW_RESPONSE_FORMAT}
+    return {"response_format": {"type": "json_object"}}
+
+
+def parse_review(content: str) -> Dict[str, Any]:
+    """The validated review in a model answer, in any of the three formats."""
+    try:
+        answer = json.loads(content)
+    except (TypeError, json.JSONDecodeError):
+        answer = extract_json_between_markers(content or "")
+    if isinstance(answer, dict) and isinstance(answer.get("review"), dict):
+        answer = answer["review"]
+    if not isinstance(answer, dict):
+        raise ReviewFormatError("no review JSON in the answer")
+    # JSON mode answers may carry the thought next to the review fields
+    answer = {k: v for k, v in answer.items() if k.lower() != "thought"}
+    try:
+        return Review.model_validate(answer).model_dump(by_alias=True)
+    except ValidationError as e:
+        problems = ", ".join(
+            f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}"
+            for error in e.errors()
+        )
+        raise ReviewFormatError(problems) from e
@@ -0,0 +1,216 @@
+import json
+import os
+import re
+from collections import Counter
+from typing import Any, Iterable, List, NamedTuple
+
+# Section structure of extracted paper text. Headings are recognised in
+# marker's markdown ("## 3 Method") and in plain PDF text, where they are
+# short lines that are numbered ("3.2 Training") or carry a standard name
+# ("References"). Passages are packed from whole paragraphs (or sentences,
+# for paragraphs that are too long) and never cross a section boundary.
+#
+# Each step can also leave back matter (references, appendices,
+# acknowledgements) and the running headers and footers of PDF pages out
+# of what it sends to the model; see [extraction].
+
+HEADING = re.compile(
+    r"^[ \t\f]*(?:"
+    r"#{1,6}[ \t]+(?P<markdown>[^\n]+?)"
+    r"|(?P<numbered>(?:\d{1,2}(?:\.\d{1,2})*\.?|[IVX]{1,4}\.)[ \t]+[A-Z][^\n.]{1,80})"
+    r"|(?P<named>(?i:abstract|introduction|related work|background|preliminaries"
+    r"|methods?|methodology|experiments?|evaluation|results|discussion"
+    r"|conclusions?|limitations|references|bibliography|acknowledge?ments?"
+    r"|appendix(?:[ \t]+[A-Z])?)(?:[ \t]*:)?)"
+    r")[ \t]*$",
+    re.MULTILINE,
+)
+PARAGRAPH_BREAK = re.compile(r"\n[ \t]*\n")
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+(?=[A-Z(\[])")
+
+# Pages of extracted PDF text are separated by form feeds
+PAGE_BREAK = "\f"
+PAGE_NUMBER = re.compile(r"^(?:page )?#(?: of #)?$|^- # -$")
+# Lines at the top and bottom of a page that may be running headers or footers
+EDGE_LINES = 3
+
+# What a step can leave out
+BACK_MATTER = ("references", "appendix", "acknowledgements")
+REFERENCES_TITLE = re.compile(r"\b(?:references|bibliography)\b", re.IGNORECASE)
+ACKNOWLEDGEMENTS_TITLE = re.compile(r"acknowledge?ments?", re.IGNORECASE)
+APPENDIX_TITLE = re.compile(
+    r"^(?:appendi(?:x|ces)|supplementary)\b|\bappendi(?:x|ces)\b", re.IGNORECASE
+)
+# A "References" heading in the first part of the text is a false positive
+# (a table of contents, a sentence that happens to be a short line)
+MIN_REFERENCES_POSITION = 0.3
+
+
+class Section(NamedTuple):
+    title: str
+    kind: str
+    start: int
+    end: int
+
+
+class Passage(NamedTuple):
+    section: str
+    text: str
+    start: int
+    end: int
+
+
+def section_kind(title: str, start: int, length: int, after_references: bool) -> str:
+    if ACKNOWLEDGEMENTS_TITLE.search(title):
+        return "acknowledgements"
+    if REFERENCES_TITLE.search(title) and start >= length * MIN_REFERENCES_POSITION:
+        return "references"
+    # Whatever follows the bibliography is supplementary material
+    if APPENDIX_TITLE.search(title) or after_references:
+        return "appendix"
+    return "body"
+
+
+def split_sections(text: str) -> List[Section]:
+    """Sections in order, each from its heading to the next one, so together
+    they cover `text`. Text before the first heading is a section with an
+    empty title."""
+    sections: List[Section] = []
+    title, start = "", 0
+    after_references = False
+    for match in HEADING.finditer(text):
+        if match.start() > start or title:
+            kind = section_kind(title, start, len(text), after_references)
+            after_references = after_references or kind == "references"
+            sections.append(Section(title, kind, start, match.start()))
+        title = next(group for group in match.groups() if group).strip()
+        start = match.start()
+    kind = section_kind(title, start, len(text), after_references)
+    sections.append(Section(title, kind, start, len(text)))
+    return [
+        section
+        for section in sections
+        if section.title or text[section.start : section.end].strip()
+    ]
+
+
+def strip_page_furniture(text: str) -> str:
+    """Remove running headers, footers and page numbers: lines at the edge
+    of a page that recur, numbers aside, at the edge of many pages."""
+    pages = text.split(PAGE_BREAK)
+    if len(pages) < 3:
+        return text
+
+    def key(line: str) -> str:
+        return re.sub(r"\d+", "#", " ".join(line.split())).lower()
+
+    def edge_indices(lines: List[str]) -> List[int]:
+        filled = [i for i, line in enumerate(lines) if line.strip()]
+        return filled[:EDGE_LINES] + filled[-EDGE_LINES:]
+
+    page_lines = [page.split("\n") for page in pages]
+    counts: Counter = Counter()
+    for lines in page_lines:
+        counts.update({key(lines[i]) for i in edge_indices(lines)})
+    repeated = {line for line, n in counts.items() if n >= max(3, len(pages) // 2)}
+    cleaned = []
+    for lines in page_lines:
+        furniture = {
+            i
+            for i in edge_indices(lines)
+            if key(lines[i]) in repeated or PAGE_NUMBER.match(key(lines[i]))
+        }
+        cleaned.append(
+            "\n".join(line for i, line in enumerate(lines) if i not in furniture)
+        )
+    return PAGE_BREAK.join(cleaned)
+
+
+def drop_sections(text: str, kinds: Iterable[str]) -> str:
+    """`text` without the sections of the given kinds."""
+    kinds = set(kinds)
+    if not kinds:
+        return text
+    return "".join(
+        text[section.start : section.end]
+        for section in split_sections(text)
+        if section.kind not in kinds
+    )
+
+
+def step_policy(config: Any, step: str) -> List[str]:
+    """The kinds of back matter `step` leaves out, from [extraction]."""
+    value = config.get("extraction", step, fallback="") if config else ""
+    kinds = [kind.strip() for kind in value.split(",") if kind.strip()]
+    unknown = set(kinds) - set(BACK_MATTER)
+    if unknown:
+        raise ValueError(f"Unknown [extraction] {step} sections: {sorted(unknown)}")
+    return kinds
+
+
+def text_for_step(text: str, config: Any, step: str) -> str:
+    """The part of a paper's extracted text that `step` sends to the model."""
+    kept = drop_sections(text, step_policy(config, step))
+    if len(kept) < len(text):
+        print(f"{step}: sending {len(kept)} of {len(text)} characters of the paper")
+    return kept
+
+
+def write_sections(path: str, text: str) -> None:
+    """Save the section offsets of `text` as JSON, for later stages."""
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        json.dump([section._asdict() for section in split_sections(text)], f, indent=2)
+    os.replace(f"{path}.tmp", path)
+
+
+def pieces(text: str, offset: int, max_chars: int) -> List[Passage]:
+    """Paragraphs of `text` (sentences or hard cuts when they are too long),
+    as passages with offsets shifted by `offset`."""
+    result: List[Passage] = []
+    position = 0
+    for paragraph in PARAGRAPH_BREAK.split(text):
+        start = text.find(paragraph, position)
+        position = start + len(paragraph)
+        if not paragraph.strip():
+            continue
+        if len(paragraph) <= max_chars:
+            result.append(Passage("", paragraph, offset + start, offset + position))
+            continue
+        sentence_start = 0
+        for match in list(SENTENCE_END.finditer(paragraph)) + [None]:
+            sentence_end = match.start() if match else len(paragraph)
+            for cut in range(sentence_start, sentence_end, max_chars):
+                end = min(cut + max_chars, sentence_end)
+                result.append(
+                    Passage(
+                        "",
+                        paragraph[cut:end],
+                        offset + start + cut,
+                        offset + start + end,
+                    )
+                )
+            sentence_start = match.end() if match else len(paragraph)
+    return result
+
+
+def split_passages(text: str, max_chars: int = 1500) -> List[Passage]:
+    """Passages of up to `max_chars`, packed from consecutive paragraphs of
+    the same section."""
+    passages: List[Passage] = []
+    for section in split_sections(text):
+        current: List[Passage] = []
+        for piece in pieces(
+            text[section.start : section.end], section.start, max_chars
+        ):
+            if current and piece.end - current[0].start > max_chars:
+                passages.append(join_pieces(text, section.title, current))
+                current = []
+            current.append(piece)
+        if current:
+            passages.append(join_pieces(text, section.title, current))
+    return passages
+
+
+def join_pieces(text: str, section: str, current: List[Passage]) -> Passage:
+    start, end = current[0].start, current[-1].end
+    return Passage(section, " ".join(text[start:end].split()), start, end)
@@ -0,0 +1,51 @@
+import hashlib
+import json
+import time
+from typing import Any, List, Optional
+from utils.paper_store import PaperStore, get_paper_store
+
+# Summaries kept in the paper store by the hash of everything that goes
+# into them: the text sent to the model, the prompt chain and the model.
+# Profiles that select the same paper with the same prompts get the summary
+# that was generated first instead of paying for the prompt chain again.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS summaries (
+    summary_key TEXT PRIMARY KEY,
+    summary TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+"""
+
+
+class SummaryCache:
+    def __init__(self, store: PaperStore):
+        self.store = store
+        with store.lock:
+            store.connection.executescript(SCHEMA)
+
+    def key(self, paper: str, model: str, prompts: List[str]) -> str:
+        return hashlib.sha256(
+            json.dumps([paper, model, prompts]).encode("utf-8")
+        ).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        with self.store.lock:
+            row = self.store.connection.execute(
+                "SELECT summary FROM summaries WHERE summary_key = ?", [key]
+            ).fetchone()
+        return row["summary"] if row else None
+
+    def put(self, key: str, summary: str) -> None:
+        with self.store.transaction() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO summaries (summary_key, summary, created_at) "
+                "VALUES (?, ?, ?)",
+                [key, summary, time.time()],
+            )
+
+
+def get_summary_cache(config: Any) -> Optional[SummaryCache]:
+    if not config.getboolean("summarize_papers", "summary_cache", fallback=True):
+        return None
+    return SummaryCache(get_paper_store(config))
@@ -0,0 +1,178 @@
+import hashlib
+import json
+import time
+from typing import Any, Dict, List, Optional
+from utils.llm_gateway import get_gateway, get_openai_client
+from utils.paper_store import PaperStore, get_paper_store, text_hash
+
+# Abstract-level triage before anything is downloaded. A small model scores
+# many abstracts per request against the reader's interests and answers in
+# a fixed JSON schema, so a paper costs about a hundred tokens instead of a
+# download, an extraction and the summary prompt chain. Scores are cached
+# by the hash of the abstract (and of the model and interests), so a paper
+# that comes up again in later runs or other queries is not scored twice.
+
+# Gateway lane for triage calls, see [llm_gateway] lanes
+LLM_LANE = "select_papers"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS triage_scores (
+    abstract_hash TEXT NOT NULL,
+    criteria_hash TEXT NOT NULL,
+    score REAL NOT NULL,
+    reason TEXT,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (abstract_hash, criteria_hash)
+);
+"""
+
+SYSTEM_MESSAGE = """You screen new arXiv papers for a reader interested in:
+{interests}
+
+Score every abstract from 0 (unrelated) to 10 (essential reading for this
+reader) and give a reason of at most ten words. Score each paper on its own."""
+
+RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "triage",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "scores": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "id": {"type": "integer"},
+                            "score": {"type": "integer"},
+                            "reason": {"type": "string"},
+                        },
+                        "required": ["id", "score", "reason"],
+                        "additionalProperties": False,
+                    },
+                }
+            },
+            "required": ["scores"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+
+class Triage:
+    def __init__(
+        self,
+        store: PaperStore,
+        client: Any,
+        model: str,
+        interests: List[str],
+        batch_size: int = 20,
+        max_abstract_chars: int = 1200,
+    ):
+        self.store = store
+        self.client = client
+        self.model = model
+        self.system_message = SYSTEM_MESSAGE.format(
+            interests="\n".join(f"- {interest}" for interest in interests)
+        )
+        self.criteria_hash = hashlib.sha256(
+            f"{model}\n{self.system_message}".encode("utf-8")
+        ).hexdigest()
+        self.batch_size = batch_size
+        self.max_abstract_chars = max_abstract_chars
+        with store.lock:
+            store.connection.executescript(SCHEMA)
+        self.scored = 0
+
+    def abstract_hash(self, paper: Dict[str, Any]) -> str:
+        return text_hash(f"{paper['title']}\n{paper['abstract']}")
+
+    def cached_scores(self, hashes: List[str]) -> Dict[str, float]:
+        with self.store.lock:
+            rows = self.store.connection.execute(
+                f"""SELECT abstract_hash, score FROM triage_scores
+                WHERE criteria_hash = ?
+                AND abstract_hash IN ({', '.join('?' for _ in hashes)})""",
+                [self.criteria_hash, *hashes],
+            ).fetchall()
+        return {row["abstract_hash"]: row["score"] for row in rows}
+
+    def score_batch(self, papers: List[Dict[str, Any]]) -> Dict[int, Dict[str, Any]]:
+        """Scores by position in `papers`, from one request."""
+        listing = "\n\n".join(
+            f"[{i}] {paper['title']}\n{paper['abstract'][: self.max_abstract_chars]}"
+            for i, paper in enumerate(papers)
+        )
+        content = get_gateway().complete(
+            self.client,
+            self.model,
+            self.system_message,
+            [{"role": "user", "content": listing}],
+            temperature=0,
+            # The answer is a few short fields per paper
+            max_tokens=40 * len(papers) + 50,
+            lane=LLM_LANE,
+            response_format=RESPONSE_FORMAT,
+        )[0]
+        return {
+            entry["id"]: entry
+            for entry in json.loads(content)["scores"]
+            if 0 <= entry["id"] < len(papers)
+        }
+
+    def scores(self, papers: List[Dict[str, Any]]) -> Dict[str, Optional[float]]:
+        """Score of each paper by arxiv_id; None where the model could not
+        score it, so the caller can decide how to treat unscored papers."""
+        hashes = {paper["arxiv_id"]: self.abstract_hash(paper) for paper in papers}
+        cached = self.cached_scores(list(set(hashes.values()))) if hashes else {}
+        missing = list(
+            {
+                hashes[paper["arxiv_id"]]: paper
+                for paper in papers
+                if hashes[paper["arxiv_id"]] not in cached
+            }.values()
+        )
+        for i in range(0, len(missing), self.batch_size):
+            batch = missing[i : i + self.batch_size]
+            try:
+                entries = self.score_batch(batch)
+            except Exception as e:
+                print(f"Triage of {len(batch)} abstracts failed: {e}")
+                continue
+            rows = [
+                (
+                    hashes[paper["arxiv_id"]],
+                    self.criteria_hash,
+                    float(entries[j]["score"]),
+                    entries[j]["reason"],
+                    time.time(),
+                )
+                for j, paper in enumerate(batch)
+                if j in entries
+            ]
+            with self.store.transaction() as db:
+                db.executemany(
+                    "INSERT OR REPLACE INTO triage_scores (abstract_hash, "
+                    "criteria_hash, score, reason, created_at) VALUES (?, ?, ?, ?, ?)",
+                    rows,
+                )
+            cached.update({row[0]: row[2] for row in rows})
+            self.scored += len(rows)
+        return {arxiv_id: cached.get(h) for arxiv_id, h in hashes.items()}
+
+
+def triage_enabled(config: Any) -> bool:
+    return config.getboolean("triage", "enabled", fallback=False)
+
+
+def get_triage(config: Any, interests: List[str]) -> Triage:
+    return Triage(
+        get_paper_store(config),
+        get_openai_client(config.get("openai", "api_key_location")),
+        config.get("triage", "model", fallback="gpt-4o-mini"),
+        interests,
+        config.getint("triage", "batch_size", fallback=20),
+        config.getint("triage", "max_abstract_chars", fallback=1200),
+    )
@@ -0,0 +1,257 @@
+import fcntl
+import hashlib
+import json
+import os
+import re
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+TTS_MODEL = "tts-1"
+TTS_VOICE = "alloy"
+# Longest input the speech endpoint accepts
+TTS_MAX_CHARS = 4096
+TTS_MAX_RETRIES = 2
+STREAM_MANIFEST = "streamed_segments.json"
+
+
+def synthesize_segment(client: Any, text: str, segment_file_path: Path) -> Path:
+    """Turn one piece of text into an MP3 file."""
+    # Speech requests bypass the LLM gateway, so the SDK retries them itself
+    response = client.with_options(max_retries=TTS_MAX_RETRIES).audio.speech.create(
+        model=TTS_MODEL, voice=TTS_VOICE, input=text
+    )
+    with open(segment_file_path, "wb") as f:
+        for chunk in response.iter_bytes():
+            f.write(chunk)
+    return segment_file_path
+
+
+# Text preparation: what gets spoken is the summary without markdown, with
+# long terms shortened, packed into as few requests as the limit allows.
+MARKDOWN_PATTERNS: List[Tuple[str, str]] = [
+    (r"!\[[^\]]*\]\([^)]*\)", ""),  # images
+    (r"!?\[\[(?:[^\]|]*\|)?([^\]]*)\]\]", r"\1"),  # Obsidian links and embeds
+    (r"\[([^\]]*)\]\([^)]*\)", r"\1"),  # links
+    (r"^\s*#+\s*(.+?)\s*#*$", r"\1."),  # headings, read as a sentence
+    (r"^\s*(?:[-*+]|\d+[.)])\s+", ""),  # list markers
+    (r"^\s*(?:[-*_]\s*){3,}$", ""),  # horizontal rules
+    (r"^\s*>\s?", ""),  # block quotes
+    (r"(?<!\w)(\*\*|__|\*|_|`+|~~)(?=\S)(.+?)(?<=\S)\1(?!\w)", r"\2"),  # emphasis, code
+    (r"https?://\S+", ""),  # bare URLs
+]
+COMPILED_MARKDOWN = [
+    (re.compile(pattern, re.MULTILINE), replacement)
+    for pattern, replacement in MARKDOWN_PATTERNS
+]
+SENTENCE_END = re.compile(r"(?<=[.!?:;])\s+(?=\S)")
+
+
+def strip_markdown(text: str) -> str:
+    for pattern, replacement in COMPILED_MARKDOWN:
+        text = pattern.sub(replacement, text)
+    text = re.sub(r"[ \t]+", " ", text)
+    return re.sub(r"\n\s*\n\s*", "\n\n", text).strip()
+
+
+class Replacements:
+    """Term replacements (e.g. "Large Language Model" to "LLM") applied in one
+    pass over the text. All terms are compiled into a single pattern, longest
+    first, so the longest term matching at a position wins and replaced text
+    is never matched again. A trailing plural "s" is kept."""
+
+    def __init__(self, terms: Dict[str, str]):
+        self.terms = terms
+        alternatives = "|".join(
+            re.escape(term) for term in sorted(terms, key=len, reverse=True)
+        )
+        self.pattern = (
+            re.compile(rf"(?<!\w)({alternatives})(s?)(?!\w)") if terms else None
+        )
+
+    def apply(self, text: str) -> str:
+        if self.pattern is None:
+            return text
+        return self.pattern.sub(
+            lambda match: self.terms[match.group(1)] + match.group(2), text
+        )
+
+
+@lru_cache(maxsize=None)
+def load_replacements(path: str) -> Replacements:
+    """The replacements in a JSON object of term to replacement; none if missing."""
+    if not path or not os.path.exists(path):
+        return Replacements({})
+    with open(path, encoding="utf-8") as f:
+        return Replacements(json.load(f))
+
+
+def replacements_from_config(config: Any) -> Replacements:
+    return load_replacements(
+        config.get("podcast", "replacements_path", fallback="config/replacements.json")
+    )
+
+
+def prepare_tts_text(text: str, replacements: Optional[Replacements] = None) -> str:
+    text = strip_markdown(text)
+    return replacements.apply(text) if replacements else text
+
+
+def split_long(sentence: str, limit: int) -> List[str]:
+    """Break a sentence longer than `limit` between words."""
+    pieces: List[str] = []
+    while len(sentence) > limit:
+        cut = sentence.rfind(" ", 0, limit + 1)
+        if cut <= 0:
+            cut = limit
+        pieces.append(sentence[:cut].rstrip())
+        sentence = sentence[cut:].lstrip()
+    return pieces + [sentence] if sentence else pieces
+
+
+def pack_sentences(text: str, limit: int = TTS_MAX_CHARS) -> List[str]:
+    """Greedily fill pieces of at most `limit` characters with whole sentences,
+    keeping paragraph breaks, so no text is lost and requests are few."""
+    pieces: List[str] = []
+    current = ""
+    for paragraph in re.split(r"\n\s*\n", text):
+        separator = "\n\n"
+        for sentence in SENTENCE_END.split(paragraph.strip()):
+            for part in split_long(sentence.strip(), limit):
+                if current and len(current) + len(separator) + len(part) <= limit:
+                    current += separator + part
+                else:
+                    if current:
+                        pieces.append(current)
+                    current = part
+                separator = " "
+    return pieces + [current] if current else pieces
+
+
+def section_hash(text: str) -> str:
+    return hashlib.sha256(text.strip().encode("utf-8")).hexdigest()
+
+
+class ParagraphSplitter:
+    """Collects streamed text and hands back each paragraph once it is complete."""
+
+    def __init__(self):
+        self.buffer = ""
+
+    def feed(self, text: str) -> List[str]:
+        self.buffer += text
+        *paragraphs, self.buffer = self.buffer.split("\n\n")
+        return [p for p in paragraphs if p.strip()]
+
+    def flush(self) -> List[str]:
+        rest, self.buffer = self.buffer, ""
+        return [rest] if rest.strip() else []
+
+
+class TTSWorker:
+    """Synthesizes paragraphs in the background while the text is still being
+    written. Segments are recorded per newsletter section (one paper's
+    summary), so the podcast step can reuse them in any order."""
+
+    def __init__(
+        self,
+        client: Any,
+        audio_path: Path,
+        max_workers: int = 2,
+        replacements: Optional[Replacements] = None,
+    ):
+        self.client = client
+        self.audio_path = audio_path
+        self.audio_path.mkdir(parents=True, exist_ok=True)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.replacements = replacements
+        self.futures: List[Future] = []
+        self.section_start = 0
+        self.sections: Dict[str, List[Future]] = {}
+        self.buffer = ""
+
+    def submit(self, text: str) -> None:
+        """Queue a paragraph; it is synthesized once enough text has built up
+        to fill a request, or when the section ends."""
+        text = prepare_tts_text(text, self.replacements)
+        if not text:
+            return
+        self.buffer = f"{self.buffer}\n\n{text}" if self.buffer else text
+        pieces = pack_sentences(self.buffer)
+        # The last piece may still have room for what comes next
+        for piece in pieces[:-1]:
+            self.synthesize(piece)
+        self.buffer = pieces[-1]
+
+    def synthesize(self, text: str) -> None:
+        path = self.audio_path / f"stream_segment_{uuid.uuid4().hex}.mp3"
+        self.futures.append(
+            self.executor.submit(synthesize_segment, self.client, text, path)
+        )
+
+    def end_section(self, text: str) -> None:
+        """Attribute the segments submitted since the last section to `text`."""
+        if self.buffer:
+            self.synthesize(self.buffer)
+            self.buffer = ""
+        self.sections[section_hash(text)] = self.futures[self.section_start :]
+        self.section_start = len(self.futures)
+
+    def discard_section(self) -> None:
+        """Drop the segments submitted since the last section, e.g. because
+        the text they voice was not finished."""
+        self.buffer = ""
+        self.section_start = len(self.futures)
+
+    def close(self, raise_errors: bool = False) -> None:
+        """Wait for the outstanding segments and add them to the manifest."""
+        self.executor.shutdown(wait=True)
+        sections: Dict[str, List[str]] = {}
+        errors: List[Exception] = []
+        for key, futures in self.sections.items():
+            try:
+                sections[key] = [future.result().name for future in futures]
+            except Exception as e:
+                errors.append(e)
+                print(
+                    f"Streaming TTS failed for a section, it will be voiced again: {e}"
+                )
+
+        # Several workers may add their sections at the same time
+        with open(self.audio_path / f"{STREAM_MANIFEST}.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            manifest = read_stream_manifest(self.audio_path)
+            manifest.update(sections)
+            temp_path = self.audio_path / f"{STREAM_MANIFEST}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(manifest, f)
+            os.replace(temp_path, self.audio_path / STREAM_MANIFEST)
+        print(f"Synthesized {len(self.futures)} audio segments")
+        if raise_errors and errors:
+            raise errors[0]
+
+
+def read_stream_manifest(audio_path: Path) -> Dict[str, List[str]]:
+    manifest_path = audio_path / STREAM_MANIFEST
+    if not manifest_path.exists():
+        return {}
+    with open(manifest_path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_streamed_segments(audio_path: Path) -> Dict[str, List[Path]]:
+    """Segments synthesized during summarization, by the hash of the section they voice."""
+    streamed = {}
+    for key, names in read_stream_manifest(audio_path).items():
+        paths = [audio_path / name for name in names]
+        if all(path.exists() for path in paths):
+            streamed[key] = paths
+    return streamed
+
+
+def discard_stream_manifest(audio_path: Path) -> None:
+    manifest_path = audio_path / STREAM_MANIFEST
+    if manifest_path.exists():
+        os.remove(manifest_path)
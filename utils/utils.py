@@ -1,14 +1,13 @@
 import os
-import csv
 import configparser
+import glob
 from typing import List, Dict, Any, Tuple, Optional
 import PyPDF2
 import subprocess
-import backoff
-import openai
 import json
-
-# from marker import Marker
+from utils.llm_gateway import get_adapter, get_gateway
+from utils.marker_service import convert_pdf as convert_pdf_with_marker, worker_count
+from utils.sections import PAGE_BREAK, strip_page_furniture, write_sections
 
 
 # Initialize configuration
@@ -23,6 +22,10 @@ def resolve_config() -> configparser.ConfigParser:
     return config
 
 
+def pipeline_steps(config: configparser.ConfigParser) -> List[str]:
+    return [step.strip() for step in config.get("pipeline", "steps").split(",")]
+
+
 # File Operations
 def save_file(filepath: str, content: str) -> None:
     """Save content to a file."""
@@ -54,38 +57,86 @@ def extract_text_from_pdf(pdf_path: str) -> str:
     try:
         with open(pdf_path, "rb") as file:
             pdf_reader: PyPDF2.PdfReader = PyPDF2.PdfReader(file)
-            paper: str = ""
+            pages: List[str] = []
             for page_num in range(len(pdf_reader.pages)):
                 page: PyPDF2.PageObject = pdf_reader.pages[page_num]
                 try:
-                    paper += page.extract_text()
+                    pages.append(page.extract_text())
                 except Exception as e:
                     print(f"Skipping page due to error: {e}")
                     continue
+            # Page breaks let running headers and footers be told apart
+            paper: str = f"\n{PAGE_BREAK}".join(pages)
         return paper[:176000] if len(paper) > 176000 else paper
     except PyPDF2.errors.PdfReadError as e:
         print(f"Error reading file {pdf_path}: {e}")
         return ""
 
 
-# CSV Operations
-def get_link(base_filename: str, csv_path: str) -> str:
-    """Get ArXiv URL for a given base filename from CSV."""
-    with open(csv_path, mode="r", newline="") as file:
-        reader: csv.DictReader = csv.DictReader(file)
-        for row in reader:
-            if row["ID"] == base_filename:
-                return row["ArXiv URL"]
-    return ""
+def extracted_text_path(pdf_path: str, text_folder: str) -> str:
+    base_filename = os.path.splitext(os.path.basename(pdf_path))[0]
+    return os.path.join(text_folder, f"{base_filename}.txt")
+
+
+def sections_path(pdf_path: str, text_folder: str) -> str:
+    base_filename = os.path.splitext(os.path.basename(pdf_path))[0]
+    return os.path.join(text_folder, f"{base_filename}.sections.json")
+
+
+def save_extracted_text(pdf_path: str, text_folder: str, text: str) -> None:
+    """Keep a PDF's text and section offsets in `text_folder` for later steps."""
+    text_path = extracted_text_path(pdf_path, text_folder)
+    os.makedirs(text_folder, exist_ok=True)
+    with open(f"{text_path}.tmp", "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(f"{text_path}.tmp", text_path)
+    write_sections(sections_path(pdf_path, text_folder), text)
+
 
+def extract_text_cached(
+    pdf_path: str,
+    text_folder: Optional[str] = None,
+    config: Optional[configparser.ConfigParser] = None,
+) -> str:
+    """Text of a PDF, reusing what was already saved to `text_folder` (by an
+    extract job, another step or another profile) and saving it there if not."""
+    if text_folder and os.path.exists(extracted_text_path(pdf_path, text_folder)):
+        return open_file(extracted_text_path(pdf_path, text_folder))
+    text = extract_paper_text(pdf_path, config)
+    if text_folder and text:
+        save_extracted_text(pdf_path, text_folder, text)
+    return text
 
-def read_papers_from_csv(input_file: str) -> List[Dict[str, Any]]:
-    """Read paper information from CSV file."""
-    papers: List[Dict[str, Any]] = []
-    with open(input_file, mode="r", newline="", encoding="utf-8") as file:
-        reader: csv.DictReader = csv.DictReader(file)
-        papers = [row for row in reader]
-    return papers
+
+def paper_pdf_path(config: configparser.ConfigParser, filename: str) -> str:
+    """A downloaded paper's PDF: in the summarize input folder, or else in
+    the download cache shared by all profiles."""
+    pdf_path = os.path.join(
+        config.get("summarize_papers", "input_folder"), f"{filename}.pdf"
+    )
+    pdf_cache = config.get("select_papers", "pdf_cache", fallback="")
+    if not os.path.exists(pdf_path) and pdf_cache:
+        return os.path.join(pdf_cache, f"{filename}.pdf")
+    return pdf_path
+
+
+def extract_paper_text(
+    pdf_path: str, config: Optional[configparser.ConfigParser] = None
+) -> str:
+    """Marker's markdown when `[marker] use_for_extraction` is on, else the
+    PyPDF2 text (without page furniture if `[extraction] strip_page_furniture`)."""
+    if config is not None and config.getboolean(
+        "marker", "use_for_extraction", fallback=False
+    ):
+        markdown = convert_pdf_with_marker(pdf_path, config)
+        if markdown is not None:
+            return markdown[:176000]
+    text = extract_text_from_pdf(pdf_path)
+    if config is not None and config.getboolean(
+        "extraction", "strip_page_furniture", fallback=False
+    ):
+        text = strip_page_furniture(text)
+    return text
 
 
 # Folder Operations
@@ -134,20 +185,53 @@ def compute_relevance_score(title: str, abstract: str, include_terms: List[str])
     )
 
 
-def convert_pdfs_to_markdown_with_marker(input_folder: str, output_folder: str) -> None:
-    """Convert PDFs in the specified folder to markdown using the marker CLI."""
-    # Ensure the output folder exists
+def convert_pdfs_to_markdown_with_marker(
+    input_folder: str,
+    output_folder: str,
+    config: Optional[configparser.ConfigParser] = None,
+    use_cache: bool = True,
+) -> None:
+    """Convert PDFs in the specified folder to markdown with marker, written
+    as `<output_folder>/<name>/<name>.md` like the marker CLI does.
+
+    Conversions go through the warm marker service (utils/marker_service.py)
+    and are cached by content hash; the CLI is the fallback when the service
+    cannot run."""
+    config = config or resolve_config()
     os.makedirs(output_folder, exist_ok=True)
 
+    failed: List[str] = []
+    for pdf_file in sorted(glob.glob(os.path.join(input_folder, "*.pdf"))):
+        base_filename = os.path.splitext(os.path.basename(pdf_file))[0]
+        markdown = convert_pdf_with_marker(pdf_file, config, use_cache)
+        if markdown is None:
+            failed.append(pdf_file)
+            continue
+        os.makedirs(os.path.join(output_folder, base_filename), exist_ok=True)
+        with open(
+            os.path.join(output_folder, base_filename, f"{base_filename}.md"),
+            "w",
+            encoding="utf-8",
+        ) as f:
+            f.write(markdown)
+    if not failed:
+        print(
+            f"Successfully converted PDFs in {input_folder} to markdown in {output_folder}."
+        )
+        return
+
     # Command to run the marker CLI
     command = [
         "marker",
         input_folder,
         output_folder,
         "--workers",
-        "4",  # Adjust the number of workers as needed
-        "--max",
-        "10",  # Adjust the maximum number of PDFs to convert
+        str(
+            worker_count(
+                config.getfloat("marker", "memory_per_worker_gb", fallback=4),
+                config.getint("marker", "max_workers", fallback=0),
+            )
+        ),
     ]
 
     try:
@@ -156,11 +240,10 @@ def convert_pdfs_to_markdown_with_marker(input_folder: str, output_folder: str)
         print(
             f"Successfully converted PDFs in {input_folder} to markdown in {output_folder}."
         )
-    except subprocess.CalledProcessError as e:
+    except (subprocess.CalledProcessError, FileNotFoundError) as e:
         print(f"An error occurred while converting PDFs: {e}")
 
 
-@backoff.on_exception(backoff.expo, (openai.RateLimitError, openai.APITimeoutError))
 def get_batch_responses_from_llm(
     msg: str,
     client: Any,
@@ -170,82 +253,44 @@ def get_batch_responses_from_llm(
     msg_history: Optional[List[Dict[str, str]]] = None,
     temperature: float = 0.75,
     n_responses: int = 1,
+    cache_prefix: Optional[str] = None,
+    lane: str = "default",
+    **params: Any,
 ) -> Tuple[List[str], List[List[Dict[str, str]]]]:
     if msg_history is None:
         msg_history = []
 
-    if model in [
-        "gpt-4o",
-        "gpt-4o-mini-2024-07-18",
-        "gpt-4o-2024-08-06",
-    ]:
-        new_msg_history = msg_history + [{"role": "user", "content": msg}]
-        response = client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": system_message},
-                *new_msg_history,
-            ],
+    adapter = get_adapter(model)
+    new_msg_history = msg_history + [adapter.user_message(msg, cache_prefix)]
+    gateway = get_gateway()
+
+    if cache_prefix and not adapter.supports_n and n_responses > 1:
+        # The first member goes alone so the others read its cache entry
+        content = gateway.complete(
+            client,
+            model,
+            system_message,
+            new_msg_history,
             temperature=temperature,
-            max_tokens=3000,
-            n=n_responses,
-            stop=None,
-            seed=0,
+            lane=lane,
+            **params,
         )
-        content = [r.message.content for r in response.choices]
-        new_msg_history = [
-            new_msg_history + [{"role": "assistant", "content": c}] for c in content
-        ]
-    elif model == "deepseek-coder-v2-0724":
-        new_msg_history = msg_history + [{"role": "user", "content": msg}]
-        response = client.chat.completions.create(
-            model="deepseek-coder",
-            messages=[
-                {"role": "system", "content": system_message},
-                *new_msg_history,
-            ],
-            temperature=temperature,
-            max_tokens=3000,
-            n=n_responses,
-            stop=None,
-        )
-        content = [r.message.content for r in response.choices]
-        new_msg_history = [
-            new_msg_history + [{"role": "assistant", "content": c}] for c in content
-        ]
-    elif model == "llama-3-1-405b-instruct":
-        new_msg_history = msg_history + [{"role": "user", "content": msg}]
-        response = client.chat.completions.create(
-            model="meta-llama/llama-3.1-405b-instruct",
-            messages=[
-                {"role": "system", "content": system_message},
-                *new_msg_history,
-            ],
-            temperature=temperature,
-            max_tokens=3000,
-            n=n_responses,
-            stop=None,
-        )
-        content = [r.message.content for r in response.choices]
-        new_msg_history = [
-            new_msg_history + [{"role": "assistant", "content": c}] for c in content
-        ]
-    elif "claude" in model:
-        content, new_msg_history = [], []
-        for _ in range(n_responses):
-            c, hist = get_response_from_llm(
-                msg,
-                client,
-                model,
-                system_message,
-                print_debug=False,
-                msg_history=None,
-                temperature=temperature,
-            )
-            content.append(c)
-            new_msg_history.append(hist)
+        n_responses -= 1
     else:
-        raise ValueError(f"Model {model} not supported.")
+        content = []
+    content += gateway.complete_many(
+        client,
+        model,
+        system_message,
+        new_msg_history,
+        n=n_responses,
+        temperature=temperature,
+        lane=lane,
+        **params,
+    )
+    new_msg_history = [
+        new_msg_history + [adapter.assistant_message(c)] for c in content
+    ]
 
     if print_debug:
         print()
@@ -259,7 +304,6 @@ def get_batch_responses_from_llm(
     return content, new_msg_history
 
 
-@backoff.on_exception(backoff.expo, (openai.RateLimitError, openai.APITimeoutError))
 def get_response_from_llm(
     msg: str,
     client: Any,
@@ -268,93 +312,33 @@ def get_response_from_llm(
     print_debug: bool = False,
     msg_history: Optional[List[Dict[str, str]]] = None,
     temperature: float = 0.75,
+    cache_prefix: Optional[str] = None,
+    lane: str = "default",
+    **params: Any,
 ) -> Tuple[str, List[Dict[str, str]]]:
+    """Send `msg` to `model` through the rate-limited LLM gateway.
+
+    `cache_prefix` is a leading part of `msg` that is identical across calls.
+    OpenAI caches repeated prefixes automatically; for Claude it is sent as its
+    own block with a cache breakpoint. `lane` names the calling pipeline step
+    for the gateway's priority and fair scheduling. Other keyword arguments
+    (e.g. `response_format`) are passed on to the provider's API.
+    """
     if msg_history is None:
         msg_history = []
 
-    if "claude" in model:
-        new_msg_history = msg_history + [
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": msg,
-                    }
-                ],
-            }
-        ]
-        response = client.messages.create(
-            model=model,
-            max_tokens=3000,
-            temperature=temperature,
-            system=system_message,
-            messages=new_msg_history,
-        )
-        content = response.content[0].text
-        new_msg_history = new_msg_history + [
-            {
-                "role": "assistant",
-                "content": [
-                    {
-                        "type": "text",
-                        "text": content,
-                    }
-                ],
-            }
-        ]
-    elif model in [
-        "gpt-4o",
-        "gpt-4o-mini-2024-07-18",
-        "gpt-4o-2024-08-06",
-    ]:
-        new_msg_history = msg_history + [{"role": "user", "content": msg}]
-        response = client.chat.completions.create(
-            model=model,
-            messages=[
-                {"role": "system", "content": system_message},
-                *new_msg_history,
-            ],
-            temperature=temperature,
-            max_tokens=3000,
-            n=1,
-            stop=None,
-            seed=0,
-        )
-        content = response.choices[0].message.content
-        new_msg_history = new_msg_history + [{"role": "assistant", "content": content}]
-    elif model == "deepseek-coder-v2-0724":
-        new_msg_history = msg_history + [{"role": "user", "content": msg}]
-        response = client.chat.completions.create(
-            model="deepseek-coder",
-            messages=[
-                {"role": "system", "content": system_message},
-                *new_msg_history,
-            ],
-            temperature=temperature,
-            max_tokens=3000,
-            n=1,
-            stop=None,
-        )
-        content = response.choices[0].message.content
-        new_msg_history = new_msg_history + [{"role": "assistant", "content": content}]
-    elif model in ["meta-llama/llama-3.1-405b-instruct", "llama-3-1-405b-instruct"]:
-        new_msg_history = msg_history + [{"role": "user", "content": msg}]
-        response = client.chat.completions.create(
-            model="meta-llama/llama-3.1-405b-instruct",
-            messages=[
-                {"role": "system", "content": system_message},
-                *new_msg_history,
-            ],
-            temperature=temperature,
-            max_tokens=3000,
-            n=1,
-            stop=None,
-        )
-        content = response.choices[0].message.content
-        new_msg_history = new_msg_history + [{"role": "assistant", "content": content}]
-    else:
-        raise ValueError(f"Model {model} not supported.")
+    adapter = get_adapter(model)
+    new_msg_history = msg_history + [adapter.user_message(msg, cache_prefix)]
+    content = get_gateway().complete(
+        client,
+        model,
+        system_message,
+        new_msg_history,
+        temperature=temperature,
+        lane=lane,
+        **params,
+    )[0]
+    new_msg_history = new_msg_history + [adapter.assistant_message(content)]
 
     if print_debug:
         print()
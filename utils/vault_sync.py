@@ -0,0 +1,232 @@
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Union
+
+# Copies notes and PDFs into the Obsidian vault, transferring only what is
+# new or changed. Every destination folder keeps a manifest with the hash
+# of each file the sync wrote there. A file is skipped when its source
+# still hashes the same, and left alone, with a warning, when it was edited
+# in the vault after the last sync. Files are written to a temporary name
+# and renamed into place, so Obsidian never sees half a file.
+
+SYNC_MANIFEST = ".vault_sync_manifest.json"
+# Linux ioctl that makes the destination share the source's blocks (btrfs,
+# XFS, and others that support reflinks)
+FICLONE = 0x40049409
+
+
+class SyncItem:
+    """One file to place at `destination`, from a source file or from text."""
+
+    def __init__(
+        self,
+        destination: str,
+        source_path: Optional[str] = None,
+        content: Optional[Union[str, bytes]] = None,
+        linkable: bool = False,
+    ):
+        self.destination = destination
+        self.source_path = source_path
+        self.content = content.encode("utf-8") if isinstance(content, str) else content
+        # Hardlinks are only used for files nobody edits in the vault, such
+        # as PDFs; a note edited in Obsidian would otherwise change the source
+        self.linkable = linkable
+        self.hash: Optional[str] = None
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def source_hash(path: str, sources: Dict[str, Any]) -> str:
+    """Hash of a source file, reusing the manifest's if size and mtime match."""
+    stat = os.stat(path)
+    cached = sources.get(path)
+    if cached and (cached["size"], cached["mtime_ns"]) == (
+        stat.st_size,
+        stat.st_mtime_ns,
+    ):
+        return cached["hash"]
+    digest = file_hash(path)
+    sources[path] = {
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "hash": digest,
+    }
+    return sources[path]["hash"]
+
+
+def clone_file(source: str, destination: str) -> None:
+    with open(source, "rb") as src, open(destination, "wb") as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+
+def place_file(item: SyncItem, link_mode: str) -> str:
+    """Write one item atomically; returns how it was transferred."""
+    temp_path = os.path.join(
+        os.path.dirname(item.destination),
+        f".{os.path.basename(item.destination)}.{os.getpid()}.tmp",
+    )
+    try:
+        method = "copied"
+        if item.content is not None:
+            with open(temp_path, "wb") as f:
+                f.write(item.content)
+            method = "written"
+        elif link_mode == "copy":
+            shutil.copyfile(item.source_path, temp_path)
+        else:
+            method = transfer_file(item, temp_path, link_mode)
+        os.replace(temp_path, item.destination)
+        return method
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def transfer_file(item: SyncItem, temp_path: str, link_mode: str) -> str:
+    """Reflink, then hardlink (if allowed), then a plain copy."""
+    if sys.platform.startswith("linux") and link_mode in ("auto", "reflink"):
+        try:
+            clone_file(item.source_path, temp_path)
+            return "cloned"
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+    if item.linkable and link_mode in ("auto", "hardlink"):
+        try:
+            os.link(item.source_path, temp_path)
+            return "linked"
+        except OSError:
+            pass
+    shutil.copyfile(item.source_path, temp_path)
+    return "copied"
+
+
+def read_manifest(folder: str) -> Dict[str, Any]:
+    try:
+        with open(os.path.join(folder, SYNC_MANIFEST), encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {"files": {}, "sources": {}}
+
+
+def write_manifest(folder: str, manifest: Dict[str, Any]) -> None:
+    temp_path = os.path.join(folder, f"{SYNC_MANIFEST}.tmp")
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(temp_path, os.path.join(folder, SYNC_MANIFEST))
+
+
+def sync_folder(
+    folder: str, items: List[SyncItem], link_mode: str, max_workers: int
+) -> Dict[str, Dict[str, int]]:
+    stats: Dict[str, int] = {}
+    results: Dict[str, str] = {}
+    with open(os.path.join(folder, f"{SYNC_MANIFEST}.lock"), "w") as lock:
+        # Summaries and cleanup may sync into the same folder at once
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        manifest = read_manifest(folder)
+        files: Dict[str, Any] = manifest["files"]
+
+        to_transfer: List[SyncItem] = []
+        for item in items:
+            name = os.path.basename(item.destination)
+            if item.content is not None:
+                item.hash = content_hash(item.content)
+            else:
+                item.hash = source_hash(item.source_path, manifest["sources"])
+            synced = files.get(name)
+            exists = os.path.exists(item.destination)
+            if (
+                exists
+                and item.source_path
+                and os.path.samefile(item.source_path, item.destination)
+            ):
+                # Hardlinked last time, so the vault already has the source
+                files[name] = {
+                    "hash": item.hash,
+                    "mtime_ns": os.stat(item.destination).st_mtime_ns,
+                }
+                results[item.destination] = "unchanged"
+                continue
+            if synced and exists and synced["hash"] == item.hash:
+                results[item.destination] = "unchanged"
+                continue
+            if exists and not synced and file_hash(item.destination) == item.hash:
+                # Already in a vault that predates the manifest
+                files[name] = {
+                    "hash": item.hash,
+                    "mtime_ns": os.stat(item.destination).st_mtime_ns,
+                }
+                results[item.destination] = "unchanged"
+                continue
+            if exists and (
+                not synced
+                or os.stat(item.destination).st_mtime_ns != synced["mtime_ns"]
+            ):
+                # Not written by us, or edited in the vault since we wrote it
+                print(f"Warning: {item.destination} was changed in the vault, skipping")
+                results[item.destination] = "conflict"
+                continue
+            to_transfer.append(item)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            methods = executor.map(
+                lambda item: place_file(item, link_mode), to_transfer
+            )
+            for item, method in zip(to_transfer, methods):
+                results[item.destination] = method
+                files[os.path.basename(item.destination)] = {
+                    "hash": item.hash,
+                    "mtime_ns": os.stat(item.destination).st_mtime_ns,
+                }
+        # Forget cached hashes of sources that are gone (cleanup deletes them)
+        manifest["sources"] = {
+            path: cached
+            for path, cached in manifest["sources"].items()
+            if os.path.exists(path)
+        }
+        write_manifest(folder, manifest)
+
+    for result in results.values():
+        stats[result] = stats.get(result, 0) + 1
+    return {"results": results, "stats": stats}
+
+
+def sync_to_vault(
+    items: List[SyncItem], link_mode: str = "auto", max_workers: int = 8
+) -> Dict[str, str]:
+    """Sync items into their destination folders; returns each destination's
+    outcome: unchanged, conflict, written, cloned, linked or copied."""
+    by_folder: Dict[str, List[SyncItem]] = {}
+    for item in items:
+        by_folder.setdefault(os.path.dirname(item.destination), []).append(item)
+
+    results: Dict[str, str] = {}
+    totals: Dict[str, int] = {}
+    for folder, folder_items in by_folder.items():
+        os.makedirs(folder, exist_ok=True)
+        synced = sync_folder(folder, folder_items, link_mode, max_workers)
+        results.update(synced["results"])
+        for key, count in synced["stats"].items():
+            totals[key] = totals.get(key, 0) + count
+    if totals:
+        print(
+            "Vault sync: "
+            + ", ".join(f"{n} {key}" for key, n in sorted(totals.items()))
+        )
+    return results
@@ -1,19 +1,44 @@
 import weaviate
-from weaviate.classes.config import Property, DataType, Configure
+from typing import Any, Optional
+from weaviate.classes.config import Property, DataType, Configure, ReferenceProperty
 from utils.utils import resolve_config
 
 config = resolve_config()
 weaviate_config = config["weaviate"]
 
-client = weaviate.connect_to_local(
-    port=weaviate_config["port"], grpc_port=weaviate_config["grpc_port"]
-)
+client = None
+# Set by the daemon, so the shared client stays connected between runs
+keep_shared_client = False
 
 
-def get_weaviate_client():
+def connect_weaviate(store_config: Optional[Any] = None) -> Any:
+    """Open a new client for the configured backend (`weaviate` or `memory`)."""
+    store_config = store_config or weaviate_config
+    if store_config.get("backend", "weaviate") == "memory":
+        from utils.memory_vector_store import connect_to_memory
+
+        return connect_to_memory()
+    return weaviate.connect_to_local(
+        port=store_config["port"], grpc_port=store_config["grpc_port"]
+    )
+
+
+def get_weaviate_client(store_config: Optional[Any] = None):
+    """Return the shared client, connecting on first use or after a close."""
+    global client
+    if client is None or not client.is_connected():
+        client = connect_weaviate(store_config)
     return client
 
 
+def release_client(released: Any) -> None:
+    """Close a client when a step is done with it, unless it is the shared
+    client and the daemon keeps it warm."""
+    if released is client and keep_shared_client:
+        return
+    released.close()
+
+
 def get_or_create_class(client: weaviate.Client, class_name: str):
     if not class_name in client.collections.list_all().keys():
         if class_name == weaviate_config.get("papers_class_name"):
@@ -30,6 +55,24 @@ def get_or_create_class(client: weaviate.Client, class_name: str):
                 ],
                 vectorizer_config=Configure.Vectorizer.text2vec_openai(),
             )
+        elif class_name == weaviate_config.get("chunks_class_name", "PaperChunks"):
+            # Passages of the full text, each pointing back at its paper
+            collection = client.collections.create(
+                name=class_name,
+                properties=[
+                    Property(name="arxiv_id", data_type=DataType.TEXT),
+                    Property(name="section", data_type=DataType.TEXT),
+                    Property(name="chunk_index", data_type=DataType.INT),
+                    Property(name="text", data_type=DataType.TEXT),
+                ],
+                references=[
+                    ReferenceProperty(
+                        name="paper",
+                        target_collection=weaviate_config.get("papers_class_name"),
+                    )
+                ],
+                vectorizer_config=Configure.Vectorizer.text2vec_openai(),
+            )
         else:
             raise ValueError(f"No default configuration for class {class_name}")
     else:
@@ -0,0 +1,95 @@
+import argparse
+import json
+import threading
+from configparser import ConfigParser
+from functools import partial
+from typing import Callable, Dict, List
+from utils.utils import resolve_config
+from utils.job_queue import JOB_KINDS, Job, get_job_queue, work
+from scripts.summarize_papers import job_handlers
+from scripts.perform_review import handle_review_job
+
+
+def build_handlers(
+    queue, config: ConfigParser, kinds: List[str]
+) -> Dict[str, Callable[[Job], None]]:
+    handlers = job_handlers(queue, config, [k for k in kinds if k != "review"])
+    if "review" in kinds:
+        handlers["review"] = partial(handle_review_job, config=config)
+    return handlers
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Pull pipeline jobs from the shared queue ([queue] in the config)"
+    )
+    parser.add_argument(
+        "--kinds",
+        default=",".join(JOB_KINDS),
+        help="comma-separated job kinds to take (default: all)",
+    )
+    parser.add_argument(
+        "--threads", type=int, default=1, help="jobs to run at once in this process"
+    )
+    parser.add_argument(
+        "--until-empty",
+        action="store_true",
+        help="exit once no job of these kinds is queued or running",
+    )
+    parser.add_argument("--stats", action="store_true", help="print queue counts")
+    parser.add_argument(
+        "--dead-letters", action="store_true", help="list dead-lettered jobs"
+    )
+    parser.add_argument(
+        "--requeue-dead", action="store_true", help="retry dead-lettered jobs"
+    )
+    args = parser.parse_args()
+
+    config = resolve_config()
+    queue = get_job_queue(config)
+    if args.stats:
+        print(json.dumps(queue.stats(), indent=2))
+        return
+    if args.dead_letters:
+        for job in queue.dead_letters():
+            print(f"{job['kind']} {job['payload']}: {job.get('error')}")
+        return
+    if args.requeue_dead:
+        print(f"Requeued {queue.requeue_dead()} jobs")
+        return
+
+    kinds = [kind.strip() for kind in args.kinds.split(",") if kind.strip()]
+    handlers = build_handlers(queue, config, kinds)
+    stop = threading.Event()
+    threads = [
+        threading.Thread(
+            target=work,
+            args=(queue, handlers),
+            kwargs={
+                "heartbeat_seconds": config.getfloat(
+                    "queue", "heartbeat_seconds", fallback=60
+                ),
+                "until_empty": args.until_empty,
+                "stop": stop,
+            },
+            daemon=True,
+        )
+        for _ in range(args.threads)
+    ]
+    print(f"Worker taking {', '.join(kinds)} jobs with {args.threads} threads")
+    for thread in threads:
+        thread.start()
+    try:
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(timeout=1)
+    except KeyboardInterrupt:
+        # Leases of unfinished jobs run out and other workers pick them up
+        print("Stopping after the current jobs...")
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+
+if __name__ == "__main__":
+    main()